@@ -0,0 +1,188 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from parsing.audio_processing import ANALYSIS_RATE, HOP_LENGTH
+from parsing.dataset import DIFFICULTY_DTYPE, PackedBeatmap
+from parsing.parse import Beatmap, Difficulty, HitObjectArrays, TimingPoints
+
+# Audio frame grid of the onset/tempo analysis and of parsing.audio_features
+FRAME_MS = 1000 * HOP_LENGTH / ANALYSIS_RATE
+
+# Beat divisors a hit object can be snapped to, smallest first
+SNAP_DIVISORS = np.array([1, 2, 3, 4, 6, 8, 12, 16])
+SNAP_TOLERANCE_MS = 2.0  # Object times are whole ms, so snapped objects are up to 1 ms off the exact beat fraction
+
+# Columns of object_features
+OBJECT_FEATURES = ['ioi', 'distance', 'bpm', 'sv', 'snap', 'circle', 'slider', 'spinner', 'new_combo']
+
+# Channels of frame_targets
+FRAME_FEATURES = ['onset', 'circle', 'slider', 'spinner', 'new_combo', 'x', 'y']
+
+# Columns of difficulty_vector, in Difficulty field order
+DIFFICULTY_FEATURES = list(DIFFICULTY_DTYPE.names)
+
+Map = Union[Beatmap, PackedBeatmap]
+
+def _unpack(beatmap: Map) -> Tuple[HitObjectArrays, TimingPoints, np.ndarray]:
+    """
+    Hit object arrays, timing points and difficulty vector of a parsed or packed map.
+    """
+    if isinstance(beatmap, PackedBeatmap):
+        difficulty = np.array([beatmap.difficulty[name] for name in DIFFICULTY_FEATURES], dtype=np.float32)
+        return beatmap.hit_objects, TimingPoints.from_numpy(beatmap.timing_points), difficulty
+    return beatmap.hitObjects.to_arrays(), beatmap.timingPoints, difficulty_vector(beatmap.difficulty)
+
+def difficulty_vector(difficulty: Difficulty) -> np.ndarray:
+    """
+    The Difficulty section as a float32 conditioning vector (see DIFFICULTY_FEATURES).
+    """
+    return np.array([getattr(difficulty, name) for name in DIFFICULTY_FEATURES], dtype=np.float32)
+
+def snap_divisors(timing_points: TimingPoints, times) -> np.ndarray:
+    """
+    Smallest divisor in SNAP_DIVISORS whose beat subdivision lies within
+    SNAP_TOLERANCE_MS of each timestamp, or 0 for unsnapped timestamps.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    phase = timing_points.beat_phase_at(times)[:, None] * SNAP_DIVISORS
+    beat_length = timing_points.beat_length_at(times)[:, None]
+    error_ms = np.abs(phase - np.round(phase)) * beat_length / SNAP_DIVISORS
+    snapped = error_ms <= SNAP_TOLERANCE_MS
+    return np.where(snapped.any(axis=1), SNAP_DIVISORS[np.argmax(snapped, axis=1)], 0)
+
+def object_features(beatmap: Map) -> np.ndarray:
+    """
+    Per hit object features of a map (see OBJECT_FEATURES), as a (hit objects, features) float32 array:
+    - ioi: ms since the previous object (0 for the first one)
+    - distance: osu!pixels from the previous object's position (0 for the first one)
+    - bpm, sv: BPM and slider velocity multiplier active at the object
+    - snap: beat divisor the object is snapped to (0 if unsnapped)
+    - circle, slider, spinner, new_combo: 0/1 flags
+    """
+    arrays, timing_points, _ = _unpack(beatmap)
+    features = np.zeros((len(arrays), len(OBJECT_FEATURES)), dtype=np.float32)
+    if len(arrays) == 0:
+        return features
+
+    times = arrays.time.astype(np.float64)
+    features[1:, 0] = np.diff(times)
+    features[1:, 1] = np.hypot(np.diff(arrays.x), np.diff(arrays.y))
+    features[:, 2] = timing_points.bpm_at(times)
+    features[:, 3] = timing_points.slider_velocity_at(times)
+    features[:, 4] = snap_divisors(timing_points, times)
+    features[:, 5] = arrays.is_circle
+    features[:, 6] = arrays.is_slider
+    features[:, 7] = arrays.is_spinner
+    features[:, 8] = arrays.new_combo
+    return features
+
+def batch_object_features(beatmaps: Sequence[Map]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    object_features of many maps, concatenated.
+
+    Returns:
+    - features: ndarray - (total hit objects, features) float32 array.
+    - offsets: ndarray - (maps + 1,) offsets; the rows of map i are features[offsets[i]:offsets[i + 1]].
+    """
+    per_map = [object_features(beatmap) for beatmap in beatmaps]
+    offsets = np.zeros(len(per_map) + 1, dtype=np.int64)
+    np.cumsum([len(features) for features in per_map], out=offsets[1:])
+    if not per_map:
+        return np.zeros((0, len(OBJECT_FEATURES)), dtype=np.float32), offsets
+    return np.concatenate(per_map), offsets
+
+def difficulty_vectors(beatmaps: Sequence[Map]) -> np.ndarray:
+    """
+    (maps, DIFFICULTY_FEATURES) float32 array of the maps' difficulty settings.
+    """
+    return np.array([_unpack(beatmap)[2] for beatmap in beatmaps], dtype=np.float32).reshape(-1, len(DIFFICULTY_FEATURES))
+
+def frame_targets(
+    beatmap: Map,
+    num_frames: Optional[int] = None,
+    frame_ms: float = FRAME_MS
+) -> np.ndarray:
+    """
+    The map rasterized onto the audio frame grid, as a (frames, FRAME_FEATURES) float32 array. Every hit object
+    sets the channels of the frame nearest to its time: onset, its type flags, new_combo, and its position scaled
+    to [0, 1]. Objects past the last frame are dropped.
+
+    Parameters:
+    - beatmap: Beatmap or PackedBeatmap - The map.
+    - num_frames: int - Length of the grid, normally the number of audio frames of the song (default is one frame
+      past the last object).
+    - frame_ms: float - Frame duration in ms (default is FRAME_MS).
+    """
+    arrays, _, _ = _unpack(beatmap)
+    frames = np.rint(arrays.time / frame_ms).astype(np.int64)
+    if num_frames is None:
+        num_frames = int(frames.max()) + 1 if len(frames) else 0
+
+    targets = np.zeros((num_frames, len(FRAME_FEATURES)), dtype=np.float32)
+    inside = (frames >= 0) & (frames < num_frames)
+    frames = frames[inside]
+    targets[frames, 0] = 1
+    targets[frames, 1] = arrays.is_circle[inside]
+    targets[frames, 2] = arrays.is_slider[inside]
+    targets[frames, 3] = arrays.is_spinner[inside]
+    targets[frames, 4] = arrays.new_combo[inside]
+    targets[frames, 5] = arrays.x[inside] / 512
+    targets[frames, 6] = arrays.y[inside] / 384
+    return targets
+
+def windows(
+    frames: np.ndarray,
+    length: int,
+    stride: int
+) -> np.ndarray:
+    """
+    Fixed-length windows over a (frames, channels) array, as a (windows, length, channels) read-only view: no data
+    is copied. A trailing partial window is dropped.
+    """
+    if len(frames) < length:
+        return np.zeros((0, length) + frames.shape[1:], dtype=frames.dtype)
+    view = np.lib.stride_tricks.sliding_window_view(frames, length, axis=0)[::stride]
+    return np.moveaxis(view, -1, 1)
+
+def batch_windows(
+    beatmaps: Sequence[Map],
+    length: int,
+    stride: Optional[int] = None,
+    num_frames: Optional[Sequence[int]] = None,
+    frame_ms: float = FRAME_MS
+) -> Dict[str, Union[List[np.ndarray], np.ndarray]]:
+    """
+    Training windows of a batch of maps. The frame targets of every map are computed once and windows are only
+    indexed, not materialized: window j is targets[map_index[j]][start_frame[j]:start_frame[j] + length], a view
+    the loader slices (like the audio features of AudioFeatures.window) when it builds a batch.
+
+    Parameters:
+    - beatmaps: Sequence of Beatmap or PackedBeatmap - The maps.
+    - length: int - Frames per window.
+    - stride: int - Frames between the starts of consecutive windows (default is `length`, i.e. no overlap).
+    - num_frames: Sequence[int] - Number of audio frames of every map's song (default is one past the last object).
+    - frame_ms: float - Frame duration in ms (default is FRAME_MS).
+
+    Returns:
+    - Dict with
+      - targets: List of (frames, FRAME_FEATURES) float32 frame targets, one per map.
+      - map_index: (windows,) index of the map each window comes from.
+      - start_frame: (windows,) first frame of each window, to slice the targets and matching audio features.
+      - difficulty: (windows, DIFFICULTY_FEATURES) conditioning vector of each window's map.
+    """
+    stride = stride or length
+    targets = [frame_targets(beatmap, num_frames[i] if num_frames is not None else None, frame_ms)
+               for i, beatmap in enumerate(beatmaps)]
+    # A trailing partial window is dropped, as in windows()
+    counts = np.array([max(0, (len(frames) - length) // stride + 1) for frames in targets], dtype=np.int64)
+    map_index = np.repeat(np.arange(len(targets), dtype=np.int64), counts)
+    first_window = np.repeat(np.cumsum(counts) - counts, counts)
+    return {
+        "targets": targets,
+        "map_index": map_index,
+        "start_frame": (np.arange(len(map_index), dtype=np.int64) - first_window) * stride,
+        "difficulty": difficulty_vectors(beatmaps)[map_index]
+    }
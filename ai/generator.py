@@ -0,0 +1,240 @@
+import copy
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from parsing.parse import (TIMING_POINT_DTYPE, Beatmap, Colours, Difficulty, Editor, Events, General, HitObjectArrays,
+                           HitObjects, Metadata, TimingPoints)
+
+PLAYFIELD = np.array([512, 384])
+MAX_SLIDER_LENGTH = 192  # osu!pixels; at most half the playfield height, so a slider always fits one way or the other
+SPINNER_GAP_BEATS = 8  # Gaps at least this long are filled with a spinner
+SPINNER_RECOVERY_BEATS = 2  # Time left between a spinner's end and the next object
+MAX_VISIBLE_OBJECTS = 8  # Objects approaching at once at most; with ApproachRate, bounds the density
+
+# Hit object type flags
+CIRCLE, SLIDER, NEW_COMBO, SPINNER = 1, 2, 4, 8
+
+class GeneratorSettings:
+    """
+    What to generate for one difficulty. The density and spacing follow the
+    Difficulty settings unless given explicitly.
+    """
+
+    def __init__(self,
+                 difficulty: Difficulty,
+                 version: str = "Generated",
+                 snap_divisor: Optional[int] = None,
+                 spacing: float = 1.0,
+                 slider_ratio: float = 0.4,
+                 seed: int = 0):
+        self.difficulty: Difficulty = difficulty
+        self.version: str = version
+        # Objects are snapped to 1/snap_divisor beats, so this bounds the density (default grows with OD)
+        self.snap_divisor: int = snap_divisor or (1 if difficulty.OverallDifficulty < 4 else
+                                                  2 if difficulty.OverallDifficulty < 7 else 4)
+        self.spacing: float = spacing  # Distance spacing: osu!pixels per beat, in units of SliderMultiplier * 100
+        self.slider_ratio: float = slider_ratio  # Share of the objects with room for a slider that become one
+        self.seed: int = seed
+
+def fit_beat_grid(
+    tempo: np.ndarray,
+    beat_times: np.ndarray
+):
+    """
+    A constant beat grid through the detected beats, by least squares.
+
+    Parameters:
+    - tempo: ndarray - Tempo in BPM, used as is if there are fewer than two beats.
+    - beat_times: ndarray - Beat times in seconds.
+
+    Returns:
+    - offset: float - Time of the first beat of the grid in ms (between 0 and one beat).
+    - beat_length: float - Beat duration in ms.
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64) * 1000
+    if len(beat_times) >= 2:
+        beat_length, offset = np.polyfit(np.arange(len(beat_times)), beat_times, 1)
+    else:
+        beat_length = 60000 / float(np.atleast_1d(tempo)[0])
+        offset = beat_times[0] if len(beat_times) else 0.0
+    return offset % beat_length, beat_length
+
+def timing_points(
+    offset: float,
+    beat_length: float,
+    meter: int = 4
+) -> TimingPoints:
+    points = np.array([(round(offset), beat_length, meter, 0, 0, 100, True, 0)], dtype=TIMING_POINT_DTYPE)
+    return TimingPoints.from_numpy(points)
+
+def preempt(approach_rate: float) -> float:
+    """
+    Time in ms an object is visible before it has to be hit, for an ApproachRate.
+    """
+    if approach_rate < 5:
+        return 1200 + 600 * (5 - approach_rate) / 5
+    return 1200 - 750 * (approach_rate - 5) / 5
+
+def circle_radius(circle_size: float) -> float:
+    """
+    Radius in osu!pixels of a hit circle, for a CircleSize.
+    """
+    return 54.4 - 4.48 * circle_size
+
+def _fold(positions: np.ndarray, margin: float = 0.0) -> np.ndarray:
+    # Reflect an unbounded walk back into the playfield, `margin` away from its edges (a triangle wave per axis)
+    size = PLAYFIELD - 2 * margin
+    return margin + size - np.abs(np.mod(positions - margin, 2 * size) - size)
+
+def generate_hit_objects(
+    onset_times: np.ndarray,
+    offset: float,
+    beat_length: float,
+    settings: GeneratorSettings,
+    meter: int = 4
+) -> HitObjectArrays:
+    """
+    Turn onsets into hit objects, with array operations only.
+
+    - Onsets are snapped to the 1/snap_divisor beat grid of the timing point (whose offset is written in whole
+      ms), and onsets landing on the same tick merged.
+    - Density follows ApproachRate: onsets are thinned so that objects are at least preempt / MAX_VISIBLE_OBJECTS
+      apart, keeping the first onset and then every first one far enough after the last kept.
+    - Gaps of at least SPINNER_GAP_BEATS become spinners; a random slider_ratio share of the objects with at
+      least two free ticks after them become sliders lasting half the gap; the rest are circles.
+    - Positions follow a random walk whose step grows with the time since the previous object (distance
+      snapping) and is at least a circle diameter, so that consecutive circles do not overlap. The walk is
+      reflected back into the playfield, a circle radius away from its edges. Sliders are straight, square to the
+      heading, and flipped per axis wherever they would leave that area. CircleSize sets the radius.
+    - A new combo starts on every measure with objects, and around spinners.
+
+    Parameters:
+    - onset_times: ndarray - Onset times in seconds.
+    - offset, beat_length: float - The beat grid in ms (see fit_beat_grid).
+    - settings: GeneratorSettings - The difficulty to generate.
+    - meter: int - Beats per measure (default is 4).
+    """
+    rng = np.random.default_rng(settings.seed)
+    difficulty = settings.difficulty
+    offset = round(offset)  # As written to the timing point, so that objects land on its ticks
+    tick = beat_length / settings.snap_divisor
+    ticks = np.unique(np.rint((np.asarray(onset_times, dtype=np.float64) * 1000 - offset) / tick).astype(np.int64))
+    ticks = ticks[offset + ticks * tick >= 0]
+
+    # Thin to the density ApproachRate allows: the chain of first ticks at least min_gap after the previous one,
+    # followed by pointer doubling as in parsing.audio_processing.measure_boundaries
+    min_gap = int(np.ceil(preempt(difficulty.ApproachRate) / MAX_VISIBLE_OBJECTS / tick))
+    if min_gap > 1:
+        jump = np.append(np.searchsorted(ticks, ticks + min_gap), len(ticks))
+        keep = np.zeros(len(ticks) + 1, dtype=bool)
+        keep[0] = True
+        for _ in range(len(ticks).bit_length()):
+            keep[jump[keep]] = True
+            jump = jump[jump]
+        ticks = ticks[keep[:-1]]
+    n = len(ticks)
+
+    arrays = HitObjectArrays(n)
+    if n == 0:
+        return arrays
+    times = np.rint(offset + ticks * tick).astype(np.int64)
+    gaps = np.append(np.diff(ticks), 0)  # In ticks; the last object has no gap after it
+    gap_beats = gaps / settings.snap_divisor
+
+    # Object types; sliders are short enough to fit one way or the other inside the margin
+    pixels_per_beat = difficulty.SliderMultiplier * 100
+    radius = circle_radius(difficulty.CircleSize)
+    max_length = min(MAX_SLIDER_LENGTH, (PLAYFIELD.min() - 2 * radius) / 2)
+    slider_ticks = np.minimum(gaps // 2, int(max_length / pixels_per_beat * settings.snap_divisor))
+    is_spinner = gap_beats >= SPINNER_GAP_BEATS
+    is_slider = ~is_spinner & (slider_ticks >= 1) & (rng.random(n) < settings.slider_ratio)
+    kind = np.select([is_spinner, is_slider], [SPINNER, SLIDER], CIRCLE)
+
+    # Positions: one heading per object, turning a little every step
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.6, n))
+    direction = np.stack([np.cos(heading), np.sin(heading)], axis=1)
+    step_beats = np.append(0, gap_beats[:-1])
+    distance = np.where(step_beats > 0, np.maximum(step_beats * pixels_per_beat * settings.spacing, 2 * radius), 0)
+    steps = direction * distance[:, None]
+    positions = np.rint(_fold(PLAYFIELD / 2 + np.cumsum(steps, axis=0), radius)).astype(np.int64)
+    positions[is_spinner] = PLAYFIELD // 2
+
+    # Straight sliders, flipped per axis wherever they would leave the playfield
+    length = slider_ticks / settings.snap_divisor * pixels_per_beat
+    turned = heading + rng.choice([-np.pi / 2, np.pi / 2], n)
+    vector = np.stack([np.cos(turned), np.sin(turned)], axis=1) * length[:, None]
+    end = positions + vector
+    outside = (end < radius) | (end > PLAYFIELD - radius)
+    end = np.rint(np.where(outside, positions - vector, end)).astype(np.int64)
+
+    # Combos
+    measure = np.floor_divide(ticks, settings.snap_divisor * meter)
+    new_combo = np.append(True, np.diff(measure) > 0) | is_spinner | np.append(False, is_spinner[:-1])
+
+    arrays.x = positions[:, 0].astype(np.int32)
+    arrays.y = positions[:, 1].astype(np.int32)
+    arrays.time = times.astype(np.int32)
+    arrays.type_flags = (kind | np.where(new_combo, NEW_COMBO, 0)).astype(np.uint8)
+    arrays.new_combo = new_combo
+    arrays.end_time = np.where(is_spinner, np.rint(offset + (ticks + gaps) * tick - SPINNER_RECOVERY_BEATS * beat_length),
+                               times).astype(np.int32)
+    arrays.slides = is_slider.astype(np.int16)
+    arrays.length = np.where(is_slider, length, 0.0)
+    arrays.curve_type = np.where(is_slider, b'L', b'').astype('S1')
+    np.cumsum(is_slider, out=arrays.curve_offsets[1:])
+    arrays.curve_points = end[is_slider].astype(np.int32)
+    return arrays
+
+def create_beatmaps(
+    onset_times: np.ndarray,
+    tempo: np.ndarray,
+    beat_times: np.ndarray,
+    settings: Sequence[GeneratorSettings],
+    audio_filename: str = "audio.mp3",
+    title: str = "",
+    artist: str = "",
+    creator: str = "BeatmapGenerator"
+) -> List[Beatmap]:
+    """
+    Generate several difficulties of one song from its audio analysis (the output of compute_tempo and the onset
+    detection). The beat grid is fitted once and shared by every difficulty.
+
+    Parameters:
+    - onset_times: ndarray - Onset times in seconds, e.g. all_onset_times or prioritized_onsets.
+    - tempo: ndarray - Tempo in BPM, from compute_tempo.
+    - beat_times: ndarray - Beat times in seconds, from compute_tempo.
+    - settings: Sequence[GeneratorSettings] - One entry per difficulty to generate.
+    - audio_filename, title, artist, creator: str - Written to the General and Metadata sections.
+
+    Returns:
+    - beatmaps: List[Beatmap] - One beatmap per settings entry, in order.
+    """
+    offset, beat_length = fit_beat_grid(tempo, beat_times)
+
+    beatmaps = []
+    for difficulty_settings in settings:
+        general = General()
+        general.AudioFilename = audio_filename
+        metadata = Metadata()
+        metadata.Title = metadata.TitleUnicode = title
+        metadata.Artist = metadata.ArtistUnicode = artist
+        metadata.Creator = creator
+        metadata.Version = difficulty_settings.version
+
+        hit_objects = HitObjects.from_arrays(generate_hit_objects(onset_times, offset, beat_length, difficulty_settings))
+        beatmaps.append(Beatmap(general, Editor(), metadata, copy.copy(difficulty_settings.difficulty), Events(),
+                                timing_points(offset, beat_length), Colours(), hit_objects))
+    return beatmaps
+
+def create_beatmap(
+    onset_times: np.ndarray,
+    tempo: np.ndarray,
+    beat_times: np.ndarray,
+    difficulty: Optional[Difficulty] = None,
+    **kwargs
+) -> Beatmap:
+    """
+    Generate a single difficulty; see create_beatmaps.
+    """
+    return create_beatmaps(onset_times, tempo, beat_times, [GeneratorSettings(difficulty or Difficulty())], **kwargs)[0]
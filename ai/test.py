@@ -0,0 +1,221 @@
+from ai.features import *
+from ai.generator import (MAX_VISIBLE_OBJECTS, GeneratorSettings, circle_radius, create_beatmap, create_beatmaps,
+                          fit_beat_grid, generate_hit_objects, preempt)
+from parsing.dataset import PackedBeatmaps, pack_files
+from parsing.parse import create_beatmap_from_file, create_beatmap_from_lines
+from parsing.writer import beatmap_to_string, write_beatmap
+import glob, os, tempfile, unittest
+
+DATA_MAPS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'test1', '*.osu')))
+
+# 120 BPM from 1000 ms, slider velocity x2 from 3000 ms
+SYNTHETIC_MAP = """osu file format v14
+
+[Difficulty]
+HPDrainRate:5
+CircleSize:4
+OverallDifficulty:8
+ApproachRate:9
+SliderMultiplier:1.4
+SliderTickRate:1
+
+[TimingPoints]
+1000,500,4,2,0,60,1,0
+3000,-50,4,2,0,60,0,0
+
+[HitObjects]
+256,192,1000,5,0,0:0:0:0:
+100,100,1167,2,0,L|200:100,1,100
+100,192,1250,1,0,0:0:0:0:
+256,192,3000,12,0,4000,0:0:0:0:
+"""
+
+class FeaturesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.synthetic = create_beatmap_from_lines(SYNTHETIC_MAP.splitlines())
+        cls.maps = [create_beatmap_from_file(path) for path in DATA_MAPS]
+
+    def test_snap_divisors(self):
+        times = [1000, 1250, 1167, 1125, 1063, 1010, 1500]
+        self.assertEqual(snap_divisors(self.synthetic.timingPoints, times).tolist(), [1, 2, 3, 4, 8, 0, 1])
+        self.assertEqual(len(snap_divisors(self.synthetic.timingPoints, [])), 0)
+
+    def test_object_features(self):
+        features = object_features(self.synthetic)
+        self.assertEqual(features.shape, (4, len(OBJECT_FEATURES)))
+        self.assertEqual(features.dtype, np.float32)
+        self.assertEqual(features[:, OBJECT_FEATURES.index('ioi')].tolist(), [0, 167, 83, 1750])
+        self.assertTrue(np.allclose(features[:, OBJECT_FEATURES.index('distance')],
+                                    [0, np.hypot(156, 92), 92, np.hypot(156, 0)]))
+        self.assertEqual(features[:, OBJECT_FEATURES.index('bpm')].tolist(), [120] * 4)
+        self.assertEqual(features[:, OBJECT_FEATURES.index('sv')].tolist(), [1, 1, 1, 2])
+        self.assertEqual(features[:, OBJECT_FEATURES.index('snap')].tolist(), [1, 3, 2, 1])
+        self.assertEqual(features[:, 5:].tolist(), [[1, 0, 0, 1], [0, 1, 0, 0], [1, 0, 0, 0], [0, 0, 1, 1]])
+
+    def test_packed_maps(self):
+        # A PackedBeatmap gives the same features as the Beatmap it was packed from
+        with tempfile.TemporaryDirectory() as directory:
+            pack_files(DATA_MAPS, directory, max_workers=1)
+            packed = PackedBeatmaps(directory)
+            for packed_map in packed:
+                beatmap = self.maps[DATA_MAPS.index(packed_map.source)]
+                self.assertTrue(np.array_equal(object_features(packed_map), object_features(beatmap)))
+                self.assertTrue(np.array_equal(frame_targets(packed_map), frame_targets(beatmap)))
+                self.assertTrue(np.array_equal(difficulty_vectors([packed_map]), difficulty_vectors([beatmap])))
+            del packed, packed_map
+
+    def test_batch_object_features(self):
+        features, offsets = batch_object_features([self.synthetic] + self.maps)
+        self.assertEqual(offsets[-1], len(features))
+        self.assertTrue(np.array_equal(features[offsets[0]:offsets[1]], object_features(self.synthetic)))
+        self.assertTrue(np.array_equal(features[offsets[-2]:offsets[-1]], object_features(self.maps[-1])))
+
+    def test_frame_targets(self):
+        targets = frame_targets(self.synthetic, frame_ms=10)
+        self.assertEqual(targets.shape, (301, len(FRAME_FEATURES)))
+        self.assertEqual(np.flatnonzero(targets[:, 0]).tolist(), [100, 117, 125, 300])
+        self.assertTrue(np.allclose(targets[117], [1, 0, 1, 0, 0, 100 / 512, 100 / 384]))
+        self.assertEqual(targets[300].tolist(), [1, 0, 0, 1, 1, 0.5, 0.5])
+        # Objects past the end of the grid are dropped
+        self.assertEqual(frame_targets(self.synthetic, num_frames=120, frame_ms=10)[:, 0].sum(), 2)
+
+    def test_windows(self):
+        frames = np.arange(20, dtype=np.float32).reshape(10, 2)
+        view = windows(frames, 4, 3)
+        self.assertEqual(view.shape, (3, 4, 2))  # The partial window at frame 9 is dropped
+        self.assertTrue(np.shares_memory(view, frames))
+        self.assertTrue(np.array_equal(view[1], frames[3:7]))
+        self.assertEqual(windows(frames, 11, 1).shape, (0, 11, 2))
+
+    def test_batch_windows(self):
+        beatmaps = [self.synthetic] + self.maps
+        batch = batch_windows(beatmaps, length=64, stride=48)
+        self.assertEqual(len(batch["targets"]), len(beatmaps))
+        self.assertEqual(len(batch["map_index"]), len(batch["start_frame"]))
+        self.assertEqual(batch["difficulty"].shape, (len(batch["map_index"]), len(DIFFICULTY_FEATURES)))
+
+        for i, beatmap in enumerate(beatmaps):
+            targets = frame_targets(beatmap)
+            self.assertTrue(np.array_equal(batch["targets"][i], targets))
+            expected = windows(targets, 64, 48)
+            starts = batch["start_frame"][batch["map_index"] == i]
+            self.assertEqual(len(starts), len(expected))
+            for start, window in zip(starts, expected):
+                self.assertTrue(np.array_equal(batch["targets"][i][start:start + 64], window))
+            self.assertTrue(np.array_equal(batch["difficulty"][batch["map_index"] == i],
+                                           np.repeat(difficulty_vectors([beatmap]), len(starts), axis=0)))
+
+        # Songs shorter than a window have none, and the grid can be set to the song length
+        short = batch_windows([self.synthetic], length=64, num_frames=[50])
+        self.assertEqual(len(short["map_index"]), 0)
+        self.assertEqual(len(short["targets"][0]), 50)
+        self.assertEqual(len(batch_windows([], length=64)["map_index"]), 0)
+
+class GeneratorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        # Two minutes at 150 BPM (400 ms beats) from 250 ms, with a 10 s break in the middle
+        cls.beat_times = 0.25 + np.arange(300) * 0.4
+        onsets = np.sort(rng.uniform(0, 120, 600))
+        cls.onsets = onsets[(onsets < 50) | (onsets > 60)]
+        cls.difficulty = Difficulty()
+        cls.difficulty.OverallDifficulty = 8
+        cls.difficulty.ApproachRate = 9
+        cls.difficulty.SliderMultiplier = 1.4
+
+    def test_fit_beat_grid(self):
+        offset, beat_length = fit_beat_grid([150], self.beat_times + 2.0)
+        self.assertAlmostEqual(beat_length, 400)
+        self.assertAlmostEqual(offset, 250)
+
+    def test_snapping(self):
+        settings = GeneratorSettings(self.difficulty, snap_divisor=4)
+        # 1003 and 1010 ms both snap to the 1000 ms tick and are merged; 1060 snaps to 1100
+        arrays = generate_hit_objects(np.array([1.003, 1.010, 1.060, 2.0]), 0.0, 400.0, settings)
+        self.assertEqual(arrays.time.tolist(), [1000, 1100, 2000])
+
+        arrays = generate_hit_objects(self.onsets, 250.0, 400.0, settings)
+        self.assertTrue(np.all(np.diff(arrays.time) > 0))
+        ticks = (arrays.time - 250) / 100
+        self.assertTrue(np.allclose(ticks, np.round(ticks), atol=0.01))
+
+        # Objects are snapped to the ticks of the timing point, whose offset is written in whole ms
+        tick = 400 / 3
+        arrays = generate_hit_objects(self.onsets, 250.4, 400.0, GeneratorSettings(self.difficulty, snap_divisor=3))
+        self.assertEqual(arrays.time.tolist(), np.rint(250 + np.round((arrays.time - 250) / tick) * tick).tolist())
+
+    def test_approach_rate(self):
+        # Lower ApproachRates keep objects further apart, at most MAX_VISIBLE_OBJECTS of them approaching at once
+        counts = []
+        for approach_rate in [10, 9, 5, 0]:
+            difficulty = Difficulty()
+            difficulty.OverallDifficulty = 8
+            difficulty.ApproachRate = approach_rate
+            arrays = generate_hit_objects(self.onsets, 250.0, 400.0, GeneratorSettings(difficulty, snap_divisor=4))
+            self.assertTrue(np.all(np.diff(arrays.time) >= preempt(approach_rate) / MAX_VISIBLE_OBJECTS - 1))
+            counts.append(len(arrays))
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertGreater(counts[0], counts[-1])
+
+    def test_circle_size(self):
+        for circle_size in [0, 4, 7]:
+            difficulty = Difficulty()
+            difficulty.CircleSize = circle_size
+            radius = circle_radius(circle_size)
+            arrays = generate_hit_objects(self.onsets, 250.0, 400.0, GeneratorSettings(difficulty, spacing=0.1))
+            # Circles stay a radius away from the edges, and sliders end there too
+            circles = ~arrays.is_spinner
+            self.assertTrue(np.all((arrays.x[circles] >= radius - 1) & (arrays.x[circles] <= 512 - radius + 1)))
+            self.assertTrue(np.all((arrays.y[circles] >= radius - 1) & (arrays.y[circles] <= 384 - radius + 1)))
+            self.assertTrue(np.all((arrays.curve_points >= radius - 1) & (arrays.curve_points <= [513 - radius, 385 - radius])))
+            # Consecutive objects do not overlap, even with a tiny distance spacing
+            positions = np.stack([arrays.x, arrays.y], axis=1)[circles]
+            self.assertGreater(np.median(np.linalg.norm(np.diff(positions, axis=0), axis=1)), 2 * radius - 1)
+
+    def test_playfield(self):
+        for spacing in [0.5, 1.0, 4.0]:
+            arrays = generate_hit_objects(self.onsets, 250.0, 400.0, GeneratorSettings(self.difficulty, spacing=spacing))
+            self.assertTrue(np.all((arrays.x >= 0) & (arrays.x <= 512) & (arrays.y >= 0) & (arrays.y <= 384)))
+            self.assertTrue(np.all((arrays.curve_points >= 0) & (arrays.curve_points <= [512, 384])))
+            # The break becomes a spinner in the middle of the playfield, ending before the next object
+            spinners = np.flatnonzero(arrays.is_spinner)
+            self.assertGreater(len(spinners), 0)
+            self.assertTrue(np.all(arrays.x[spinners] == 256) and np.all(arrays.y[spinners] == 192))
+            self.assertTrue(np.all(arrays.end_time[spinners] > arrays.time[spinners]))
+            followed = spinners[spinners + 1 < len(arrays)]
+            self.assertTrue(np.all(arrays.end_time[followed] < arrays.time[followed + 1]))
+            self.assertTrue(arrays.new_combo[spinners].all())
+
+    def test_seed(self):
+        generated = [beatmap_to_string(create_beatmaps(self.onsets, [150], self.beat_times,
+                                                       [GeneratorSettings(self.difficulty, seed=seed)])[0])
+                     for seed in [1, 1, 2]]
+        self.assertEqual(generated[0], generated[1])
+        self.assertNotEqual(generated[0], generated[2])
+        self.assertEqual(beatmap_to_string(create_beatmap(self.onsets, [150], self.beat_times)),
+                         beatmap_to_string(create_beatmap(self.onsets, [150], self.beat_times)))
+
+    def test_round_trip(self):
+        settings = [GeneratorSettings(self.difficulty, version="Hard", seed=3),
+                    GeneratorSettings(Difficulty(), version="Normal", slider_ratio=0.8)]
+        beatmaps = create_beatmaps(self.onsets, [150], self.beat_times, settings, title="Song", artist="Artist")
+        self.assertEqual([beatmap.metadata.Version for beatmap in beatmaps], ["Hard", "Normal"])
+        self.assertGreater(len(beatmaps[0].hitObjects.to_arrays()), len(beatmaps[1].hitObjects.to_arrays()))
+
+        with tempfile.TemporaryDirectory() as directory:
+            for beatmap in beatmaps:
+                path = os.path.join(directory, "generated.osu")
+                write_beatmap(beatmap, path)
+                parsed = create_beatmap_from_file(path)
+                self.assertEqual(parsed.metadata.Title, "Song")
+                self.assertEqual(parsed.difficulty.to_dict(), beatmap.difficulty.to_dict())
+                self.assertEqual(parsed.timingPoints.timing_points, beatmap.timingPoints.timing_points)
+                for name, column in beatmap.hitObjects.to_arrays().to_dict().items():
+                    self.assertTrue(np.array_equal(getattr(parsed.hitObjects.to_arrays(), name), column), name)
+                # Generated maps are ready for the training features too
+                self.assertEqual(len(object_features(parsed)), len(parsed.hitObjects.to_arrays()))
+
+if __name__ == "__main__":
+    unittest.main()
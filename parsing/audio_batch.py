@@ -0,0 +1,313 @@
+import argparse, hashlib, json, multiprocessing, os, shutil, sys, tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import soundfile
+from audioread.exceptions import DecodeError
+
+from parsing.audio_processing import (AudioBuffer, can_stream, compute_onsets_streaming, compute_tempo,
+                                      compute_tempo_streaming, measure_prioritization, save_stems, separate,
+                                      separate_streaming)
+from parsing.instrumentation import PipelineReport, StageRecord
+
+class SongResult:
+    def __init__(self,
+                 path: str,
+                 result_path: str,
+                 error: Optional[str] = None,
+                 attempts: int = 0,
+                 skipped: bool = False):
+        self.path: str = path
+        self.result_path: str = result_path  # Per-song JSON, only written on success
+        self.error: Optional[str] = error  # "ExceptionType: message" of the last attempt if the song failed
+        self.attempts: int = attempts  # Number of failed attempts, retries included
+        self.skipped: bool = skipped  # The result already existed from an earlier run
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def read_manifest(manifest_path: str) -> List[str]:
+    """
+    Audio file paths listed in a manifest, one per line. Blank lines and lines
+    starting with '#' are ignored; relative paths are relative to the manifest.
+    """
+    root = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        lines = [line.strip() for line in file]
+    return [os.path.join(root, line) for line in lines if line and not line.startswith('#')]
+
+def song_id(path: str) -> str:
+    """
+    File name of a song's results: its name plus a hash of its path, since osu!
+    song folders all call their audio file audio.mp3.
+    """
+    path = os.path.abspath(path)
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=6).hexdigest()
+    return f"{os.path.splitext(os.path.basename(path))[0]}-{digest}"
+
+def _write_json(path: str, data: dict):
+    # Atomic, so an interrupted run never leaves a truncated result behind
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+# Errors that come out the same on every attempt (unreadable or missing files, bad input), so retrying is pointless.
+# Anything else, a crashed worker included, may be transient and is retried.
+PERMANENT_ERRORS = (ValueError, TypeError, LookupError, FileNotFoundError, IsADirectoryError, NotADirectoryError,
+                    DecodeError)
+
+def _describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+def _separate_job(
+    path: str,
+    stems_dir: str,
+    stems: int
+) -> Tuple[List[StageRecord], Optional[str], bool]:
+    """
+    Heavy stage: separate a song into stems_dir. Stems are written to a partial
+    directory first, so a complete stems_dir can be reused after an interruption.
+    Songs libsndfile cannot stream (mp4/m4a) are decoded and separated whole.
+    Failures are returned rather than raised, so the timing of a failed attempt
+    reaches the report too, along with whether the error is worth retrying.
+    """
+    report = PipelineReport()
+    if os.path.isdir(stems_dir):
+        return report.records, None, False
+    partial_dir = stems_dir + '.partial'
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    try:
+        with report.stage(path, 'separate') as record:
+            if can_stream(path):
+                record.audio_s = separate_streaming(path, partial_dir, num_stems=stems)
+            else:
+                audio = AudioBuffer.load(path)
+                record.audio_s = audio.duration
+                save_stems(separate(audio.waveform, stems), partial_dir)
+        os.replace(partial_dir, stems_dir)
+    except BaseException as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        if not isinstance(e, Exception):
+            raise
+        return report.records, _describe(e), not isinstance(e, PERMANENT_ERRORS)
+    return report.records, None, False
+
+def _stems_duration(stems_dir: str) -> float:
+    # Stems are wav files of the whole song, which soundfile reads whatever the source format was
+    stem = next(file for file in sorted(os.listdir(stems_dir)) if file.endswith('.wav'))
+    return soundfile.info(os.path.join(stems_dir, stem)).duration
+
+def _analyse_job(
+    path: str,
+    stems_dir: str,
+    result_path: str,
+    stems: int,
+    top_k: int,
+    keep_stems: bool,
+    duration: Optional[float] = None
+) -> Tuple[List[StageRecord], Optional[str], bool]:
+    """
+    Light stage: tempo, onsets and prioritized onsets of a separated song, written to result_path. `duration` is
+    the one measured by the separation stage (read from the stems when they come from an earlier run). The tempo
+    of a song libsndfile cannot stream is computed from the whole decoded song.
+    """
+    report = PipelineReport()
+    try:
+        if duration is None:
+            duration = _stems_duration(stems_dir)
+        with report.stage(path, 'tempo', duration):
+            tempo, beat_times = compute_tempo_streaming(path) if can_stream(path) else compute_tempo(path)
+        with report.stage(path, 'onsets', duration):
+            all_onset_times, onset_times_by_track = compute_onsets_streaming(stems_dir, return_by_track=True)
+        with report.stage(path, 'prioritize', duration):
+            prioritized_onsets = measure_prioritization(tempo, beat_times, all_onset_times, top_k=top_k)
+
+        _write_json(result_path, {
+            "path": os.path.abspath(path),
+            "stems": stems,
+            "tempo": tempo.tolist(),
+            "beat_times": beat_times.tolist(),
+            "onset_times": {instrument: times.tolist() for instrument, times in onset_times_by_track.items()},
+            "prioritized_onsets": prioritized_onsets
+        })
+    except Exception as e:
+        return report.records, _describe(e), not isinstance(e, PERMANENT_ERRORS)
+    if not keep_stems:
+        shutil.rmtree(stems_dir, ignore_errors=True)
+    return report.records, None, False
+
+def run_batch(
+    paths: Iterable[str],
+    output_dir: str,
+    work_dir: Optional[str] = None,
+    stems: int = 4,
+    top_k: int = 1,
+    separation_workers: int = 1,
+    analysis_workers: Optional[int] = None,
+    retries: int = 2,
+    keep_stems: bool = False,
+    report: Optional[PipelineReport] = None,
+    max_pending: Optional[int] = None
+) -> Iterator[SongResult]:
+    """
+    Run the audio pipeline over many songs. Separation runs on a few heavy worker processes (each loads its own
+    Spleeter model), tempo and onset detection on lighter ones, and songs flow from one pool to the other as
+    soon as their stems are written. A worker killed mid-song (out of memory on a very long song, a crash in
+    native code) breaks its pool: the pool is recreated, and every song it had in flight is resubmitted, the crash
+    counting as one failed attempt for each.
+
+    Parameters:
+    - paths: Iterable[str] - The audio files to process. Consumed lazily, as separation slots free up.
+    - output_dir: str - Where the per-song JSON results (output_dir/<song_id>.json) are written.
+    - work_dir: str - Where stems are kept between the two stages (default is output_dir/stems).
+    - stems: int - The number of stems to separate the audio into (default is 4).
+    - top_k: int - Number of onsets kept per measure (default is 1).
+    - separation_workers: int - Number of separation processes (default is 1).
+    - analysis_workers: int - Number of analysis processes (default is the number of CPUs).
+    - retries: int - How many times a failed stage is retried before the song is given up on (default is 2).
+      Errors in PERMANENT_ERRORS (unreadable files, bad input) fail the song at once.
+    - keep_stems: bool - Keep the separated stems in work_dir once a song is done (default is False).
+    - report: PipelineReport - Optional report that receives the stage timings measured in the workers, failed
+      attempts included (with their error).
+    - max_pending: int - Maximum number of songs waiting for or in separation (default is twice the number of
+      separation workers). New songs are only submitted once earlier ones are separated.
+
+    Returns:
+    - Iterator[SongResult] - One result per song, in completion order. Songs whose JSON result already exists are
+      skipped, so an interrupted run resumes where it stopped; failed songs carry `error` instead of raising.
+    """
+    work_dir = work_dir or os.path.join(output_dir, 'stems')
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(work_dir, exist_ok=True)
+    analysis_workers = analysis_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * separation_workers
+    songs = iter(paths)
+    failures = {}
+
+    # TensorFlow does not survive fork() once initialised, so workers are spawned
+    context = multiprocessing.get_context('spawn')
+    workers = {'separate': separation_workers, 'analyse': analysis_workers}
+    pools = {stage: ProcessPoolExecutor(count, mp_context=context) for stage, count in workers.items()}
+
+    def submit(path: str, stage: str, duration: Optional[float] = None) -> Future:
+        stems_dir = os.path.join(work_dir, song_id(path))
+        if stage == 'separate':
+            job = (_separate_job, path, stems_dir, stems)
+        else:
+            job = (_analyse_job, path, stems_dir, os.path.join(output_dir, song_id(path) + '.json'), stems, top_k,
+                   keep_stems, duration)
+        try:
+            future = pools[stage].submit(*job)
+        except BrokenProcessPool:
+            # Broke since its last result came in; its in-flight songs come back as failed attempts
+            restart(stage, pools[stage])
+            future = pools[stage].submit(*job)
+        pending[future] = (path, stage, duration, pools[stage])
+        return future
+
+    def restart(stage: str, broken: ProcessPoolExecutor):
+        if pools[stage] is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            pools[stage] = ProcessPoolExecutor(workers[stage], mp_context=context)
+
+    pending = {}  # future -> (path, stage, duration, pool)
+    separating = 0
+
+    def fill() -> Iterator[SongResult]:
+        # Submit songs until max_pending of them are in separation, yielding the ones already done
+        nonlocal separating
+        while separating < max_pending:
+            path = next(songs, None)
+            if path is None:
+                return
+            result_path = os.path.join(output_dir, song_id(path) + '.json')
+            if os.path.exists(result_path):
+                yield SongResult(path, result_path, skipped=True)
+            else:
+                submit(path, 'separate')
+                separating += 1
+
+    try:
+        yield from fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, stage, duration, pool = pending.pop(future)
+                result_path = os.path.join(output_dir, song_id(path) + '.json')
+
+                # A job returns its own failures; an exception here means a worker died and broke its pool
+                if future.exception() is not None:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        restart(stage, pool)
+                    records, error, retry = [], _describe(future.exception()), True
+                else:
+                    records, error, retry = future.result()
+                if report is not None:
+                    for record in records:
+                        report.add(record)
+
+                if error is None:
+                    if stage == 'separate':
+                        separating -= 1
+                        duration = next((record.audio_s for record in records if record.stage == 'separate'), None)
+                        submit(path, 'analyse', duration)
+                    else:
+                        yield SongResult(path, result_path, attempts=failures.get(path, 0))
+                    continue
+
+                failures[path] = failures.get(path, 0) + 1
+                if retry and failures[path] <= retries:
+                    submit(path, stage, duration)
+                else:
+                    separating -= stage == 'separate'
+                    yield SongResult(path, result_path, error=error, attempts=failures[path])
+            yield from fill()
+    finally:
+        for pool in pools.values():
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate, beat track and detect onsets of many songs.")
+    parser.add_argument("manifest", help="Text file listing one audio file per line")
+    parser.add_argument("output_dir", help="Directory for the per-song JSON results")
+    parser.add_argument("--work-dir", help="Directory for the intermediate stems (default: OUTPUT_DIR/stems)")
+    parser.add_argument("--stems", type=int, default=4, choices=[2, 4, 5])
+    parser.add_argument("--top-k", type=int, default=1, help="Onsets kept per measure")
+    parser.add_argument("--separation-workers", type=int, default=1)
+    parser.add_argument("--analysis-workers", type=int, default=None)
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Songs waiting for or in separation at once (default: twice the separation workers)")
+    parser.add_argument("--keep-stems", action="store_true")
+    parser.add_argument("--report", help="Write the per-song, per-stage timings to this JSON file")
+    parser.add_argument("--log", help="Append every stage timing to this JSON lines file as it finishes")
+    args = parser.parse_args()
+
+    paths = read_manifest(args.manifest)
+    report = PipelineReport(args.log)
+    failed = 0
+    for done, result in enumerate(run_batch(paths, args.output_dir, args.work_dir, args.stems, args.top_k,
+                                            args.separation_workers, args.analysis_workers, args.retries,
+                                            args.keep_stems, report, args.max_pending), start=1):
+        status = "skipped" if result.skipped else "ok" if result.ok else f"FAILED ({result.error})"
+        print(f"[{done}/{len(paths)}] {result.path}: {status}", flush=True)
+        failed += not result.ok
+
+    print(f"{len(paths) - failed}/{len(paths)} songs processed")
+    for name, totals in report.summary().items():
+        rtf = f"{totals['real_time_factor']:.3f}x real time" if totals['real_time_factor'] is not None else "n/a"
+        print(f"    {name}: {totals['wall_s']:.1f} s wall, {totals['cpu_s']:.1f} s CPU, {rtf}")
+    if args.report:
+        report.write_json(args.report)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import functools, hashlib, importlib.metadata, json
+from typing import Callable, Dict, Optional
+
+import librosa
+import numpy as np
+from numpy import ndarray
+
+from parsing.audio_processing import (ANALYSIS_RATE, HOP_LENGTH, SAMPLING_RATE, AudioBuffer, compute_onsets_from_stems,
+                                      compute_tempo, measure_prioritization, separate)
+from parsing.cache import DiskCache
+
+# Bump whenever a change to the audio stages alters their output
+AUDIO_CACHE_VERSION = 1
+
+# Stages computed from the separated stems, whose output also depends on the spleeter release (and its models)
+SEPARATED_STAGES = {'separate', 'onsets'}
+
+@functools.lru_cache(maxsize=None)
+def spleeter_version() -> Optional[str]:
+    """
+    Installed spleeter version, or None if it is not installed. Read from the package metadata, so spleeter (and
+    TensorFlow) are not imported.
+    """
+    try:
+        return importlib.metadata.version('spleeter')
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+class AudioCache:
+    """
+    Disk cache of the expensive audio stages (separated stems, tempo/beats and
+    onsets). Entries are keyed by the hash of the audio file contents plus the
+    stage name and its parameters, so a stage is only recomputed when its
+    inputs change. The directory is bounded to `max_bytes` by evicting the
+    least recently used entries.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 8 << 30):
+        self.cache: DiskCache = DiskCache(directory, max_bytes, suffix='.npz')
+
+    @staticmethod
+    def audio_hash(filename: str) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        with open(filename, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def key(audio_hash: str, stage: str, params: dict) -> str:
+        description = {
+            "audio": audio_hash,
+            "stage": stage,
+            "params": params,
+            "version": AUDIO_CACHE_VERSION,
+            "librosa": librosa.__version__
+        }
+        if stage in SEPARATED_STAGES:
+            description["spleeter"] = spleeter_version()
+        description = json.dumps(description, sort_keys=True)
+        return hashlib.blake2b(description.encode('utf-8'), digest_size=20).hexdigest()
+
+    def stage(
+        self,
+        audio_hash: str,
+        stage: str,
+        params: dict,
+        compute: Callable[[], Dict[str, ndarray]]
+    ) -> Dict[str, ndarray]:
+        """
+        Return the cached output of a stage, or compute and store it.
+
+        Parameters:
+        - audio_hash: str - Hash of the source audio, from audio_hash.
+        - stage: str - Name of the stage.
+        - params: dict - Everything else the output depends on (stem count, sample rate, hop length...).
+        - compute: Callable - Produces the stage output as a dict of arrays on a miss.
+
+        Returns:
+        - outputs: Dict[str, ndarray] - The stage output.
+        """
+        key = self.key(audio_hash, stage, params)
+        path = self.cache.get(key)
+        if path is not None:
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    return {name: data[name] for name in data.files}
+            except (OSError, ValueError, KeyError):
+                pass  # Corrupt, or evicted while reading; recompute
+
+        outputs = compute()
+        self.cache.put(key, lambda file: np.savez(file, **outputs))
+        return outputs
+
+def cached_audio_processing(
+    path_to_mp4: str,
+    cache: AudioCache,
+    stems: int = 4,
+    top_k: int = 1
+):
+    """
+    Same as audio_processing, but every expensive stage goes through `cache`. The song is only decoded, and the stems
+    only separated or loaded, if a stage that needs them misses.
+
+    Parameters:
+    - path_to_mp4: str - The path to the source audio file.
+    - cache: AudioCache - The stage cache.
+    - stems: int - The number of stems to separate the audio into (default is 4).
+    - top_k: int - Number of onsets kept per measure (default is 1).
+
+    Returns:
+    - prioritized_onsets: list - List of prioritized onset times.
+    """
+    audio_hash = cache.audio_hash(path_to_mp4)
+    decoded: Optional[AudioBuffer] = None
+
+    def audio() -> AudioBuffer:
+        nonlocal decoded
+        if decoded is None:
+            decoded = AudioBuffer.load(path_to_mp4)
+        return decoded
+
+    def separated() -> Dict[str, ndarray]:
+        return cache.stage(audio_hash, 'separate', {"stems": stems, "sr": SAMPLING_RATE},
+                           lambda: separate(audio().waveform, stems))
+
+    def tempo() -> Dict[str, ndarray]:
+        tempo, beat_times = compute_tempo(audio=audio())
+        return {"tempo": tempo, "beat_times": beat_times}
+
+    def onsets() -> Dict[str, ndarray]:
+        all_onset_times, onset_times_by_track = compute_onsets_from_stems(separated(), SAMPLING_RATE, return_by_track=True)
+        return {"all_onset_times": all_onset_times, **{f"track_{name}": times for name, times in onset_times_by_track.items()}}
+
+    beats = cache.stage(audio_hash, 'tempo', {"sr": ANALYSIS_RATE, "hop_length": HOP_LENGTH}, tempo)
+    onset_times = cache.stage(audio_hash, 'onsets', {"stems": stems, "sr": SAMPLING_RATE, "hop_length": HOP_LENGTH}, onsets)
+
+    return measure_prioritization(
+        tempo=beats["tempo"], beat_times=beats["beat_times"], all_onset_times=onset_times["all_onset_times"], top_k=top_k)
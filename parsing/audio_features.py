@@ -0,0 +1,234 @@
+import contextlib, json, multiprocessing, os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import librosa
+import numpy as np
+from numpy import ndarray
+
+from parsing.audio_processing import ANALYSIS_RATE, HOP_LENGTH, AudioBuffer
+from parsing.dataset import MANIFEST, _ArrayWriter
+from parsing.parse import TimingPoints
+
+N_MELS = 128  # librosa's default, the spectrogram onset_strength is computed from
+FEATURE_DTYPE = np.dtype(np.float16)
+
+# One row per song: where its frames live in the flat arrays
+AUDIO_INDEX_DTYPE = np.dtype([
+    ('frame_offset', np.int64),
+    ('frame_count', np.int64)
+])
+
+# Stored arrays, with the shape of one frame
+FEATURES = {
+    "mel": (N_MELS,),  # Log-mel power in dB
+    "onset": ()  # Onset strength envelope
+}
+
+def extract_features(
+    filepath: Optional[str] = None,
+    audio: Optional[AudioBuffer] = None
+) -> Dict[str, ndarray]:
+    """
+    Log-mel spectrogram and onset strength envelope of a song, on the frame grid of the onset and tempo analysis
+    (ANALYSIS_RATE, HOP_LENGTH). The envelope is what librosa.onset.onset_strength computes from the same
+    spectrogram, so the song goes through a single STFT.
+
+    The envelope is taken from the mix rather than from the per-stem envelopes behind compute_onsets_from_stems:
+    those need a separated song and are on the SAMPLING_RATE grid, twice as many frames as the mel spectrogram
+    they would be stored next to.
+
+    Parameters:
+    - filepath: str - The path to the audio file (only decoded if `audio` is not given).
+    - audio: AudioBuffer - The already decoded song.
+
+    Returns:
+    - Dict[str, ndarray] with
+      - mel: (frames, N_MELS) float32 log-mel spectrogram.
+      - onset: (frames,) float32 onset strength.
+    """
+    if audio is None:
+        audio = AudioBuffer.load(filepath)
+    mel = librosa.power_to_db(librosa.feature.melspectrogram(y=audio.mono(ANALYSIS_RATE), sr=ANALYSIS_RATE,
+                                                             hop_length=HOP_LENGTH, n_mels=N_MELS))
+    onset = librosa.onset.onset_strength(S=mel, sr=ANALYSIS_RATE, hop_length=HOP_LENGTH)
+    return {"mel": np.ascontiguousarray(mel.T), "onset": onset}
+
+def _extract_job(path: str) -> Tuple[str, Optional[Dict[str, ndarray]], Optional[str]]:
+    try:
+        return path, extract_features(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+def pack_audio_features(
+    paths: Iterable[str],
+    directory: str,
+    max_workers: Optional[int] = None,
+    max_pending: Optional[int] = None
+) -> List[str]:
+    """
+    Extract the features of many songs in parallel, once, and pack them as float16 flat arrays plus an index table
+    (the layout of parsing.dataset), for AudioFeatures to memory-map at training time.
+
+    Parameters:
+    - paths: Iterable[str] - Audio files. Consumed lazily; songs are packed in completion order, which the manifest
+      records (see AudioFeatures.position).
+    - directory: str - Output directory; one raw .bin file per array and a manifest.json.
+    - max_workers: int - Number of worker processes (default is the number of CPUs).
+    - max_pending: int - Maximum number of songs in flight (default is twice the number of workers). Bounds peak
+      memory, as in parsing.bulk.parse_many: new songs are only submitted once earlier features are written.
+
+    Returns:
+    - List[str] - "path: error" for every file that could not be decoded and was skipped.
+    """
+    os.makedirs(directory, exist_ok=True)
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * max_workers
+    paths = iter(paths)
+
+    with contextlib.ExitStack() as stack:
+        # Every file is closed, even if packing fails halfway
+        writers = {name: stack.enter_context(_ArrayWriter(os.path.join(directory, f"{name}.bin"), FEATURE_DTYPE, shape))
+                   for name, shape in FEATURES.items()}
+        writers["index"] = stack.enter_context(_ArrayWriter(os.path.join(directory, "index.bin"), AUDIO_INDEX_DTYPE))
+
+        sources, errors = [], []
+        # Workers are spawned, like the audio batch runner, since the audio stack does not survive fork() reliably
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            pending = {executor.submit(_extract_job, path) for path in islice(paths, max_pending)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, features, error = future.result()
+                    if error is not None:
+                        errors.append(f"{path}: {error}")
+                        continue
+                    offset = writers["mel"].append(features["mel"])
+                    writers["onset"].append(features["onset"])
+                    writers["index"].append(np.array([(offset, len(features["mel"]))], dtype=AUDIO_INDEX_DTYPE))
+                    sources.append(path)
+                for path in islice(paths, len(done)):
+                    pending.add(executor.submit(_extract_job, path))
+
+        manifest = {
+            "arrays": {name: writer.close() for name, writer in writers.items()},
+            "sources": sources,
+            "sr": ANALYSIS_RATE,
+            "hop_length": HOP_LENGTH
+        }
+        with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+    return errors
+
+def beat_frames(
+    timing_points: TimingPoints,
+    num_frames: int,
+    divisor: int = 1,
+    sr: int = ANALYSIS_RATE,
+    hop_length: int = HOP_LENGTH
+) -> ndarray:
+    """
+    Frame nearest to every 1/divisor beat of a map's timing, up to the end of a song of `num_frames` frames.
+    """
+    end_ms = num_frames * hop_length / sr * 1000
+    frames = np.rint(timing_points.beat_times(end_ms, divisor) * sr / hop_length / 1000).astype(np.int64)
+    return frames[frames < num_frames]
+
+def beat_synchronous(
+    features: ndarray,
+    frames: ndarray
+) -> ndarray:
+    """
+    Aggregate frame features per beat: the mean of the frames from each beat
+    frame up to the next (up to the end for the last one), in float32. Beats
+    closer together than a frame get the frame they fall on.
+
+    Parameters:
+    - features: ndarray - (frames, ...) features, e.g. a song's mel or onset array.
+    - frames: ndarray - Sorted beat frames, e.g. from beat_frames.
+
+    Returns:
+    - ndarray - (beats, ...) aggregated features.
+    """
+    frames = np.asarray(frames, dtype=np.int64)
+    if len(frames) == 0:
+        return np.zeros((0,) + features.shape[1:], dtype=np.float32)
+    sums = np.add.reduceat(features, frames, axis=0, dtype=np.float32)
+    counts = np.diff(np.append(frames, len(features))).clip(1).astype(np.float32)
+    return sums / counts.reshape((-1,) + (1,) * (features.ndim - 1))
+
+class AudioFeatures:
+    """
+    Random access to a directory written by pack_audio_features. Like
+    PackedBeatmaps, every array is an np.memmap, songs and windows are served as
+    zero-copy slices, and pickling only carries the directory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.directory, MANIFEST), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        self.sources: List[str] = manifest["sources"]
+        self.sr: int = manifest["sr"]
+        self.hop_length: int = manifest["hop_length"]
+        self.arrays: Dict[str, ndarray] = {}
+        for name, entry in manifest["arrays"].items():
+            dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            if shape[0] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=dtype)  # np.memmap cannot map an empty file
+            else:
+                self.arrays[name] = np.memmap(os.path.join(self.directory, f"{name}.bin"), dtype=dtype, mode='r', shape=shape)
+        self.index: ndarray = self.arrays["index"]
+        self._positions: Optional[Dict[str, int]] = None
+
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.directory = state["directory"]
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> Dict[str, ndarray]:
+        """
+        All frames of song i, as {"mel": (frames, N_MELS), "onset": (frames,)} float16 views.
+        """
+        return self.window(i, 0, int(self.index[i]['frame_count']))
+
+    def num_frames(self, i: int) -> int:
+        return int(self.index[i]['frame_count'])
+
+    def position(self, source: str) -> int:
+        """
+        Index of the song packed from `source` (the audio path it was packed from).
+        """
+        if self._positions is None:
+            self._positions = {path: i for i, path in enumerate(self.sources)}
+        return self._positions[source]
+
+    def window(self, i: int, start_frame: int, length: int) -> Dict[str, ndarray]:
+        """
+        Frames [start_frame, start_frame + length) of song i as zero-copy views,
+        e.g. the audio of an ai.features.batch_windows window. Shorter if the
+        window runs past the end of the song.
+        """
+        row = self.index[i]
+        start = int(row['frame_offset']) + min(max(start_frame, 0), int(row['frame_count']))
+        end = int(row['frame_offset']) + min(max(start_frame + length, 0), int(row['frame_count']))
+        return {name: self.arrays[name][start:end] for name in FEATURES}
+
+    def beat_synchronous(self, i: int, timing_points: TimingPoints, divisor: int = 1) -> Dict[str, ndarray]:
+        """
+        Features of song i aggregated per 1/divisor beat of a map's timing points
+        (see beat_frames and beat_synchronous). Returns the beat frames too.
+        """
+        features = self[i]
+        frames = beat_frames(timing_points, self.num_frames(i), divisor, self.sr, self.hop_length)
+        return {"frames": frames, **{name: beat_synchronous(features[name], frames) for name in FEATURES}}
@@ -1,8 +1,52 @@
-import librosa, os, numpy as np
-from spleeter.separator import Separator
+import librosa, logging, os, soundfile, soxr, tempfile, threading, numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from numpy import ndarray
+from typing import Callable, Dict, List, Optional
+
+from parsing.instrumentation import PipelineReport, stage
+
+logger = logging.getLogger(__name__)
 
 SAMPLING_RATE = 44100
+ANALYSIS_RATE = 22050  # Rate of the mono signal used for tempo estimation
+HOP_LENGTH = 512  # librosa hop length of every onset/beat analysis
+N_FFT = 2048  # librosa's default frame length, used by the streaming onset envelope
+STREAM_BLOCK_FRAMES = 2048  # Analysis frames per block in streaming mode (about 24 s at SAMPLING_RATE)
+
+# Loaded separators, keyed by stem count. Building one constructs the
+# TensorFlow graph and loads the model weights, which takes seconds.
+_separators: Dict[int, 'Separator'] = {}
+_separators_lock = threading.Lock()
+
+def get_separator(
+    num_stems: int = 2
+) -> 'Separator':
+    """
+    Return the long-lived Separator for the given stem count, creating it on first use.
+    Spleeter (and TensorFlow with it) is only imported here, so the rest of the module
+    loads without it.
+
+    Parameters:
+    - num_stems: int - The number of stems the model separates the audio into (default is 2).
+
+    Returns:
+    - separator: Separator - A separator shared by every call in this process.
+    """
+    from spleeter.separator import Separator
+
+    with _separators_lock:
+        if num_stems not in _separators:
+            _separators[num_stems] = Separator(f'spleeter:{num_stems}stems')
+        return _separators[num_stems]
+
+def stem_dir(
+    filename: str,
+    dest: str
+) -> str:
+    """
+    The directory spleeter writes the stems of `filename` to (dest/<song name>).
+    """
+    return os.path.join(dest, os.path.splitext(os.path.basename(filename))[0])
 
 def spleet(
     filename: str,
@@ -14,49 +58,207 @@ def spleet(
 
     Parameters:
     - filename: str - The path to the source audio file.
-    - dest: str - The directory where the separated audio files will be saved.
+    - dest: str - The directory where the separated audio files will be saved (in a sub-directory named after the song).
     - num_stems: int - The number of stems to separate the audio into (default is 2).
 
     Raises:
     - Exception: If there is any error in loading, separating, or saving the audio.
     """
-
     try:
-        separator = Separator(f'spleeter:{num_stems}stems')
-        separator.separate_to_file(audio_descriptor=filename, destination=dest)
-        print("Separation OK")
-    except Exception as e:
-        print(f"Cannot separate audio: {e}")
+        get_separator(num_stems).separate_to_file(audio_descriptor=filename, destination=dest)
+    except Exception:
+        logger.exception("Cannot separate audio %s", filename)
+        raise
+    logger.info("Separated %s", filename)
+
+class AudioBuffer:
+    """
+    A song decoded once: the canonical (samples, 2) float32 waveform at
+    SAMPLING_RATE (what Spleeter expects), plus mono versions at any derived
+    rate, each resampled once and kept. Every stage reads from the same buffer,
+    so all times they report share one time base.
+    """
+
+    def __init__(self, waveform: ndarray, sr: int = SAMPLING_RATE):
+        self.waveform: ndarray = waveform
+        self.sr: int = sr
+        self._mono: Dict[int, ndarray] = {}
+
+    @staticmethod
+    def load(filename: str, sr: int = SAMPLING_RATE) -> 'AudioBuffer':
+        """
+        Decode an audio file at an explicit sample rate.
+        """
+        y, _ = librosa.load(filename, sr=sr, mono=False)
+        if y.ndim == 1:
+            y = np.stack([y, y])
+        return AudioBuffer(np.ascontiguousarray(y.T, dtype=np.float32), sr)
+
+    @property
+    def duration(self) -> float:
+        return len(self.waveform) / self.sr
+
+    def mono(self, sr: Optional[int] = None) -> ndarray:
+        """
+        Mono downmix at `sr` (default is the buffer's own rate).
+        """
+        sr = sr or self.sr
+        if sr not in self._mono:
+            y = np.mean(self.waveform, axis=1)
+            if sr != self.sr:
+                y = librosa.resample(y, orig_sr=self.sr, target_sr=sr)
+            self._mono[sr] = y
+        return self._mono[sr]
+
+def separate(
+    waveform: ndarray,
+    num_stems: int = 2
+) -> Dict[str, ndarray]:
+    """
+    Split a waveform into stems in memory, without writing anything to disk.
+
+    Parameters:
+    - waveform: ndarray - (samples, 2) waveform at SAMPLING_RATE, e.g. AudioBuffer.waveform.
+    - num_stems: int - The number of stems to separate the audio into (default is 2).
+
+    Returns:
+    - stems: Dict[str, ndarray] - Instrument name to (samples, 2) waveform.
+    """
+    return get_separator(num_stems).separate(waveform)
+
+def save_stems(
+    stems: Dict[str, ndarray],
+    dest: str
+):
+    """
+    Write in-memory stems to dest/<instrument>.wav, the same layout spleet produces.
+    """
+    os.makedirs(dest, exist_ok=True)
+    for instrument, waveform in stems.items():
+        soundfile.write(os.path.join(dest, f'{instrument}.wav'), waveform, SAMPLING_RATE)
+
+def spleet_many(
+    filenames: List[str],
+    dest: str,
+    num_stems: int = 2
+) -> List[str]:
+    """
+    Split a whole list of songs with a single loaded model. The stems of a song
+    are written on a background thread while the next song is being separated;
+    each write is waited for before the following one starts, so a failed write
+    is reported for its own song.
+
+    Parameters:
+    - filenames: List[str] - The paths to the source audio files.
+    - dest: str - The directory where the separated audio files will be saved (one sub-directory per song).
+    - num_stems: int - The number of stems to separate the audio into (default is 2).
+
+    Returns:
+    - failed: List[str] - The files that could not be separated or written.
+    """
+    separator = get_separator(num_stems)
+    failed = []
+    writing = None  # (filename, future) of the stems being written
+
+    def wait_for_write():
+        filename, future = writing
+        try:
+            future.result()
+            logger.info("Separated %s", filename)
+        except Exception as e:
+            logger.error("Cannot write the stems of %s: %s", filename, e)
+            failed.append(filename)
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for filename in filenames:
+            try:
+                stems = separator.separate(AudioBuffer.load(filename).waveform)
+            except Exception as e:
+                logger.error("Cannot separate audio %s: %s", filename, e)
+                failed.append(filename)
+                continue
+            if writing is not None:
+                wait_for_write()
+            writing = (filename, writer.submit(save_stems, stems, stem_dir(filename, dest)))
+        if writing is not None:
+            wait_for_write()
+
+    logger.info("Separated %d/%d songs", len(filenames) - len(failed), len(filenames))
+    return failed
 
 def compute_tempo(
-    filepath: str
+    filepath: Optional[str] = None,
+    audio: Optional[AudioBuffer] = None
 ):
     """
     Compute the tempo and beat times of the given audio file.
 
     Parameters:
-    - filepath: str - The path to the audio file.
+    - filepath: str - The path to the audio file (only decoded if `audio` is not given).
+    - audio: AudioBuffer - The already decoded song.
 
     Returns:
     - tempo: ndarray - The estimated tempo of the audio in BPM.
     - beat_times: ndarray - The time values (in seconds) corresponding to the detected beats.
     """
-    y, sr = librosa.load(path=filepath)
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units='time')
-    beat_times = librosa.frames_to_time(beats, sr=sr)
-    return tempo, beat_times
+    if audio is None:
+        audio = AudioBuffer.load(filepath)
+    tempo, beat_times = librosa.beat.beat_track(y=audio.mono(ANALYSIS_RATE), sr=ANALYSIS_RATE, hop_length=HOP_LENGTH, units='time')
+    return np.atleast_1d(tempo), beat_times
+
+def onset_times(
+    y: ndarray,
+    sr: int
+) -> ndarray:
+    """
+    Detect the onsets of a single mono track.
+
+    Parameters:
+    - y: ndarray - The mono time series.
+    - sr: int - The sampling rate of `y`.
+
+    Returns:
+    - onset_times: ndarray - The onset times in seconds.
+    """
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=HOP_LENGTH)
+    onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH)
+    return librosa.frames_to_time(frames=onset_frames, sr=sr, hop_length=HOP_LENGTH)
+
+def _load_onset_times(
+    filepath: str
+) -> ndarray:
+    # The decoded track only lives for the duration of this call
+    y, _ = librosa.load(filepath, sr=SAMPLING_RATE)
+    return onset_times(y, SAMPLING_RATE)
+
+def _merge_onsets(
+    onset_times_by_track: Dict[str, ndarray],
+    return_by_track: bool
+):
+    all_onset_times = np.hstack(list(onset_times_by_track.values()))
+    all_onset_times.sort()
+
+    if return_by_track:
+        return all_onset_times, onset_times_by_track
+    return all_onset_times
 
 def compute_onsets(
-    instrument_dir: str
+    instrument_dir: str,
+    max_workers: Optional[int] = None,
+    return_by_track: bool = False
 ):
     """
-    Compute the onset times for each separated track in the given directory.
+    Compute the onset times for each separated track in the given directory. Tracks are loaded and analysed
+    concurrently, one worker thread per track, and each decoded track is released as soon as its onsets are known.
 
     Parameters:
     - instrument_dir: str - The directory containing the separated audio files.
+    - max_workers: int - Maximum number of tracks processed at once (default is one per track).
+    - return_by_track: bool - Also return the onset times of every track (default is False).
 
     Returns:
     - all_onset_times: ndarray - Sorted array of all onset times from all tracks.
+    - onset_times_by_track: Dict[str, ndarray] - Instrument name to its onset times (only if return_by_track).
     """
 
     # List all files in the output directory
@@ -64,98 +266,453 @@ def compute_onsets(
 
     # Extract instrument names and paths.
     separated_tracks = {os.path.splitext(file)[0]: os.path.join(instrument_dir, file) for file in separated_files if file.endswith('.wav')}
+    if not separated_tracks:
+        raise Exception(f"No separated tracks in {instrument_dir}")
 
-    # Loading time series info
-    track_data = {}
-    for instrument, filepath in separated_tracks.items():
-        y, _ = librosa.load(filepath)
-        track_data[instrument] = y
-    
-    # Calculate onset times
-    onset_times_by_track = {}
-    for instrument, y in track_data.items():
-        onset_env = librosa.onset.onset_strength(y=y, sr=SAMPLING_RATE)
-        onset_frames = librosa.onset.onset_detect(onset_envelope=onset_env)
-        onset_times_by_track[instrument] = librosa.frames_to_time(frames=onset_frames, sr=SAMPLING_RATE)
+    # Load and calculate onset times, per track in parallel
+    with ThreadPoolExecutor(max_workers=max_workers or len(separated_tracks)) as executor:
+        futures = {instrument: executor.submit(_load_onset_times, filepath) for instrument, filepath in separated_tracks.items()}
+        onset_times_by_track = {instrument: future.result() for instrument, future in futures.items()}
 
-    all_onset_times = np.hstack(list(onset_times_by_track.values()))
-    all_onset_times.sort()
+    return _merge_onsets(onset_times_by_track, return_by_track)
 
-    return all_onset_times
+def compute_onsets_from_stems(
+    stems: Dict[str, ndarray],
+    sr: int = SAMPLING_RATE,
+    max_workers: Optional[int] = None,
+    return_by_track: bool = False
+):
+    """
+    Compute the onset times of separated stems held in memory, as returned by `separate`. Stems are analysed
+    concurrently, one worker thread per stem.
+
+    Parameters:
+    - stems: Dict[str, ndarray] - Instrument name to (samples, channels) waveform.
+    - sr: int - The sampling rate of the stems (default is SAMPLING_RATE).
+    - max_workers: int - Maximum number of stems processed at once (default is one per stem).
+    - return_by_track: bool - Also return the onset times of every stem (default is False).
+
+    Returns:
+    - all_onset_times: ndarray - Sorted array of all onset times from all stems.
+    - onset_times_by_track: Dict[str, ndarray] - Instrument name to its onset times (only if return_by_track).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(stems)) as executor:
+        futures = {instrument: executor.submit(lambda w: onset_times(np.mean(w, axis=1), sr), waveform)
+                   for instrument, waveform in stems.items()}
+        onset_times_by_track = {instrument: future.result() for instrument, future in futures.items()}
+
+    return _merge_onsets(onset_times_by_track, return_by_track)
+
+def can_stream(
+    filename: str
+) -> bool:
+    """
+    Whether libsndfile can read the file block by block. It cannot read mp4/m4a, for instance; those songs have to
+    be decoded whole with AudioBuffer.load.
+    """
+    try:
+        soundfile.info(filename)
+    except RuntimeError:
+        return False
+    return True
+
+def stream_blocks(
+    filename: str,
+    blocksize: int,
+    sr: Optional[int] = None
+):
+    """
+    Read an audio file block by block, resampled on the fly, so only one block is ever decoded at a time.
+
+    Parameters:
+    - filename: str - The path to the audio file.
+    - blocksize: int - Frames read from the file per block.
+    - sr: int - Output sampling rate (default is the file's own rate).
+
+    Yields:
+    - block: ndarray - (frames, channels) float32 block. Resampled blocks do not all have the same length.
+
+    Raises:
+    - ValueError: If libsndfile cannot read the format (e.g. mp4/m4a), which then has to be decoded whole with
+      AudioBuffer.load.
+    """
+    try:
+        source = soundfile.SoundFile(filename)
+    except RuntimeError as e:
+        raise ValueError(f"Cannot stream {filename}: {e}") from e
+    with source:
+        resampler = None
+        if sr is not None and sr != source.samplerate:
+            resampler = soxr.ResampleStream(source.samplerate, sr, source.channels, dtype='float32')
+        for block in source.blocks(blocksize, always_2d=True, dtype='float32'):
+            yield resampler.resample_chunk(block) if resampler else block
+        if resampler:
+            yield resampler.resample_chunk(np.zeros((0, source.channels), dtype=np.float32), last=True)
+
+def stream_onset_envelope(
+    filename: str,
+    sr: int = SAMPLING_RATE,
+    block_length: int = STREAM_BLOCK_FRAMES,
+    top_db: float = 80.0,
+    aggregate: Callable[..., ndarray] = np.mean
+):
+    """
+    Onset strength envelope of a whole file, computed block by block with bounded memory. Equivalent to
+    librosa.onset.onset_strength(y=librosa.load(filename, sr=sr)[0], sr=sr, hop_length=HOP_LENGTH): the
+    centered frames overlapping a block boundary are rebuilt from the samples carried over from the previous
+    block, and the last mel frame of each block is kept to difference against the first one of the next.
+
+    The only deviation is the top_db floor, which is taken relative to the loudest frame seen so far instead
+    of the loudest frame of the file, so quiet frames before the first loud one may differ slightly.
+
+    Parameters:
+    - filename: str - The path to the audio file.
+    - sr: int - Sampling rate to analyse the audio at (default is SAMPLING_RATE).
+    - block_length: int - Analysis frames per block (default is STREAM_BLOCK_FRAMES).
+    - top_db: float - Dynamic range of the log-mel spectrogram in dB (default is 80, as in librosa).
+    - aggregate: Callable - Reduces the flux of every mel band to one value per frame, like librosa's `aggregate`
+      (default is np.mean; beat tracking uses np.median).
+
+    Returns:
+    - onset_env: ndarray - One onset strength value per HOP_LENGTH samples, like librosa.
+    """
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=N_FFT)
+    window = librosa.filters.get_window('hann', N_FFT, fftbins=True).astype(np.float32)
+
+    # Onset strength is zero for the first lag + n_fft // (2 * hop) frames, as in librosa
+    pieces = [np.zeros(1 + N_FFT // (2 * HOP_LENGTH))]
+    num_frames = 0
+    previous = None
+    peak = -np.inf
+
+    def analyse(samples: ndarray) -> ndarray:
+        # Consume every complete frame of `samples` and return the samples the next frame starts from
+        nonlocal num_frames, previous, peak
+        count = 1 + (len(samples) - N_FFT) // HOP_LENGTH if len(samples) >= N_FFT else 0
+        if count == 0:
+            return samples
+        frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP_LENGTH][:count]
+        power = np.abs(np.fft.rfft(frames * window, axis=1)).T ** 2
+        S = librosa.power_to_db(mel_basis @ power, top_db=None)
+        peak = max(peak, S.max())
+        if previous is not None:
+            S = np.hstack([previous, S])
+        S = np.maximum(S, peak - top_db)
+        pieces.append(aggregate(np.maximum(0, S[:, 1:] - S[:, :-1]), axis=0))
+        previous = S[:, -1:]
+        num_frames += count
+        return samples[count * HOP_LENGTH:]
+
+    # Centered frames: the signal is padded with n_fft // 2 zeros on both ends
+    carry = np.zeros(N_FFT // 2, dtype=np.float32)
+    for block in stream_blocks(filename, block_length * HOP_LENGTH, sr):
+        carry = analyse(np.concatenate([carry, block.mean(axis=1)]))
+    analyse(np.concatenate([carry, np.zeros(N_FFT // 2, dtype=np.float32)]))
+
+    return np.concatenate(pieces)[:num_frames]
+
+def compute_tempo_streaming(
+    filepath: str,
+    block_length: int = STREAM_BLOCK_FRAMES
+):
+    """
+    Same as compute_tempo, but the song is never fully decoded: beats are tracked on the streamed onset envelope.
+
+    Parameters:
+    - filepath: str - The path to the audio file.
+    - block_length: int - Analysis frames per block (default is STREAM_BLOCK_FRAMES).
+
+    Returns:
+    - tempo: ndarray - The estimated tempo of the audio in BPM.
+    - beat_times: ndarray - The time values (in seconds) corresponding to the detected beats.
+    """
+    # beat_track aggregates the onset strength with the median when given a waveform
+    onset_env = stream_onset_envelope(filepath, ANALYSIS_RATE, block_length, aggregate=np.median)
+    tempo, beat_times = librosa.beat.beat_track(onset_envelope=onset_env, sr=ANALYSIS_RATE, hop_length=HOP_LENGTH, units='time')
+    return np.atleast_1d(tempo), beat_times
+
+def _stream_onset_times(
+    filepath: str,
+    block_length: int = STREAM_BLOCK_FRAMES
+) -> ndarray:
+    onset_env = stream_onset_envelope(filepath, SAMPLING_RATE, block_length)
+    return librosa.onset.onset_detect(onset_envelope=onset_env, sr=SAMPLING_RATE, hop_length=HOP_LENGTH, units='time')
+
+def compute_onsets_streaming(
+    instrument_dir: str,
+    max_workers: Optional[int] = None,
+    return_by_track: bool = False,
+    block_length: int = STREAM_BLOCK_FRAMES
+):
+    """
+    Same as compute_onsets, but every track is streamed block by block instead of loaded whole.
+
+    Parameters:
+    - instrument_dir: str - The directory containing the separated audio files.
+    - max_workers: int - Maximum number of tracks processed at once (default is one per track).
+    - return_by_track: bool - Also return the onset times of every track (default is False).
+    - block_length: int - Analysis frames per block (default is STREAM_BLOCK_FRAMES).
+
+    Returns:
+    - all_onset_times: ndarray - Sorted array of all onset times from all tracks.
+    - onset_times_by_track: Dict[str, ndarray] - Instrument name to its onset times (only if return_by_track).
+    """
+    separated_tracks = {os.path.splitext(file)[0]: os.path.join(instrument_dir, file)
+                        for file in os.listdir(instrument_dir) if file.endswith('.wav')}
+    if not separated_tracks:
+        raise Exception(f"No separated tracks in {instrument_dir}")
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(separated_tracks)) as executor:
+        futures = {instrument: executor.submit(_stream_onset_times, filepath, block_length)
+                   for instrument, filepath in separated_tracks.items()}
+        onset_times_by_track = {instrument: future.result() for instrument, future in futures.items()}
+
+    return _merge_onsets(onset_times_by_track, return_by_track)
+
+def separate_streaming(
+    filename: str,
+    dest: str,
+    num_stems: int = 2,
+    segment_seconds: float = 30.0,
+    context_seconds: float = 1.0
+):
+    """
+    Split a song into stems segment by segment, appending each segment to dest/<instrument>.wav (the layout
+    save_stems produces). Every segment is separated with `context_seconds` of audio on both sides, which is
+    then dropped, so the model sees no hard cut at segment boundaries. Memory is bounded by the segment length
+    rather than by the song length.
+
+    Parameters:
+    - filename: str - The path to the source audio file.
+    - dest: str - The directory the stems are written to.
+    - num_stems: int - The number of stems to separate the audio into (default is 2).
+    - segment_seconds: float - Length of the audio kept from each separated segment (default is 30).
+    - context_seconds: float - Extra audio separated on each side of a segment (default is 1).
+
+    Returns:
+    - duration: float - Seconds of audio separated.
+    """
+    separator = get_separator(num_stems)
+    segment = int(segment_seconds * SAMPLING_RATE)
+    context = min(int(context_seconds * SAMPLING_RATE), segment)
+    os.makedirs(dest, exist_ok=True)
+
+    writers: Dict[str, soundfile.SoundFile] = {}
+    buffer = np.zeros((0, 2), dtype=np.float32)
+    left = 0  # Samples of left context at the start of the buffer
+    samples = 0
+
+    def flush(final: bool):
+        nonlocal buffer, left
+        while len(buffer) >= left + segment + context or (final and len(buffer) > left):
+            stems = separator.separate(buffer[:left + segment + context])
+            for instrument, waveform in stems.items():
+                if instrument not in writers:
+                    writers[instrument] = soundfile.SoundFile(
+                        os.path.join(dest, f'{instrument}.wav'), 'w', SAMPLING_RATE, waveform.shape[1])
+                writers[instrument].write(waveform[left:left + segment])
+            buffer = buffer[left + segment - context:]
+            left = context
+
+    try:
+        for block in stream_blocks(filename, SAMPLING_RATE, SAMPLING_RATE):
+            if block.shape[1] == 1:
+                block = np.repeat(block, 2, axis=1)
+            buffer = np.concatenate([buffer, block[:, :2]])
+            samples += len(block)
+            flush(final=False)
+        flush(final=True)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return samples / SAMPLING_RATE
+
+def measure_boundaries(
+    tempo: ndarray,
+    beat_times: ndarray,
+    beats_per_measure: int = 4
+) -> ndarray:
+    """
+    Split the beat grid into measures. The first beat opens the first measure; each following measure starts at the
+    first beat lying more than one measure (at the tempo of the beat that opened the current one) after it. As in
+    the original scan, a measure opened at exactly 0.0 s is closed by the very next beat.
+
+    Parameters:
+    - tempo: ndarray - The tempo in BPM, either a single global value or one value per beat (for BPM changes).
+    - beat_times: ndarray - Sorted beat times in seconds.
+    - beats_per_measure: int - Beats per measure (default is 4).
+
+    Returns:
+    - boundaries: ndarray - The times (in seconds) at which a new measure starts.
+    """
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    n = len(beat_times)
+    if n == 0:
+        return beat_times
+    tempo = np.atleast_1d(np.asarray(tempo, dtype=np.float64))
+    bpm = tempo if len(tempo) == n else np.full(n, tempo[0])
+    measure_duration = beats_per_measure * (60 / bpm)
+    index = np.arange(n)
+
+    # The beat that would open the next measure if one opened at every beat. searchsorted tests
+    # beat > start + duration, while the scan tested beat - start > duration; the two round differently when a
+    # beat lands exactly one measure later (common, librosa tempos being whole frame lags), so step the guess to
+    # where the scan's test flips.
+    following = np.maximum(np.searchsorted(beat_times, beat_times + measure_duration, side='right'), index + 1)
+    while True:
+        earlier = (following > index + 1) & (beat_times[following - 1] - beat_times > measure_duration)
+        if not earlier.any():
+            break
+        following -= earlier
+    while True:
+        later = (following < n) & ~(beat_times[np.minimum(following, n - 1)] - beat_times > measure_duration)
+        if not later.any():
+            break
+        following += later
+    following[beat_times == 0] = index[beat_times == 0] + 1
+
+    # Walk the chain from the first beat by pointer doubling: after round k, every beat reachable in fewer than
+    # 2 ** (k + 1) measures is marked. n (past the last beat) is where the chain ends.
+    jump = np.append(following, n)
+    opens = np.zeros(n + 1, dtype=bool)
+    opens[0] = True
+    for _ in range(n.bit_length()):
+        opens[jump[opens]] = True
+        jump = jump[jump]
+    return beat_times[opens[:n]]
 
 def measure_prioritization(
     tempo: ndarray,
     beat_times: ndarray,
-    all_onset_times: ndarray
+    all_onset_times: ndarray,
+    top_k: int = 1,
+    onset_strengths: Optional[ndarray] = None,
+    beats_per_measure: int = 4
 ):
     """
-    Prioritize onset times within each measure based on the detected BPM.
+    Prioritize onset times within each measure based on the detected BPM. Onsets are binned into measure segments
+    with a single np.searchsorted, so this stays O(n log n) for tens of thousands of onsets.
 
     Parameters:
-    - tempo: ndarray - The estimated tempo of the audio in BPM.
+    - tempo: ndarray - The estimated tempo of the audio in BPM, either global or one value per beat.
     - beat_times: ndarray - The time values (in seconds) corresponding to the detected beats.
     - all_onset_times: ndarray - Sorted array of all onset times from all tracks.
+    - top_k: int - Number of onsets kept per measure (default is 1).
+    - onset_strengths: ndarray - Optional strength of every onset. If given, the strongest onsets of a measure are
+      kept, otherwise the earliest.
+    - beats_per_measure: int - Beats per measure (default is 4).
 
     Returns:
-    - prioritized_onsets: list - List of prioritized onset times.
+    - prioritized_onsets: list - List of prioritized onset times, in time order.
     """
-    prioritized_onsets = []
-    current_bpm = tempo[0]
-    measure_duration = 4 * (60 / current_bpm)
-    segment_start_time = 0
-
-    for beat_time in beat_times:
-        if segment_start_time == 0 or beat_time - segment_start_time > measure_duration:
-            segment_end_time = beat_time
-            segment_onsets = [time for time in all_onset_times if segment_start_time <= time < segment_end_time]
-            if segment_onsets:
-                prioritized_onsets.append(segment_onsets[0])
-            segment_start_time = segment_end_time
-            current_bpm = tempo[0]
-            measure_duration = 4 * (60 / current_bpm)
-
-    # Process remaining onsets after the last tempo change
-    segment_onsets = [time for time in all_onset_times if segment_start_time <= time]
-    if segment_onsets:
-        prioritized_onsets.append(segment_onsets[0])
+    onsets = np.asarray(all_onset_times, dtype=np.float64)
 
-    return prioritized_onsets
+    # Segment i spans [edges[i], edges[i + 1]), the last one is open-ended
+    edges = np.concatenate([[0.0], measure_boundaries(tempo, beat_times, beats_per_measure)])
+    starts = np.searchsorted(onsets, edges, side='left')
+    counts = np.diff(np.append(starts, len(onsets)))
+    onsets = onsets[starts[0]:]
+    first_in_segment = np.repeat(starts - starts[0], counts)
+    segment = np.repeat(np.arange(len(edges)), counts)
 
-def audio_processing(path_to_mp4, instrument_dir, stems=4):
+    if onset_strengths is None:
+        order = np.arange(len(onsets))
+    else:
+        strengths = np.asarray(onset_strengths)[starts[0]:]
+        order = np.lexsort((-strengths, segment))
+
+    # Rank of every onset inside its segment, after ordering by priority
+    rank = np.arange(len(onsets)) - first_in_segment
+    keep = np.sort(order[rank < top_k])
+    return onsets[keep].tolist()
+
+def audio_processing(path_to_mp4, instrument_dir: Optional[str] = None, stems=4, report: Optional[PipelineReport] = None):
     """
     Process the audio file by separating it into individual instruments, computing the tempo, detecting onsets,
-    and prioritizing onsets within each measure.
+    and prioritizing onsets within each measure. Separated stems stay in memory and go straight into onset
+    detection.
 
     Parameters:
     - path_to_mp4: str - The path to the source audio file.
-    - instrument_dir: str - The directory where the separated audio files will be saved.
+    - instrument_dir: str - Optional directory where the separated audio files are also saved
+      (in a sub-directory named after the song). Nothing is written if omitted.
     - stems: int - The number of stems to separate the audio into (default is 4).
+    - report: PipelineReport - Optional report that receives the timings of every stage.
 
     Returns:
     - prioritized_onsets: list - List of prioritized onset times.
     """
+    # Decode once; every stage below shares this buffer
+    with stage(report, path_to_mp4, 'decode') as record:
+        audio = AudioBuffer.load(path_to_mp4)
+        record.audio_s = audio.duration
+
     # First split the audio into individual instruments.
-    spleet(
-        filename=path_to_mp4,
-        dest=instrument_dir,
-        num_stems=stems
-    )
+    with stage(report, path_to_mp4, 'separate', audio.duration):
+        separated = separate(
+            waveform=audio.waveform,
+            num_stems=stems
+        )
+    if instrument_dir is not None:
+        with stage(report, path_to_mp4, 'save_stems', audio.duration):
+            save_stems(separated, stem_dir(path_to_mp4, instrument_dir))
 
     # Get BPM, beats, and BPM changes
-    tempo, beat_times = compute_tempo(filepath=path_to_mp4)
+    with stage(report, path_to_mp4, 'tempo', audio.duration):
+        tempo, beat_times = compute_tempo(audio=audio)
 
     # Get onset times
-    all_onset_times = compute_onsets(instrument_dir=instrument_dir)
+    with stage(report, path_to_mp4, 'onsets', audio.duration):
+        all_onset_times = compute_onsets_from_stems(stems=separated, sr=audio.sr)
 
     # Get Prioritized Onsets
-    prioritized_onsets = measure_prioritization(
-        tempo=tempo, beat_times=beat_times, all_onset_times=all_onset_times)
+    with stage(report, path_to_mp4, 'prioritize', audio.duration):
+        prioritized_onsets = measure_prioritization(
+            tempo=tempo, beat_times=beat_times, all_onset_times=all_onset_times)
     
     return prioritized_onsets
 
 
+def audio_processing_streaming(path_to_mp4, instrument_dir: Optional[str] = None, stems=4,
+                               report: Optional[PipelineReport] = None):
+    """
+    Same as audio_processing, but with memory bounded regardless of the song length: stems are separated
+    segment by segment into wav files, and tempo and onsets are computed by streaming the audio block by block.
+    Formats libsndfile cannot read (mp4/m4a) cannot be streamed; those songs go through audio_processing instead.
+
+    Parameters:
+    - path_to_mp4: str - The path to the source audio file.
+    - instrument_dir: str - Optional directory where the separated audio files are kept (in a sub-directory
+      named after the song). A temporary directory is used if omitted.
+    - stems: int - The number of stems to separate the audio into (default is 4).
+    - report: PipelineReport - Optional report that receives the timings of every stage.
+
+    Returns:
+    - prioritized_onsets: list - List of prioritized onset times.
+    """
+    if not can_stream(path_to_mp4):
+        logger.warning("Cannot stream %s, decoding it whole", path_to_mp4)
+        return audio_processing(path_to_mp4, instrument_dir, stems, report)
+
+    duration = soundfile.info(path_to_mp4).duration
+    with tempfile.TemporaryDirectory() as scratch:
+        song_dir = stem_dir(path_to_mp4, instrument_dir or scratch)
+        with stage(report, path_to_mp4, 'separate', duration):
+            separate_streaming(path_to_mp4, song_dir, num_stems=stems)
+
+        with stage(report, path_to_mp4, 'tempo', duration):
+            tempo, beat_times = compute_tempo_streaming(path_to_mp4)
+        with stage(report, path_to_mp4, 'onsets', duration):
+            all_onset_times = compute_onsets_streaming(song_dir)
+
+    with stage(report, path_to_mp4, 'prioritize', duration):
+        return measure_prioritization(
+            tempo=tempo, beat_times=beat_times, all_onset_times=all_onset_times)
+
 # # Example usage
 # path_to_mp4 = 'path/to/song.mp3'
 # instrument_dir = 'output'
 # prioritized_onsets = audio_processing(path_to_mp4, instrument_dir)
-# create_beatmap(prioritized_onsets)
+# tempo, beat_times = compute_tempo(path_to_mp4)
+# beatmap = ai.generator.create_beatmap(prioritized_onsets, tempo, beat_times)
+# parsing.writer.write_beatmap(beatmap, 'song.osu')
@@ -0,0 +1,301 @@
+import argparse, glob, json, multiprocessing, os, platform, sys, tempfile, time, tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from parsing.instrumentation import peak_rss
+from parsing.parse import (PARSER_VERSION, SECTION_CLASSES, Beatmap, HitObject, HitObjectArrays,
+                           create_beatmap_from_file)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+SYNTHETIC_SIZES = [1000, 10000, 100000]
+BASELINE_MAX_HIT_OBJECTS = 10000  # The buffered baseline is quadratic; skip it on bigger maps
+
+def create_beatmap_from_file_buffered(file_path):
+    """
+    The original parser: accumulates every section into a string buffer and
+    re-splits it in load_from_string. Kept only as a baseline for comparison.
+    """
+
+    sections = {section: "" for section in SECTION_CLASSES}
+    current_section = None
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line in SECTION_CLASSES:
+                current_section = line
+            elif current_section and line:
+                sections[current_section] += line + '\n'
+
+    section_objects = {name: cls() for name, cls in SECTION_CLASSES.items()}
+    for name, data in sections.items():
+        section_objects[name].load_from_string(data)
+
+    return Beatmap(*section_objects.values())
+
+def time_parser(
+    parser: Callable,
+    data,
+    repeats: int = 20
+) -> float:
+    """
+    Best-of-`repeats` wall time (in seconds) of parser(data).
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def read_sections(
+    file_path: str
+) -> Dict[str, List[str]]:
+    """
+    Stripped, non-empty lines of every section of a .osu file.
+    """
+    sections = {name: [] for name in SECTION_CLASSES}
+    current_section = None
+    with open(file_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line in SECTION_CLASSES:
+                current_section = line
+            elif current_section and line:
+                sections[current_section].append(line)
+    return sections
+
+def read_section_lines(
+    file_path: str,
+    section: str = "[HitObjects]"
+) -> List[str]:
+    return read_sections(file_path)[section]
+
+def hit_object_throughput(
+    lines: List[str],
+    repeats: int = 5
+) -> Dict[str, float]:
+    """
+    Hit objects parsed per second, per line with HitObject.create versus the
+    vectorized HitObjectArrays.from_lines fast path.
+    """
+    per_line = time_parser(lambda ls: [HitObject.create(line) for line in ls], lines, repeats)
+    vectorized = time_parser(HitObjectArrays.from_lines, lines, repeats)
+    return {
+        "per_line": len(lines) / per_line,
+        "vectorized": len(lines) / vectorized
+    }
+
+def time_sections(
+    file_path: str,
+    repeats: int = 5
+) -> Dict[str, float]:
+    """
+    Best wall time (in seconds) spent in each section class, loading its lines
+    and finishing it. "HitObjects.objects" is the extra cost of materializing
+    the Circle/Slider/Spinner instances.
+    """
+    sections = read_sections(file_path)
+
+    def load(cls, lines):
+        section = cls()
+        for line in lines:
+            section.load_line(line)
+        section.finish()
+        return section
+
+    timings = {}
+    for name, cls in SECTION_CLASSES.items():
+        timings[name.strip('[]')] = time_parser(lambda lines: load(cls, lines), sections[name], repeats)
+    timings["HitObjects.objects"] = time_parser(lambda lines: load(SECTION_CLASSES["[HitObjects]"], lines).hit_objects,
+                                                sections["[HitObjects]"], repeats) - timings["HitObjects"]
+    return timings
+
+def peak_allocations(
+    parser: Callable,
+    data
+) -> int:
+    """
+    Peak bytes allocated (as seen by tracemalloc, which includes NumPy buffers) while running parser(data).
+    """
+    tracemalloc.start()
+    try:
+        parser(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def synthetic_map(
+    num_hit_objects: int,
+    template: str,
+    seed: int = 0
+) -> str:
+    """
+    A .osu file with the header sections of `template` and `num_hit_objects`
+    random hit objects (about 50% circles, 45% sliders and 5% spinners).
+    """
+    rng = np.random.default_rng(seed)
+    sections = read_sections(template)
+    header = [line for name, lines in sections.items() if name != "[HitObjects]" for line in [name, *lines, ""]]
+
+    kinds = rng.choice(3, size=num_hit_objects, p=[0.5, 0.45, 0.05])
+    times = np.cumsum(rng.integers(50, 400, size=num_hit_objects))
+    xs = rng.integers(0, 513, size=num_hit_objects)
+    ys = rng.integers(0, 385, size=num_hit_objects)
+
+    lines = []
+    for kind, t, x, y in zip(kinds.tolist(), times.tolist(), xs.tolist(), ys.tolist()):
+        if kind == 0:
+            lines.append(f"{x},{y},{t},1,0,0:0:0:0:")
+        elif kind == 1:
+            points = "|".join(f"{px}:{py}" for px, py in rng.integers(0, 385, size=(rng.integers(1, 5), 2)).tolist())
+            curve_type = "BLP"[int(rng.integers(3))]
+            lines.append(f"{x},{y},{t},2,0,{curve_type}|{points},{int(rng.integers(1, 3))},{rng.uniform(20, 300):.4f},0|0,0:0|0:0,0:0:0:0:")
+        else:
+            lines.append(f"256,192,{t},12,0,{t + 1000},0:0:0:0:")
+
+    return "\n".join(header + ["[HitObjects]"] + lines) + "\n"
+
+def benchmark_file(
+    file_path: str,
+    name: str,
+    repeats: int
+) -> dict:
+    hit_object_lines = read_section_lines(file_path)
+    num_hit_objects = len(hit_object_lines)
+    parse_time = time_parser(create_beatmap_from_file, file_path, repeats)
+    buffered_time = None
+    if num_hit_objects <= BASELINE_MAX_HIT_OBJECTS:
+        buffered_time = time_parser(create_beatmap_from_file_buffered, file_path, repeats)
+    objects_time = time_parser(lambda path: create_beatmap_from_file(path).hitObjects.hit_objects, file_path, repeats)
+
+    return {
+        "name": name,
+        "hit_objects": num_hit_objects,
+        "wall_time_s": {
+            "parse": parse_time,
+            "parse_with_objects": objects_time,
+            "buffered_baseline": buffered_time
+        },
+        "sections_s": time_sections(file_path, repeats),
+        "hit_objects_per_s": {
+            "parse": num_hit_objects / parse_time,
+            "parse_with_objects": num_hit_objects / objects_time,
+            **hit_object_throughput(hit_object_lines, repeats)
+        },
+        "tracemalloc_peak_bytes": {
+            "parse": peak_allocations(create_beatmap_from_file, file_path),
+            "parse_with_objects": peak_allocations(lambda path: create_beatmap_from_file(path).hitObjects.hit_objects, file_path)
+        }
+    }
+
+def _benchmark_case(
+    file_path: str,
+    name: str,
+    repeats: int
+) -> dict:
+    case = benchmark_file(file_path, name, repeats)
+    case["peak_rss_bytes"] = peak_rss()
+    return case
+
+def benchmark_isolated(
+    file_path: str,
+    name: str,
+    repeats: int
+) -> dict:
+    """
+    benchmark_file in a fresh process, which also reports its peak RSS (None where it cannot be read), so that
+    the memory of one case is not hidden by the peak of an earlier, bigger one.
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_benchmark_case, file_path, name, repeats).result()
+
+def find_maps(data_dir: str = DATA_DIR) -> List[str]:
+    return sorted(glob.glob(os.path.join(data_dir, '**', '*.osu'), recursive=True))
+
+def run(
+    maps: List[str],
+    sizes: List[int],
+    repeats: int = 5
+) -> dict:
+    """
+    Benchmark the parser on real maps and on synthetic maps of the given sizes, each in its own process.
+    """
+    cases = [benchmark_isolated(path, os.path.basename(path), repeats) for path in maps]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f"synthetic_{size}.osu")
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(synthetic_map(size, maps[0]))
+            cases.append(benchmark_isolated(path, f"synthetic_{size}", max(1, repeats * 1000 // size)))
+
+    return {
+        "parser_version": PARSER_VERSION,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "cases": cases
+    }
+
+def compare(
+    results: dict,
+    baseline: dict,
+    threshold: float
+) -> List[str]:
+    """
+    Cases whose parse time grew by more than `threshold` (e.g. 1.2 = 20% slower) relative to a baseline run.
+    """
+    baseline_cases = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = baseline_cases.get(case["name"])
+        if old is None:
+            continue
+        for key, new_time in case["wall_time_s"].items():
+            old_time = old["wall_time_s"].get(key)
+            if old_time and new_time and new_time > old_time * threshold:
+                regressions.append(f"{case['name']} {key}: {old_time * 1000:.2f} ms -> {new_time * 1000:.2f} ms")
+    return regressions
+
+def print_results(results: dict):
+    for case in results["cases"]:
+        wall = case["wall_time_s"]
+        baseline = f"{wall['buffered_baseline'] * 1000:.2f} ms" if wall['buffered_baseline'] is not None else "skipped"
+        rss = f"{case['peak_rss_bytes'] / 2 ** 20:.1f} MiB" if case.get('peak_rss_bytes') is not None else "n/a"
+        print(f"{case['name']} ({case['hit_objects']} hit objects): parse {wall['parse'] * 1000:.2f} ms "
+              f"({case['hit_objects_per_s']['parse']:,.0f} obj/s), with objects {wall['parse_with_objects'] * 1000:.2f} ms, "
+              f"buffered baseline {baseline}, "
+              f"peak alloc {case['tracemalloc_peak_bytes']['parse'] / 2 ** 20:.1f} MiB, peak RSS {rss}")
+        print("    " + ", ".join(f"{name} {seconds * 1000:.2f} ms" for name, seconds in case["sections_s"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the .osu parser.")
+    parser.add_argument("--maps", nargs="*", default=None, help="Maps to benchmark (default: every .osu under data/)")
+    parser.add_argument("--sizes", nargs="*", type=int, default=SYNTHETIC_SIZES, help="Hit object counts of the synthetic maps")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.2, help="Allowed slowdown relative to the baseline")
+    args = parser.parse_args()
+
+    results = run(args.maps or find_maps(), args.sizes, args.repeats)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
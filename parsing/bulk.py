@@ -0,0 +1,99 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from parsing.parse import Beatmap, create_beatmap_from_file
+
+class ParseResult:
+    def __init__(self,
+                 path: str,
+                 beatmap: Optional[Beatmap] = None,
+                 error: Optional[str] = None):
+        self.path: str = path
+        self.beatmap: Optional[Beatmap] = beatmap
+        self.error: Optional[str] = error  # "ExceptionType: message" if parsing failed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+def _parse_chunk(
+    paths: List[str],
+    parser: Callable
+) -> List[ParseResult]:
+    """
+    Parse a chunk of files in a worker, recording failures instead of raising.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append(ParseResult(path, beatmap=parser(path)))
+        except Exception as e:
+            results.append(ParseResult(path, error=f"{type(e).__name__}: {e}"))
+    return results
+
+def _chunks(
+    iterable: Iterable[str],
+    size: int
+) -> Iterator[List[str]]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def parse_many(
+    paths: Iterable[str],
+    parser: Callable = create_beatmap_from_file,
+    max_workers: Optional[int] = None,
+    chunksize: int = 16,
+    max_pending: Optional[int] = None
+) -> Iterator[ParseResult]:
+    """
+    Parse many .osu files across a process pool, yielding results as they finish.
+
+    Parameters:
+    - paths: Iterable[str] - Paths of the .osu files. Consumed lazily, so a generator over a huge corpus is fine.
+    - parser: Callable - Picklable callable mapping a path to a Beatmap, or to any picklable value derived
+      from it, stored in ParseResult.beatmap (default is create_beatmap_from_file).
+    - max_workers: int - Number of worker processes (default is the number of CPUs).
+    - chunksize: int - Number of files sent to a worker at once.
+    - max_pending: int - Maximum number of chunks in flight (default is twice the number of workers).
+      Bounds peak memory: new chunks are only submitted once earlier results are consumed.
+
+    Returns:
+    - Iterator[ParseResult] - One result per path, in completion order. Failed files carry
+      `error` instead of raising, so one bad map does not abort the whole run.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * max_workers
+    chunks = _chunks(paths, chunksize)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_parse_chunk, chunk, parser) for chunk in islice(chunks, max_pending)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+            for chunk in islice(chunks, len(done)):
+                pending.add(executor.submit(_parse_chunk, chunk, parser))
+
+def find_beatmap_files(
+    directory: str
+) -> Iterator[str]:
+    """
+    Lazily walk a directory tree for .osu files.
+    """
+    for root, _, files in os.walk(directory):
+        for file in sorted(files):
+            if file.endswith('.osu'):
+                yield os.path.join(root, file)
+
+def parse_directory(
+    directory: str,
+    **kwargs
+) -> Iterator[ParseResult]:
+    """
+    Parse every .osu file below a directory (e.g. the Kaggle osu-beatmaps dataset)
+    in parallel. Keyword arguments are passed on to parse_many.
+    """
+    return parse_many(find_beatmap_files(directory), **kwargs)
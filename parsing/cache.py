@@ -0,0 +1,251 @@
+import hashlib, json, os, tempfile
+from typing import Callable, Optional
+
+import numpy as np
+
+from parsing.parse import (PARSER_VERSION, Beatmap, Colours, Difficulty, Editor, Events, General,
+                           HitObjectArrays, HitObjects, Metadata, TimingPoints, create_beatmap_from_lines)
+
+### DISK CACHE ###
+# Once full, the cache is evicted down to this share of max_bytes, so the directory is only scanned again after
+# another (1 - EVICTION_LOW_WATER) * max_bytes have been written
+EVICTION_LOW_WATER = 0.9
+
+class DiskCache:
+    """
+    A directory of files keyed by string, bounded to `max_bytes` by evicting
+    the least recently used entries. Safe to share between processes: entries
+    are written to a temporary file and atomically renamed into place.
+
+    The size of the directory is scanned once, then kept as a running total
+    that put() updates, so filling the cache is linear in the number of entries.
+    Each process only counts its own writes between scans, so a directory
+    shared by several processes can briefly exceed max_bytes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30, suffix: str = '.bin'):
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.suffix: str = suffix
+        self._total: Optional[int] = None  # Bytes in the directory, scanned on the first put
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # Every process scans the directory for itself
+        return {**self.__dict__, "_total": None}
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Path of the entry for `key`, or None on a miss. Marks the entry as recently used.
+        """
+
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, write: Callable) -> str:
+        """
+        Store an entry by calling `write(file)` on a binary file object.
+        """
+
+        if self._total is None:
+            self._total = self.size()
+        path = self.path_for(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                write(file)
+                written = file.tell()
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._total += written - replaced
+        if self._total > self.max_bytes:
+            self.evict(int(self.max_bytes * EVICTION_LOW_WATER))
+        return path
+
+    def size(self) -> int:
+        return sum(size for _, _, size in self._entries())
+
+    def evict(self, target: Optional[int] = None) -> None:
+        """
+        Delete least recently used entries until the cache fits in `target`
+        bytes (default is max_bytes).
+        """
+
+        target = self.max_bytes if target is None else target
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Evicted concurrently by another process
+            total -= size
+        self._total = total
+
+    def clear(self) -> None:
+        for path, _, _ in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._total = 0
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
+
+### BEATMAP SERIALIZATION ###
+MAGIC = b'OSUB'
+
+def save_beatmap(beatmap: Beatmap, file) -> None:
+    """
+    Write a parsed Beatmap in a compact binary form: a JSON header holding the
+    key/value sections and an index of raw array buffers (timing points, hit
+    object columns and the raw hit object lines) that follow it.
+    """
+
+    arrays = {f"hit_objects_{name}": column for name, column in beatmap.hitObjects.to_arrays().to_dict().items()}
+    arrays["timing_points"] = beatmap.timingPoints.to_numpy()
+    arrays["hit_object_lines"] = np.frombuffer('\n'.join(beatmap.hitObjects.to_lines()).encode('utf-8'), dtype=np.uint8)
+
+    index = {}
+    offset = 0
+    for name, array in arrays.items():
+        index[name] = {
+            "dtype": np.lib.format.dtype_to_descr(array.dtype),
+            "shape": array.shape,
+            "offset": offset
+        }
+        offset += array.nbytes
+
+    header = json.dumps({
+        "parser_version": PARSER_VERSION,
+        "general": beatmap.general.to_dict(),
+        "editor": beatmap.editor.to_dict(),
+        "metadata": beatmap.metadata.to_dict(),
+        "difficulty": beatmap.difficulty.to_dict(),
+        "events": beatmap.events.to_dict(),
+        "colours": beatmap.colours.to_dict(),
+        "arrays": index
+    }).encode('utf-8')
+
+    file.write(MAGIC)
+    file.write(len(header).to_bytes(4, 'little'))
+    file.write(header)
+    for array in arrays.values():
+        file.write(np.ascontiguousarray(array).tobytes())
+
+def _read_arrays(data: bytes, index: dict, start: int) -> dict:
+    arrays = {}
+    for name, entry in index.items():
+        dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=start + entry["offset"])
+        arrays[name] = array.reshape(shape).copy()
+    return arrays
+
+def _load_section(section, values: dict):
+    for key, value in values.items():
+        setattr(section, key, value)
+    return section
+
+def _as_tuple(value):
+    return tuple(value) if value is not None else None
+
+def load_beatmap(file_path: str) -> Beatmap:
+    """
+    Read a Beatmap written by save_beatmap without touching the .osu text parser.
+    """
+
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if data[:4] != MAGIC:
+        raise ValueError("Cache: Not a cached beatmap")
+    header_length = int.from_bytes(data[4:8], 'little')
+    header = json.loads(data[8:8 + header_length].decode('utf-8'))
+    if header["parser_version"] != PARSER_VERSION:
+        raise ValueError(f"Cache: Parser version mismatch (cached {header['parser_version']}, current {PARSER_VERSION})")
+    arrays = _read_arrays(data, header["arrays"], 8 + header_length)
+
+    hit_object_arrays = HitObjectArrays()
+    for name in hit_object_arrays.to_dict():
+        setattr(hit_object_arrays, name, arrays[f"hit_objects_{name}"])
+    lines = arrays["hit_object_lines"].tobytes().decode('utf-8')
+    hit_objects = HitObjects.from_arrays(hit_object_arrays, lines.split('\n') if lines else [])
+    timing_points = TimingPoints.from_numpy(arrays["timing_points"])
+
+    # JSON turns tuples into lists
+    events = _load_section(Events(), header["events"])
+    for event in events.events:
+        if "offset" in event:
+            event["offset"] = tuple(event["offset"])
+    colours = Colours()
+    colours.combo_colors = {key: tuple(value) for key, value in header["colours"]["combo_colors"].items()}
+    colours.slider_track_override = _as_tuple(header["colours"]["slider_track_override"])
+    colours.slider_border = _as_tuple(header["colours"]["slider_border"])
+
+    return Beatmap(
+        _load_section(General(), header["general"]),
+        _load_section(Editor(), header["editor"]),
+        _load_section(Metadata(), header["metadata"]),
+        _load_section(Difficulty(), header["difficulty"]),
+        events,
+        timing_points,
+        colours,
+        hit_objects
+    )
+
+### BEATMAP CACHE ###
+class BeatmapCache:
+    """
+    Drop-in replacement for create_beatmap_from_file that keeps a binary copy
+    of every parsed Beatmap, keyed by the hash of the .osu contents and the
+    parser version. Instances are picklable, so they can be handed to
+    parsing.bulk.parse_many as the parser.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.cache: DiskCache = DiskCache(directory, max_bytes, suffix='.osub')
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        digest = hashlib.blake2b(content, digest_size=20)
+        digest.update(f"parser-v{PARSER_VERSION}".encode())
+        return digest.hexdigest()
+
+    def __call__(self, file_path: str) -> Beatmap:
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        key = self.key(content)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            try:
+                return load_beatmap(cached)
+            except (OSError, ValueError, KeyError):
+                pass  # Corrupt, or evicted while reading; fall back to parsing
+
+        beatmap = create_beatmap_from_lines(content.decode('utf-8').splitlines())
+        self.cache.put(key, lambda file: save_beatmap(beatmap, file))
+        return beatmap
@@ -0,0 +1,197 @@
+import os, sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from parsing.bulk import find_beatmap_files, parse_many
+from parsing.parse import create_beatmap_from_file
+from parsing.star_rating import star_ratings
+
+# Sections needed for a row; Editor, TimingPoints and Colours are skipped
+INDEX_SECTIONS = ["General", "Metadata", "Difficulty", "Events", "HitObjects"]
+
+# Column name -> SQLite type. Beatmap fields keep their .osu key names.
+COLUMNS = {
+    "path": "TEXT PRIMARY KEY",
+    "mtime": "REAL",
+    "size": "INTEGER",
+    "error": "TEXT",  # Set (and everything below NULL) if the file failed to parse
+    "AudioFilename": "TEXT",
+    "Mode": "INTEGER",
+    "StackLeniency": "REAL",
+    "Title": "TEXT",
+    "Artist": "TEXT",
+    "Creator": "TEXT",
+    "Version": "TEXT",
+    "Source": "TEXT",
+    "Tags": "TEXT",  # Space separated
+    "BeatmapID": "INTEGER",
+    "BeatmapSetID": "INTEGER",
+    "HPDrainRate": "REAL",
+    "CircleSize": "REAL",
+    "OverallDifficulty": "REAL",
+    "ApproachRate": "REAL",
+    "SliderMultiplier": "REAL",
+    "SliderTickRate": "REAL",
+    "hit_objects": "INTEGER",
+    "circles": "INTEGER",
+    "sliders": "INTEGER",
+    "spinners": "INTEGER",
+    "length": "INTEGER",  # ms from the first to the last hit object
+    "drain_length": "INTEGER",  # length minus breaks, in ms
+    "aim_rating": "REAL",  # See parsing.star_rating
+    "speed_rating": "REAL",
+    "star_rating": "REAL"
+}
+
+INDEXED_COLUMNS = ["Mode", "Creator", "BeatmapSetID", "CircleSize", "OverallDifficulty", "ApproachRate", "star_rating"]
+
+def extract_row(file_path: str) -> Dict:
+    """
+    Parse one .osu file into a row of the corpus index (minus path/mtime/size).
+    """
+    beatmap = create_beatmap_from_file(file_path, sections=INDEX_SECTIONS)
+    general, metadata, difficulty = beatmap.general, beatmap.metadata, beatmap.difficulty
+    arrays = beatmap.hitObjects.to_arrays()
+
+    if len(arrays):
+        start, end = int(arrays.time.min()), int(np.maximum(arrays.time, arrays.end_time).max())
+    else:
+        start = end = 0
+    breaks = sum(max(0, min(event["endTime"], end) - max(event["startTime"], start))
+                 for event in beatmap.events.events if event["type"] == "Break")
+    rating = star_ratings([beatmap])[0]
+
+    return {
+        "AudioFilename": general.AudioFilename,
+        "Mode": general.Mode,
+        "StackLeniency": general.StackLeniency,
+        "Title": metadata.Title,
+        "Artist": metadata.Artist,
+        "Creator": metadata.Creator,
+        "Version": metadata.Version,
+        "Source": metadata.Source,
+        "Tags": " ".join(metadata.Tags),
+        "BeatmapID": metadata.BeatmapID,
+        "BeatmapSetID": metadata.BeatmapSetID,
+        "HPDrainRate": difficulty.HPDrainRate,
+        "CircleSize": difficulty.CircleSize,
+        "OverallDifficulty": difficulty.OverallDifficulty,
+        "ApproachRate": difficulty.ApproachRate,
+        "SliderMultiplier": difficulty.SliderMultiplier,
+        "SliderTickRate": difficulty.SliderTickRate,
+        "hit_objects": len(arrays),
+        "circles": int(arrays.is_circle.sum()),
+        "sliders": int(arrays.is_slider.sum()),
+        "spinners": int(arrays.is_spinner.sum()),
+        "length": end - start,
+        "drain_length": end - start - breaks,
+        "aim_rating": float(rating['aim']),
+        "speed_rating": float(rating['speed']),
+        "star_rating": float(rating['stars'])
+    }
+
+class CorpusIndex:
+    """
+    SQLite table with one row of General/Metadata/Difficulty fields, hit object
+    counts, drain length and star rating per .osu file, so training subsets can
+    be selected with a query instead of parsing the whole corpus.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path: str = db_path
+        self.connection: sqlite3.Connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        columns = ", ".join(f'"{name}" {sql_type}' for name, sql_type in COLUMNS.items())
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS beatmaps ({columns})")
+        # Indexes created before a column was added get it, and every file is reindexed on the next update
+        existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(beatmaps)")}
+        missing = [name for name in COLUMNS if name not in existing]
+        for name in missing:
+            self.connection.execute(f'ALTER TABLE beatmaps ADD COLUMN "{name}" {COLUMNS[name]}')
+        if missing:
+            self.connection.execute("UPDATE beatmaps SET mtime = NULL")
+        for name in INDEXED_COLUMNS:
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS beatmaps_{name} ON beatmaps ("{name}")')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> 'CorpusIndex':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(
+        self,
+        directory: str,
+        prune: bool = True,
+        **kwargs
+    ) -> Tuple[int, List[str]]:
+        """
+        Incrementally index a directory of .osu files. Only files that are new
+        or whose mtime/size changed since the last update are parsed (in
+        parallel, keyword arguments go to parsing.bulk.parse_many).
+
+        Parameters:
+        - directory: str - Root of the corpus.
+        - prune: bool - Drop rows of files below `directory` that no longer exist (default is True).
+
+        Returns:
+        - int - Number of (re)indexed files.
+        - List[str] - "path: error" for every file that failed to parse.
+        """
+        directory = os.path.abspath(directory)
+        known = {row["path"]: (row["mtime"], row["size"])
+                 for row in self.connection.execute("SELECT path, mtime, size FROM beatmaps")}
+
+        stats = {}
+        for path in find_beatmap_files(directory):
+            stat = os.stat(path)
+            stats[path] = (stat.st_mtime, stat.st_size)
+        stale = [path for path, stat in stats.items() if known.get(path) != stat]
+
+        errors = []
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        names = ", ".join(f'"{name}"' for name in COLUMNS)
+        for result in parse_many(stale, parser=extract_row, **kwargs):
+            row = dict.fromkeys(COLUMNS)
+            if result.ok:
+                row.update(result.beatmap)
+            else:
+                row["error"] = result.error
+                errors.append(f"{result.path}: {result.error}")
+            row["path"] = result.path
+            row["mtime"], row["size"] = stats[result.path]
+            self.connection.execute(f"INSERT OR REPLACE INTO beatmaps ({names}) VALUES ({placeholders})", list(row.values()))
+
+        if prune:
+            removed = [(path,) for path in known if path.startswith(directory + os.sep) and path not in stats]
+            self.connection.executemany("DELETE FROM beatmaps WHERE path = ?", removed)
+
+        self.connection.commit()
+        return len(stale), errors
+
+    def query(
+        self,
+        where: Optional[str] = None,
+        params: Sequence = (),
+        columns: str = "*"
+    ) -> List[sqlite3.Row]:
+        """
+        Rows of successfully parsed maps matching an SQL condition, e.g.
+        query("Mode = ? AND ApproachRate BETWEEN ? AND ?", (0, 8, 10)).
+        """
+        sql = f"SELECT {columns} FROM beatmaps WHERE error IS NULL"
+        if where:
+            sql += f" AND ({where})"
+        return self.connection.execute(sql, params).fetchall()
+
+    def select_paths(
+        self,
+        where: Optional[str] = None,
+        params: Sequence = ()
+    ) -> List[str]:
+        return [row["path"] for row in self.query(where, params, columns="path")]
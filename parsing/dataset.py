@@ -0,0 +1,252 @@
+import contextlib, json, os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from parsing.bulk import parse_many
+from parsing.parse import TIMING_POINT_DTYPE, Beatmap, HitObjectArrays
+
+DIFFICULTY_DTYPE = np.dtype([
+    ('HPDrainRate', np.float32),
+    ('CircleSize', np.float32),
+    ('OverallDifficulty', np.float32),
+    ('ApproachRate', np.float32),
+    ('SliderMultiplier', np.float32),
+    ('SliderTickRate', np.float32)
+])
+
+# One row per map: where its rows live in each of the flat arrays
+INDEX_DTYPE = np.dtype([
+    ('map_id', np.int64),  # Metadata.BeatmapID
+    ('hit_object_offset', np.int64),
+    ('hit_object_count', np.int64),
+    ('curve_offsets_offset', np.int64),  # count is hit_object_count + 1
+    ('curve_point_offset', np.int64),
+    ('curve_point_count', np.int64),
+    ('timing_point_offset', np.int64),
+    ('timing_point_count', np.int64)
+])
+
+# Per-object HitObjectArrays columns, concatenated over all maps
+HIT_OBJECT_COLUMNS = ['x', 'y', 'time', 'type_flags', 'hit_sound', 'new_combo',
+                      'combo_skip', 'end_time', 'slides', 'length', 'curve_type']
+
+MANIFEST = 'manifest.json'
+
+### WRITER ###
+class _ArrayWriter:
+    """
+    Appends arrays of one dtype to a raw binary file, so packing never holds
+    more than one map in memory.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype, row_shape: Tuple = ()):
+        self.file = open(path, 'wb')
+        self.dtype: np.dtype = dtype
+        self.row_shape: Tuple = row_shape
+        self.rows: int = 0
+
+    def append(self, array: np.ndarray) -> int:
+        """
+        Write the rows of `array` and return the row offset they start at.
+        """
+        offset = self.rows
+        self.file.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+        self.rows += len(array)
+        return offset
+
+    def close(self) -> dict:
+        self.file.close()
+        return {
+            "dtype": np.lib.format.dtype_to_descr(self.dtype),
+            "shape": [self.rows, *self.row_shape]
+        }
+
+    def __enter__(self) -> '_ArrayWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+def pack_beatmaps(
+    beatmaps: Iterable[Tuple[str, Beatmap]],
+    directory: str
+) -> int:
+    """
+    Pack many parsed beatmaps into a few large flat arrays plus an index table.
+
+    Parameters:
+    - beatmaps: Iterable[Tuple[str, Beatmap]] - (source name, beatmap) pairs. Consumed lazily.
+    - directory: str - Output directory; one raw .bin file per array and a manifest.json.
+
+    Returns:
+    - int - The number of packed maps.
+    """
+    os.makedirs(directory, exist_ok=True)
+    empty = HitObjectArrays()
+    with contextlib.ExitStack() as stack:
+        # Every file is closed, even if packing fails halfway
+        def writer(name: str, dtype: np.dtype, row_shape: Tuple = ()) -> _ArrayWriter:
+            return stack.enter_context(_ArrayWriter(os.path.join(directory, f"{name}.bin"), dtype, row_shape))
+
+        writers = {f"hit_objects_{name}": writer(f"hit_objects_{name}", getattr(empty, name).dtype)
+                   for name in HIT_OBJECT_COLUMNS}
+        writers["curve_offsets"] = writer("curve_offsets", np.dtype(np.int64))
+        writers["curve_points"] = writer("curve_points", np.dtype(np.int32), (2,))
+        writers["timing_points"] = writer("timing_points", TIMING_POINT_DTYPE)
+        writers["difficulty"] = writer("difficulty", DIFFICULTY_DTYPE)
+        writers["index"] = writer("index", INDEX_DTYPE)
+
+        sources = []
+        for source, beatmap in beatmaps:
+            arrays = beatmap.hitObjects.to_arrays()
+            timing_points = beatmap.timingPoints.to_numpy()
+
+            # The hit object columns are appended in lockstep, so they share one offset
+            hit_object_offset = writers["hit_objects_time"].rows
+            for name in HIT_OBJECT_COLUMNS:
+                writers[f"hit_objects_{name}"].append(getattr(arrays, name))
+            row = (
+                beatmap.metadata.BeatmapID,
+                hit_object_offset,
+                len(arrays),
+                writers["curve_offsets"].append(arrays.curve_offsets),
+                writers["curve_points"].append(arrays.curve_points),
+                len(arrays.curve_points),
+                writers["timing_points"].append(timing_points),
+                len(timing_points)
+            )
+            writers["index"].append(np.array([row], dtype=INDEX_DTYPE))
+
+            difficulty = beatmap.difficulty
+            writers["difficulty"].append(np.array([tuple(getattr(difficulty, name) for name in DIFFICULTY_DTYPE.names)],
+                                                  dtype=DIFFICULTY_DTYPE))
+            sources.append(source)
+
+        manifest = {
+            "arrays": {name: array_writer.close() for name, array_writer in writers.items()},
+            "sources": sources
+        }
+        with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as file:
+            json.dump(manifest, file)
+    return len(sources)
+
+def pack_files(
+    paths: Iterable[str],
+    directory: str,
+    **kwargs
+) -> List[str]:
+    """
+    Parse .osu files in parallel (see parsing.bulk.parse_many, which receives
+    the keyword arguments) and pack them into `directory`.
+
+    Returns:
+    - List[str] - "path: error" for every file that failed to parse and was skipped.
+    """
+    errors = []
+
+    def parsed() -> Iterator[Tuple[str, Beatmap]]:
+        for result in parse_many(paths, **kwargs):
+            if result.ok:
+                yield result.path, result.beatmap
+            else:
+                errors.append(f"{result.path}: {result.error}")
+
+    pack_beatmaps(parsed(), directory)
+    return errors
+
+### READER ###
+class PackedBeatmap:
+    def __init__(self,
+                 source: str,
+                 map_id: int,
+                 hit_objects: HitObjectArrays,
+                 timing_points: np.ndarray,
+                 difficulty: np.void):
+        self.source: str = source
+        self.map_id: int = map_id
+        self.hit_objects: HitObjectArrays = hit_objects  # Read-only views into the packed arrays
+        self.timing_points: np.ndarray = timing_points  # TIMING_POINT_DTYPE view
+        self.difficulty: np.void = difficulty  # DIFFICULTY_DTYPE record
+
+class PackedBeatmaps:
+    """
+    Random access to a directory written by pack_beatmaps. Every array is an
+    np.memmap, so maps are served as zero-copy slices and all processes reading
+    the same pack share the OS page cache. Pickling only carries the directory,
+    so instances can be handed to DataLoader workers.
+    """
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.directory, MANIFEST), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        self.sources: List[str] = manifest["sources"]
+        self.arrays: Dict[str, np.ndarray] = {}
+        for name, entry in manifest["arrays"].items():
+            dtype = np.lib.format.descr_to_dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            if shape[0] == 0:
+                self.arrays[name] = np.zeros(shape, dtype=dtype)  # np.memmap cannot map an empty file
+            else:
+                self.arrays[name] = np.memmap(os.path.join(self.directory, f"{name}.bin"), dtype=dtype, mode='r', shape=shape)
+        self.index: np.ndarray = self.arrays["index"]
+        self.difficulty: np.ndarray = self.arrays["difficulty"]
+        self._positions: Optional[Dict[int, List[int]]] = None
+
+    def __getstate__(self):
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.directory = state["directory"]
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> PackedBeatmap:
+        row = self.index[i]
+        start, count = row['hit_object_offset'], row['hit_object_count']
+
+        hit_objects = HitObjectArrays()
+        for name in HIT_OBJECT_COLUMNS:
+            setattr(hit_objects, name, self.arrays[f"hit_objects_{name}"][start:start + count])
+        offsets_start = row['curve_offsets_offset']
+        hit_objects.curve_offsets = self.arrays["curve_offsets"][offsets_start:offsets_start + count + 1]
+        points_start = row['curve_point_offset']
+        hit_objects.curve_points = self.arrays["curve_points"][points_start:points_start + row['curve_point_count']]
+
+        timing_start = row['timing_point_offset']
+        timing_points = self.arrays["timing_points"][timing_start:timing_start + row['timing_point_count']]
+
+        return PackedBeatmap(self.sources[i], int(row['map_id']), hit_objects, timing_points, self.difficulty[i])
+
+    def __iter__(self) -> Iterator[PackedBeatmap]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def positions(self, map_id: int) -> List[int]:
+        """
+        Rows of every map with the given BeatmapID (several for unsubmitted maps,
+        which share BeatmapID 0, or for a map packed more than once).
+        """
+        if self._positions is None:
+            self._positions = {}
+            for i, row_id in enumerate(self.index['map_id'].tolist()):
+                self._positions.setdefault(row_id, []).append(i)
+        return list(self._positions.get(map_id, []))
+
+    def position(self, map_id: int) -> int:
+        """
+        Row of the map with the given BeatmapID. Raises KeyError if there is
+        none and ValueError if several maps share the ID (see positions).
+        """
+        positions = self.positions(map_id)
+        if not positions:
+            raise KeyError(map_id)
+        if len(positions) > 1:
+            raise ValueError(f"Dataset: {len(positions)} maps with BeatmapID {map_id}")
+        return positions[0]
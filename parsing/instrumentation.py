@@ -0,0 +1,211 @@
+import json, os, platform, sys, threading, time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident set size of this process in bytes.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def current_rss() -> Optional[int]:
+    """
+    Resident set size of this process in bytes, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class _RSSSampler:
+    """
+    Tracks the peak RSS of the process while a stage runs by polling it from a
+    background thread. Where RSS cannot be polled, falls back to the lifetime
+    peak reported by getrusage.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval: float = interval
+        self.peak: Optional[int] = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self) -> '_RSSSampler':
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.peak is None:
+            self.peak = peak_rss()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss() or 0)
+
+class StageRecord:
+    def __init__(self,
+                 song: str,
+                 stage: str,
+                 audio_s: Optional[float] = None):
+        self.song: str = song
+        self.stage: str = stage
+        self.audio_s: Optional[float] = audio_s  # Seconds of audio the stage processed
+        self.wall_s: float = 0.0
+        self.cpu_s: float = 0.0  # CPU time of every thread of the process, not of worker processes
+        self.peak_rss_bytes: Optional[int] = None
+        self.error: Optional[str] = None  # "ExceptionType: message" if the stage raised
+
+    @property
+    def real_time_factor(self) -> Optional[float]:
+        """
+        Wall time per second of audio; below 1 is faster than real time.
+        """
+        return self.wall_s / self.audio_s if self.audio_s else None
+
+    def to_dict(self) -> Dict:
+        return {
+            "song": self.song,
+            "stage": self.stage,
+            "audio_s": self.audio_s,
+            "wall_s": self.wall_s,
+            "cpu_s": self.cpu_s,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            "real_time_factor": self.real_time_factor,
+            "error": self.error
+        }
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'StageRecord':
+        record = StageRecord(data["song"], data["stage"], data["audio_s"])
+        record.wall_s, record.cpu_s = data["wall_s"], data["cpu_s"]
+        record.peak_rss_bytes, record.error = data["peak_rss_bytes"], data["error"]
+        return record
+
+def environment() -> Dict[str, str]:
+    """
+    Library versions the timings depend on, to tell regressions apart from upgrades.
+    """
+    # Imported here so the parser benchmark can use peak_rss without the audio stack
+    import librosa
+
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "librosa": librosa.__version__,
+        "platform": platform.platform()
+    }
+
+class PipelineReport:
+    """
+    Wall time, CPU time, peak RSS and audio seconds of every stage of the audio
+    pipeline, per song. Pass one to audio_processing (or run_batch) to fill it;
+    if `log_path` is given, every record is also appended to that file as a JSON
+    line as soon as its stage finishes.
+    """
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.records: List[StageRecord] = []
+        self.log_path: Optional[str] = log_path
+        self.environment: Dict[str, str] = environment()
+        self._lock = threading.Lock()
+
+    def add(self, record: StageRecord):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps({**record.to_dict(), "environment": self.environment, "timestamp": time.time()}) + '\n')
+
+    @contextmanager
+    def stage(
+        self,
+        song: str,
+        stage: str,
+        audio_s: Optional[float] = None
+    ) -> Iterator[StageRecord]:
+        """
+        Measure the enclosed block as one stage of `song`. The record is yielded
+        so audio_s can be filled in once known (e.g. after decoding). A stage
+        that raises is recorded with its error and the exception propagates.
+        """
+        record = StageRecord(song, stage, audio_s)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            with _RSSSampler() as sampler:
+                yield record
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.wall_s = time.perf_counter() - wall
+            record.cpu_s = time.process_time() - cpu
+            record.peak_rss_bytes = sampler.peak
+            self.add(record)
+
+    def by_song(self) -> Dict[str, List[StageRecord]]:
+        songs = {}
+        for record in self.records:
+            songs.setdefault(record.song, []).append(record)
+        return songs
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Totals per stage over all songs: wall and CPU time, audio seconds, the
+        resulting real-time factor and the highest peak RSS.
+        """
+        stages = {}
+        for record in self.records:
+            totals = stages.setdefault(record.stage, {"songs": 0, "errors": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                                      "audio_s": 0.0, "peak_rss_bytes": None})
+            totals["songs"] += 1
+            totals["errors"] += record.error is not None
+            totals["wall_s"] += record.wall_s
+            totals["cpu_s"] += record.cpu_s
+            totals["audio_s"] += record.audio_s or 0.0
+            if record.peak_rss_bytes is not None:
+                totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"] or 0, record.peak_rss_bytes)
+        for totals in stages.values():
+            totals["real_time_factor"] = totals["wall_s"] / totals["audio_s"] if totals["audio_s"] else None
+        return stages
+
+    def to_dict(self) -> Dict:
+        return {
+            "environment": self.environment,
+            "summary": self.summary(),
+            "records": [record.to_dict() for record in self.records]
+        }
+
+    def write_json(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+def stage(
+    report: Optional[PipelineReport],
+    song: str,
+    name: str,
+    audio_s: Optional[float] = None
+):
+    """
+    report.stage(...), or a no-op yielding a throwaway record when there is no report.
+    """
+    if report is None:
+        return nullcontext(StageRecord(song, name, audio_s))
+    return report.stage(song, name, audio_s)
@@ -1,5 +1,9 @@
 import numpy as np
-from typing import List, Dict, Tuple, Union, Optional
+from typing import List, Dict, Iterable, Tuple, Union, Optional
+
+# Bump whenever a change to the parser alters the parsed result, so that
+# anything derived from parsed beatmaps (e.g. parsing.cache) is invalidated
+PARSER_VERSION = 1
 
 ### SECTIONS ###
 class Section:
@@ -13,14 +17,30 @@ class Section:
 
         for line in data_string.strip().split('\n'):
             line = line.strip()
-            if ':' in line:
-                key, value = line.split(':', 1)
-                key = key.strip()
-                value = value.strip()
+            if line:
+                self.load_line(line)
+        self.finish()
+
+    def load_line(self, line: str) -> None:
+        """
+        Parse a single stripped, non-empty line of the section
+        """
+
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+
+            # Assign value to the corresponding attribute
+            if hasattr(self, key):
+                setattr(self, key, self._cast_value(key, value))
+
+    def finish(self) -> None:
+        """
+        Called once every line of the section has been loaded
+        """
 
-                # Assign value to the corresponding attribute
-                if hasattr(self, key):
-                    setattr(self, key, self._cast_value(key, value))
+        pass
 
     def to_dict(self) -> dict:
         """
@@ -133,11 +153,9 @@ class Events(Section):
     def __init__(self):
         self.events: List[Dict] = []
 
-    def load_from_string(self, data_string: str):
-        for line in data_string.strip().split('\n'):
-            line = line.strip()
-            if line and not line.startswith('//'):  # Ignore empty lines and comments
-                self.events.append(self._parse_event_line(line))
+    def load_line(self, line: str):
+        if not line.startswith('//'):  # Ignore comments
+            self.events.append(self._parse_event_line(line))
 
     def _parse_event_line(self, line: str):
         parts = line.split(',')
@@ -174,23 +192,20 @@ class Colours(Section):
         self.slider_track_override: Optional[Tuple] = None
         self.slider_border: Optional[Tuple] = None
 
-    def load_from_string(self, data_string: str):
-        for line in data_string.strip().split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split(':')
-                if len(parts) == 2:
-                    key = parts[0].strip()
-                    value = tuple(map(int, parts[1].strip().split(',')))
-
-                    if key.startswith('Combo'):
-                        self.combo_colors[key] = value
-                    elif key == 'SliderTrackOverride':
-                        self.slider_track_override = value
-                    elif key == 'SliderBorder':
-                        self.slider_border = value
-                    else:
-                        raise Exception("Colours: Key not found")
+    def load_line(self, line: str):
+        parts = line.split(':')
+        if len(parts) == 2:
+            key = parts[0].strip()
+            value = tuple(map(int, parts[1].strip().split(',')))
+
+            if key.startswith('Combo'):
+                self.combo_colors[key] = value
+            elif key == 'SliderTrackOverride':
+                self.slider_track_override = value
+            elif key == 'SliderBorder':
+                self.slider_border = value
+            else:
+                raise Exception("Colours: Key not found")
 
     def to_dict(self) -> dict:
         return {
@@ -200,42 +215,315 @@ class Colours(Section):
         }
 
 ### DATA ###
-class TimingPoints:
+TIMING_POINT_DTYPE = np.dtype([
+    ('time', np.int32),
+    ('beat_length', np.float64),
+    ('meter', np.int16),
+    ('sample_set', np.uint8),
+    ('sample_index', np.int32),
+    ('volume', np.uint8),
+    ('uninherited', np.bool_),
+    ('effects', np.uint8)
+])
+
+class _ObservedList(list):
+    """
+    A list that calls on_change after every in-place edit
+    """
+
+    def __init__(self, items, on_change):
+        super().__init__(items)
+        self._on_change = on_change
+
+def _observed(name):
+    method = getattr(list, name)
+
+    def edit(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._on_change()
+        return result
+
+    edit.__name__ = name
+    return edit
+
+for _name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert',
+              'pop', 'remove', 'clear', 'sort', 'reverse']:
+    setattr(_ObservedList, _name, _observed(_name))
+
+class TimingPoints(Section):
     def __init__(self):
-        self.timing_points: List[List[Union[int, float]]] = []
+        self._rows: Optional[List[Tuple]] = []  # None while wrapping an array from from_numpy
+        self._points: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+        self._view: Optional[_ObservedList] = None  # Cached timing_points list
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_points'] = self.points
+        state['_view'] = None
+        return state
+
+    def load_line(self, line: str):
+        parts = line.split(',')
+        if len(parts) >= 8:
+            if self._points is None and self._view is not None:
+                self._rows = [tuple(point) for point in self._view]
+            elif self._rows is None:
+                self._rows = self._points.tolist()
+            self._rows.append((
+                int(parts[0]),     # time
+                float(parts[1]),  # beat_length
+                int(parts[2]),    # meter
+                int(parts[3]),    # sample_set
+                int(parts[4]),    # sample_index
+                int(parts[5]),    # volume
+                bool(int(parts[6])),  # uninherited
+                int(parts[7])     # effects
+            ))
+            self._points = None
+            self._view = None
+        else:
+            raise Exception(f"TimingPoints: Incorrect number of arguments (Need 8, got {len(parts)})")
 
-    def load_from_string(self, data_string: str):
-        for line in data_string.strip().split('\n'):
-            line = line.strip()
-            if line:
-                parts = line.split(',')
-                if len(parts) >= 8:
-                    self.timing_points.append([
-                        int(parts[0]),     # time
-                        float(parts[1]),  # beat_length
-                        int(parts[2]),    # meter
-                        int(parts[3]),    # sample_set
-                        int(parts[4]),    # sample_index
-                        int(parts[5]),    # volume
-                        bool(int(parts[6])),  # uninherited
-                        int(parts[7])     # effects
-                    ])
-                else:
-                    raise Exception(f"TimingPoints: Incorrect number of arguments (Need 8, got {len(parts)})")
+    def finish(self):
+        self._build()
+
+    @staticmethod
+    def from_numpy(points: np.ndarray) -> 'TimingPoints':
+        """
+        Wrap a TIMING_POINT_DTYPE array (e.g. a PackedBeatmap view) without copying it into rows
+        """
+
+        timing_points = TimingPoints()
+        timing_points._rows = None
+        timing_points._points = np.asarray(points, dtype=TIMING_POINT_DTYPE)
+        timing_points._sort()
+        return timing_points
+
+    def _build(self):
+        self._points = np.array(self._rows, dtype=TIMING_POINT_DTYPE)
+        self._sort()
+
+    def _sort(self):
+        # Stable, so points sharing a timestamp keep their file order (the later one wins)
+        self._order = np.argsort(self._points['time'], kind='stable')
+
+    @property
+    def points(self) -> np.ndarray:
+        """
+        Timing points as a structured array of TIMING_POINT_DTYPE, in file order
+        """
+
+        if self._points is None:
+            if self._view is not None:
+                # The list view was edited in place; watch the rows it gained too
+                for i, point in enumerate(self._view):
+                    if not isinstance(point, _ObservedList):
+                        list.__setitem__(self._view, i, _ObservedList(point, self._edited))
+                self._rows = [tuple(point) for point in self._view]
+            self._build()
+        return self._points
+
+    def _edited(self):
+        self._points = None
+
+    @property
+    def timing_points(self) -> List[List[Union[int, float]]]:
+        """
+        The timing points as a list of [time, beat_length, meter, sample_set,
+        sample_index, volume, uninherited, effects] lists. The list is built
+        once and kept; editing it (or one of its rows) in place updates points.
+        """
+
+        if self._view is None:
+            self._view = _ObservedList((_ObservedList(point, self._edited) for point in self.points.tolist()),
+                                       self._edited)
+        return self._view
+
+    @timing_points.setter
+    def timing_points(self, timing_points: List[List[Union[int, float]]]):
+        self._rows = [tuple(point) for point in timing_points]
+        self._view = None
+        self._build()
 
     def to_numpy(self) -> np.ndarray:
-        return np.array(self.timing_points)
+        return self.points
+
+    def to_dict(self) -> dict:
+        return {"timing_points": self.timing_points}
+
+    def _active(self, times, uninherited_only: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        For every timestamp, the index (into self.points) of the last timing
+        point at or before it. Timestamps before the first point map to the
+        first point. Also returns a mask of timestamps that have no point at all.
+        """
+
+        points = self.points
+        order = self._order
+        if uninherited_only:
+            order = order[points['uninherited'][order]]
+
+        times = np.asarray(times)
+        if len(order) == 0:
+            return np.zeros(times.shape, dtype=np.int64), np.ones(times.shape, dtype=np.bool_)
+
+        idx = np.searchsorted(points['time'][order], times, side='right') - 1
+        return order[np.clip(idx, 0, None)], np.zeros(times.shape, dtype=np.bool_)
+
+    def beat_length_at(self, times) -> np.ndarray:
+        """
+        Beat duration in ms of the uninherited timing point active at each timestamp
+        """
+
+        idx, missing = self._active(times, uninherited_only=True)
+        if missing.any():
+            raise Exception("TimingPoints: No uninherited timing point")
+        return self.points['beat_length'][idx]
+
+    def bpm_at(self, times) -> np.ndarray:
+        """
+        BPM active at each timestamp
+        """
+
+        return 60000 / self.beat_length_at(times)
+
+    def beat_phase_at(self, times) -> np.ndarray:
+        """
+        Number of beats (fractional) elapsed at each timestamp since the
+        uninherited timing point active at it
+        """
+
+        idx, missing = self._active(times, uninherited_only=True)
+        if missing.any():
+            raise Exception("TimingPoints: No uninherited timing point")
+        points = self.points[idx]
+        return (np.asarray(times) - points['time']) / points['beat_length']
+
+    def beat_times(self, end: float, divisor: int = 1) -> np.ndarray:
+        """
+        Times in ms of every 1/divisor beat before `end`, restarting the grid at
+        every uninherited timing point. The first point's grid extends back to 0.
+        """
+
+        points = self.points
+        order = self._order[points['uninherited'][self._order]]
+        if len(order) == 0:
+            raise Exception("TimingPoints: No uninherited timing point")
+        starts = points['time'][order].astype(np.float64)
+        ticks = points['beat_length'][order] / divisor
+        starts[0] -= np.floor(starts[0] / ticks[0]) * ticks[0]
+
+        counts = np.ceil((np.append(starts[1:], end) - starts) / ticks).clip(0).astype(np.int64)
+        section = np.repeat(np.arange(len(starts)), counts)
+        beat = np.arange(len(section)) - np.repeat(np.cumsum(counts) - counts, counts)
+        times = starts[section] + beat * ticks[section]
+        return times[times < end]
+
+    def slider_velocity_at(self, times) -> np.ndarray:
+        """
+        Slider velocity multiplier active at each timestamp. Uninherited points
+        reset it to 1, inherited points set it to -100 / beat_length.
+        """
+
+        idx, missing = self._active(times)
+        if missing.all():
+            return np.ones(missing.shape)
+        active = self.points[idx]
+        with np.errstate(divide='ignore'):
+            inherited_sv = np.clip(-100 / active['beat_length'], 0.1, 10)
+        return np.where(active['uninherited'], 1.0, inherited_sv)
 
-class HitObjects:
+    def kiai_at(self, times) -> np.ndarray:
+        """
+        Whether kiai time is active at each timestamp
+        """
+
+        idx, missing = self._active(times)
+        if missing.all():
+            return np.zeros(missing.shape, dtype=np.bool_)
+        return (self.points['effects'][idx] & 1) > 0
+
+class HitObjects(Section):
     def __init__(self):
-        self.hit_objects: List[HitObject] = []
+        self._lines: List[str] = []
+        self._arrays: Optional[HitObjectArrays] = None
+        self._hit_objects: Optional[List[HitObject]] = None
 
-    def load_from_string(self, data_string: str):
-        for line in data_string.strip().split('\n'):
-            line = line.strip()
-            if line:
-                hit_object = HitObject.create(line)
-                self.hit_objects.append(hit_object)
+    def load_line(self, line: str):
+        self._lines.append(line)
+        self._arrays = None
+
+    def finish(self):
+        # Tokenize the numeric columns of the whole section in one go; the
+        # per-line HitObject instances are only built if someone asks for them
+        self._arrays = HitObjectArrays.from_lines(self._lines)
+
+    @staticmethod
+    def from_arrays(arrays: 'HitObjectArrays', lines: Optional[List[str]] = None) -> 'HitObjects':
+        """
+        Rebuild a section from already-parsed columns and the raw lines they
+        came from. Without lines (e.g. generated hit objects), they are
+        serialized from the columns when first needed.
+        """
+
+        hit_objects = HitObjects()
+        hit_objects._lines = lines
+        hit_objects._arrays = arrays
+        return hit_objects
+
+    @property
+    def hit_objects(self) -> List['HitObject']:
+        if self._hit_objects is None:
+            self._hit_objects = [HitObject.create(line) for line in self.to_lines()]
+        return self._hit_objects
+
+    @hit_objects.setter
+    def hit_objects(self, hit_objects: List['HitObject']):
+        self._lines = []
+        self._arrays = None
+        self._hit_objects = hit_objects
+
+    def to_lines(self) -> List[str]:
+        """
+        Returns the .osu lines of the section: the raw lines as read, or the
+        serialized hit objects once they have been materialized (and possibly
+        edited) or if the section was built from columns alone
+        """
+
+        if self._hit_objects is not None:
+            return [hit_object.to_line() for hit_object in self._hit_objects]
+        if self._lines is None:
+            self._lines = self._arrays.to_lines()
+        return self._lines
+
+    def to_arrays(self) -> 'HitObjectArrays':
+        """
+        Returns the hit objects as typed, contiguous NumPy columns
+        """
+
+        # Once materialized, the object list is the source of truth (it may have been edited)
+        if self._hit_objects is not None:
+            return HitObjectArrays.from_hit_objects(self._hit_objects)
+        if self._arrays is None:
+            self._arrays = HitObjectArrays.from_lines(self._lines)
+        return self._arrays
+
+    def to_dict(self) -> dict:
+        return {"hit_objects": self.hit_objects}
+
+DEFAULT_HIT_SAMPLE = "0:0:0:0:"
+
+def format_decimal(value: float) -> str:
+    """
+    Shortest decimal string that parses back to the same float, without a
+    trailing '.0' (500.0 -> "500", 31.4999990386963 -> "31.4999990386963")
+    """
+
+    text = repr(float(value))
+    if 'e' in text:  # repr switches to scientific notation outside [1e-4, 1e16)
+        return np.format_float_positional(value, trim='-')
+    return text[:-2] if text.endswith('.0') else text
 
 class HitObject:
     def __init__(self, x, y, time, type_flags, hit_sound, hit_sample):
@@ -248,11 +536,33 @@ class HitObject:
         self.new_combo: bool = self.type_flags & 4 > 0
         self.combo_skip: int = (self.type_flags >> 4) & 7
 
+    def _object_params(self) -> List[str]:
+        return []
+
+    def to_line(self) -> str:
+        """
+        The object as a HitObjects line
+        """
+
+        fields = [str(self.x), str(self.y), str(self.time), str(self.type_flags), str(self.hit_sound)]
+        return ','.join(fields + self._object_params() + [':'.join(self.hit_sample)])
+
     @staticmethod
     def create(line):
         parts = line.split(',')
-        x, y, time, type_flags, hit_sound, *object_params, hit_sample = [int(part) if i < 5 else part for i, part in enumerate(parts)]
-        
+        x, y, time, type_flags, hit_sound = [int(part) for part in parts[:5]]
+
+        # hitSample (and a slider's edgeSounds/edgeSets) are optional, so the
+        # object params are sliced by position rather than taken from the end
+        if type_flags & 2:
+            num_params = 5
+        elif type_flags & 8:
+            num_params = 1
+        else:
+            num_params = 0
+        object_params = parts[5:5 + num_params]
+        hit_sample = parts[5 + num_params] if len(parts) > 5 + num_params else DEFAULT_HIT_SAMPLE
+
         if type_flags & 1:
             return Circle(x, y, time, type_flags, hit_sound, hit_sample)
         elif type_flags & 2:
@@ -280,12 +590,180 @@ class Slider(HitObject):
     def _parse_point(self, point_str):
         x, y = point_str.split(':')
         return int(x), int(y)
+
+    def _object_params(self) -> List[str]:
+        curve = '|'.join([self.curveType] + [f"{x}:{y}" for x, y in self.curvePoints])
+        return [curve, str(self.slides), format_decimal(self.length)]
+
+    def to_line(self) -> str:
+        # hitSample can only follow edgeSounds and edgeSets, so a slider without
+        # them ends after its length (it is read back with the default hitSample)
+        line = ','.join([str(self.x), str(self.y), str(self.time), str(self.type_flags), str(self.hit_sound)]
+                        + self._object_params())
+        if self.edgeSounds or self.edgeSets:
+            line += f",{'|'.join(map(str, self.edgeSounds))},{'|'.join(self.edgeSets)},{':'.join(self.hit_sample)}"
+        return line
         
 class Spinner(HitObject):
     def __init__(self, x, y, time, type_flags, hit_sound, object_params, hit_sample):
         super().__init__(x, y, time, type_flags, hit_sound, hit_sample)
         self.end_time: int = int(object_params[0])
 
+    def _object_params(self) -> List[str]:
+        return [str(self.end_time)]
+
+class HitObjectArrays:
+    """
+    Columnar store of a HitObjects section: one typed NumPy array per field,
+    indexed by object. Slider curve points of object i live in
+    curve_points[curve_offsets[i]:curve_offsets[i + 1]].
+    """
+
+    def __init__(self, n: int = 0, num_points: int = 0):
+        self.x: np.ndarray = np.zeros(n, dtype=np.int32)
+        self.y: np.ndarray = np.zeros(n, dtype=np.int32)
+        self.time: np.ndarray = np.zeros(n, dtype=np.int32)
+        self.type_flags: np.ndarray = np.zeros(n, dtype=np.uint8)
+        self.hit_sound: np.ndarray = np.zeros(n, dtype=np.uint8)
+        self.new_combo: np.ndarray = np.zeros(n, dtype=np.bool_)
+        self.combo_skip: np.ndarray = np.zeros(n, dtype=np.uint8)
+        self.end_time: np.ndarray = np.zeros(n, dtype=np.int32)  # Spinner end, otherwise time
+        self.slides: np.ndarray = np.zeros(n, dtype=np.int16)  # 0 for non-sliders
+        self.length: np.ndarray = np.zeros(n, dtype=np.float64)  # 0 for non-sliders
+        self.curve_type: np.ndarray = np.zeros(n, dtype='S1')  # b'' for non-sliders
+        self.curve_offsets: np.ndarray = np.zeros(n + 1, dtype=np.int64)
+        self.curve_points: np.ndarray = np.zeros((num_points, 2), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    @property
+    def is_circle(self) -> np.ndarray:
+        return (self.type_flags & 1) > 0
+
+    @property
+    def is_slider(self) -> np.ndarray:
+        return (self.type_flags & 2) > 0
+
+    @property
+    def is_spinner(self) -> np.ndarray:
+        return (self.type_flags & 8) > 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.to_dict().values())
+
+    def curve(self, i: int) -> np.ndarray:
+        """
+        Returns the (k, 2) curve points of object i (empty for non-sliders)
+        """
+
+        return self.curve_points[self.curve_offsets[i]:self.curve_offsets[i + 1]]
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_lines(lines: List[str]) -> 'HitObjectArrays':
+        """
+        Vectorized parse of raw HitObjects lines. The numeric prefix
+        (x, y, time, type, hitSound) of every line is tokenized in a single
+        np.loadtxt call; only slider curve fields are split per line.
+        """
+
+        n = len(lines)
+        arrays = HitObjectArrays(n)
+        if n == 0:
+            return arrays
+
+        prefix = np.loadtxt(lines, delimiter=',', usecols=range(5), dtype=np.int64, ndmin=2, comments=None)
+        arrays.x = prefix[:, 0].astype(np.int32)
+        arrays.y = prefix[:, 1].astype(np.int32)
+        arrays.time = prefix[:, 2].astype(np.int32)
+        arrays.type_flags = prefix[:, 3].astype(np.uint8)
+        arrays.hit_sound = prefix[:, 4].astype(np.uint8)
+        arrays.new_combo = (arrays.type_flags & 4) > 0
+        arrays.combo_skip = (arrays.type_flags >> 4) & 7
+        arrays.end_time = arrays.time.copy()
+
+        # Same precedence as HitObject.create: circle, then slider, then spinner
+        is_circle = (arrays.type_flags & 1) > 0
+        is_slider = ((arrays.type_flags & 2) > 0) & ~is_circle
+        is_spinner = ((arrays.type_flags & 8) > 0) & ~is_circle & ~is_slider
+
+        spinners = np.flatnonzero(is_spinner)
+        if len(spinners):
+            arrays.end_time[spinners] = np.loadtxt([lines[i] for i in spinners], delimiter=',', usecols=5,
+                                                   dtype=np.int64, ndmin=1, comments=None)
+
+        sliders = np.flatnonzero(is_slider)
+        if len(sliders):
+            curves, slides, lengths = zip(*(lines[i].split(',', 8)[5:8] for i in sliders))
+            arrays.slides[sliders] = np.array(slides).astype(np.int16)
+            arrays.length[sliders] = np.array(lengths).astype(np.float64)
+            arrays.curve_type[sliders] = [curve.split('|', 1)[0] for curve in curves]
+
+            counts = np.zeros(n, dtype=np.int64)
+            counts[sliders] = [curve.count('|') for curve in curves]
+            np.cumsum(counts, out=arrays.curve_offsets[1:])
+
+            # All "x:y" points of all sliders, tokenized together
+            points = '|'.join(curve.split('|', 1)[1] for curve in curves if '|' in curve)
+            if points:
+                arrays.curve_points = np.array(points.replace(':', '|').split('|')).astype(np.int32).reshape(-1, 2)
+
+        return arrays
+
+    @staticmethod
+    def from_hit_objects(hit_objects: List[HitObject]) -> 'HitObjectArrays':
+        n = len(hit_objects)
+        slider_points = [obj.curvePoints if isinstance(obj, Slider) else [] for obj in hit_objects]
+        counts = np.fromiter((len(points) for points in slider_points), dtype=np.int64, count=n)
+
+        arrays = HitObjectArrays()
+        arrays.x = np.fromiter((obj.x for obj in hit_objects), dtype=np.int32, count=n)
+        arrays.y = np.fromiter((obj.y for obj in hit_objects), dtype=np.int32, count=n)
+        arrays.time = np.fromiter((obj.time for obj in hit_objects), dtype=np.int32, count=n)
+        arrays.type_flags = np.fromiter((obj.type_flags for obj in hit_objects), dtype=np.uint8, count=n)
+        arrays.hit_sound = np.fromiter((obj.hit_sound for obj in hit_objects), dtype=np.uint8, count=n)
+        arrays.new_combo = (arrays.type_flags & 4) > 0
+        arrays.combo_skip = (arrays.type_flags >> 4) & 7
+        arrays.end_time = np.fromiter((getattr(obj, 'end_time', obj.time) for obj in hit_objects), dtype=np.int32, count=n)
+        arrays.slides = np.fromiter((getattr(obj, 'slides', 0) for obj in hit_objects), dtype=np.int16, count=n)
+        arrays.length = np.fromiter((getattr(obj, 'length', 0.0) for obj in hit_objects), dtype=np.float64, count=n)
+        arrays.curve_type = np.array([getattr(obj, 'curveType', '') for obj in hit_objects], dtype='S1').reshape(n)
+        arrays.curve_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=arrays.curve_offsets[1:])
+        arrays.curve_points = np.array([point for points in slider_points for point in points], dtype=np.int32).reshape(-1, 2)
+        return arrays
+
+    def to_lines(self) -> List[str]:
+        """
+        Serialize the columns as HitObjects lines. Hit samples and slider edge
+        sounds are not stored in the columns, so circles and spinners get the
+        default hitSample and sliders end after their length.
+        """
+
+        # Same precedence as HitObject.create: circle, then slider, then spinner
+        kinds = np.select([self.is_circle, self.is_slider, self.is_spinner], [0, 1, 2], 3).tolist()
+        points = [f"{x}:{y}" for x, y in self.curve_points.tolist()]
+        offsets = self.curve_offsets.tolist()
+        curve_types = self.curve_type.astype('U1').tolist()
+
+        lines = []
+        columns = zip(kinds, self.x.tolist(), self.y.tolist(), self.time.tolist(), self.type_flags.tolist(),
+                      self.hit_sound.tolist(), self.end_time.tolist(), self.slides.tolist(), self.length.tolist())
+        for i, (kind, x, y, time, type_flags, hit_sound, end_time, slides, length) in enumerate(columns):
+            prefix = f"{x},{y},{time},{type_flags},{hit_sound}"
+            if kind == 1:
+                curve = '|'.join([curve_types[i]] + points[offsets[i]:offsets[i + 1]])
+                lines.append(f"{prefix},{curve},{slides},{format_decimal(length)}")
+            elif kind == 2:
+                lines.append(f"{prefix},{end_time},{DEFAULT_HIT_SAMPLE}")
+            else:
+                lines.append(f"{prefix},{DEFAULT_HIT_SAMPLE}")
+        return lines
+
 ### BEATMAP OBJECT ###
 class Beatmap:
     def __init__(self, 
@@ -308,34 +786,67 @@ class Beatmap:
         self.hitObjects: HitObjects = hitObjects
 
 ### Wrapper function ###
-def create_beatmap_from_file(file_path):
-    section_classes = {
-        "[General]": General,
-        "[Editor]": Editor,
-        "[Metadata]": Metadata,
-        "[Difficulty]": Difficulty,
-        "[Events]": Events,
-        "[TimingPoints]": TimingPoints,
-        "[Colours]": Colours,
-        "[HitObjects]": HitObjects
-    }
-    
+SECTION_CLASSES = {
+    "[General]": General,
+    "[Editor]": Editor,
+    "[Metadata]": Metadata,
+    "[Difficulty]": Difficulty,
+    "[Events]": Events,
+    "[TimingPoints]": TimingPoints,
+    "[Colours]": Colours,
+    "[HitObjects]": HitObjects
+}
+
+HEADER_SECTIONS = ["General", "Metadata", "Difficulty"]
+
+def create_beatmap_from_lines(lines: Iterable[str], sections: Optional[Iterable[str]] = None) -> Beatmap:
+    """
+    Parse the lines of a .osu file into a Beatmap. If `sections` is given
+    (e.g. ["Difficulty", "TimingPoints", "HitObjects"]), lines of every other
+    section are skipped, those sections are left at their defaults, and
+    reading stops as soon as the last requested section has ended.
+    """
+
     # Initialize sections
-    sections = {section: "" for section in section_classes}
+    section_objects = {name: cls() for name, cls in SECTION_CLASSES.items()}
+    if sections is None:
+        requested = set(section_objects)
+    else:
+        requested = {f"[{name.strip('[]')}]" for name in sections}
+        unknown = requested - set(section_objects)
+        if unknown:
+            raise Exception(f"Beatmap: Unknown sections {sorted(unknown)}")
+    remaining = set(requested)
     current_section = None
 
+    # Stream every line straight to the handler of the section it belongs to
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line in section_objects:
+            if not remaining:
+                break
+            current_section = section_objects[line] if line in requested else None
+            remaining.discard(line)
+        elif current_section is not None:
+            current_section.load_line(line)
+
+    for name in requested:
+        section_objects[name].finish()
+
+    # Create and return the Beatmap object
+    return Beatmap(*section_objects.values())
+
+def create_beatmap_from_file(file_path, sections: Optional[Iterable[str]] = None):
     with open(file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            line = line.strip()
-            if line in section_classes:
-                current_section = line
-            elif current_section and line:
-                sections[current_section] += line + '\n'
+        return create_beatmap_from_lines(file, sections)
 
-    # Create section objects
-    section_objects = {name: cls() for name, cls in section_classes.items()}
-    for name, data in sections.items():
-        section_objects[name].load_from_string(data)
+def read_beatmap_header(file_path) -> Beatmap:
+    """
+    Only parse the [General], [Metadata] and [Difficulty] sections, e.g. to
+    filter a corpus by Mode, OverallDifficulty or ApproachRate. Reading stops
+    at the section after [Difficulty], long before [HitObjects].
+    """
 
-    # Create and return the Beatmap object
-    return Beatmap(*section_objects.values())
\ No newline at end of file
+    return create_beatmap_from_file(file_path, sections=HEADER_SECTIONS)
@@ -0,0 +1,343 @@
+import functools
+from typing import Tuple
+
+import numpy as np
+
+from parsing.parse import HitObjectArrays, TimingPoints
+
+PATH_CACHE_SIZE = 1 << 16  # Unique (curve, length) paths kept by curve_path
+BEZIER_STEP = 2.0  # osu!pixels of control polygon per Bézier sample
+MAX_BEZIER_SAMPLES = 1000  # Per Bézier segment
+CATMULL_SAMPLES = 50  # Per Catmull segment, as in osu!
+CIRCLE_TOLERANCE = 0.1  # Maximum distance in osu!pixels between a perfect circle arc and its samples
+
+def _bezier(points: np.ndarray) -> np.ndarray:
+    """
+    Samples of one Bézier segment: the Bernstein basis at evenly spaced t, times the control points.
+    """
+    degree = len(points) - 1
+    if degree == 0:
+        return points
+    polygon = np.linalg.norm(np.diff(points, axis=0), axis=1).sum()
+    t = np.linspace(0, 1, int(np.clip(np.ceil(polygon / BEZIER_STEP), 2, MAX_BEZIER_SAMPLES)))[:, None]
+    i = np.arange(degree + 1)
+    # Binomial coefficients in log space, so high degrees don't overflow
+    log_binomial = np.concatenate([[0.0], np.cumsum(np.log(degree - i[1:] + 1) - np.log(i[1:]))])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        basis = np.exp(log_binomial + i * np.log(t) + (degree - i) * np.log1p(-t))
+    basis[0] = i == 0
+    basis[-1] = i == degree
+    return basis @ points
+
+def _bezier_path(points: np.ndarray) -> np.ndarray:
+    # A repeated control point (a red anchor in the editor) ends one Bézier segment and starts the next
+    anchors = np.flatnonzero((points[1:] == points[:-1]).all(axis=1)) + 1
+    bounds = [0] + anchors.tolist() + [len(points)]
+    segments = [_bezier(points[start:end]) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    return np.concatenate(segments)
+
+def _catmull_path(points: np.ndarray) -> np.ndarray:
+    # Catmull-Rom through every control point; the first and last segments mirror their neighbour
+    if len(points) < 2:
+        return points
+    v2 = points[:-1]
+    v1 = np.concatenate([points[:1], points[:-2]])
+    v3 = points[1:]
+    v4 = np.concatenate([points[2:], 2 * v3[-1:] - v2[-1:]])
+    t = np.linspace(0, 1, CATMULL_SAMPLES + 1)[None, :, None]
+    samples = 0.5 * (2 * v2[:, None] + (v3 - v1)[:, None] * t
+                     + (2 * v1 - 5 * v2 + 4 * v3 - v4)[:, None] * t ** 2
+                     + (3 * v2 - v1 - 3 * v3 + v4)[:, None] * t ** 3)
+    return np.concatenate([samples[:, :-1].reshape(-1, 2), points[-1:]])
+
+def _circle_path(points: np.ndarray) -> np.ndarray:
+    # The arc through the three control points; anything else is drawn as a Bézier like osu! does
+    if len(points) != 3:
+        return _bezier_path(points)
+    a, b, c = points
+    d = 2 * (a[0] * (b[1] - c[1]) + b[0] * (c[1] - a[1]) + c[0] * (a[1] - b[1]))
+    if abs(d) < 1e-3:  # Collinear
+        return _bezier_path(points)
+    squares = (points ** 2).sum(axis=1)
+    center = np.array([squares @ [b[1] - c[1], c[1] - a[1], a[1] - b[1]],
+                       squares @ [c[0] - b[0], a[0] - c[0], b[0] - a[0]]]) / d
+    radius = np.linalg.norm(a - center)
+    start, through, end = np.arctan2(*(points - center)[:, ::-1].T)
+    # Go from start to end in the direction that passes through the middle point
+    span = (end - start) % (2 * np.pi)
+    if (through - start) % (2 * np.pi) > span:
+        span -= 2 * np.pi
+    step = 2 * np.arccos(max(-1.0, 1 - CIRCLE_TOLERANCE / radius)) if radius > CIRCLE_TOLERANCE else np.pi
+    angles = start + np.linspace(0, span, max(2, int(np.ceil(abs(span) / step)) + 1))
+    return center + radius * np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+CURVES = {
+    'B': _bezier_path,
+    'C': _catmull_path,
+    'L': lambda points: points,
+    'P': _circle_path
+}
+
+def _fit_length(path: np.ndarray, length: float) -> np.ndarray:
+    """
+    Cut the path where it reaches `length`, or extend its last segment up to
+    `length` when it is shorter, as osu! does.
+    """
+    distances = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(path, axis=0), axis=1))])
+    if len(path) < 2 or length <= 0:
+        return path[:1]
+    end = min(int(np.searchsorted(distances, length)), len(path) - 1)
+    while end > 1 and distances[end] == distances[end - 1]:
+        end -= 1
+    segment = distances[end] - distances[end - 1]
+    fraction = (length - distances[end - 1]) / segment if segment > 0 else 1.0
+    last = path[end - 1] + (path[end] - path[end - 1]) * fraction
+    return np.concatenate([path[:end], last[None]])
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _relative_path(curve_type: str, points: bytes, length: float) -> np.ndarray:
+    control_points = np.frombuffer(points, dtype=np.float64).reshape(-1, 2)
+    path = _fit_length(CURVES.get(curve_type, _bezier_path)(control_points), length)
+    path.setflags(write=False)
+    return path
+
+def curve_path(
+    curve_type: str,
+    points: np.ndarray,
+    length: float
+) -> np.ndarray:
+    """
+    The path a slider follows, as a polyline truncated (or extended) to its pixel length.
+
+    Paths are memoized per curve shape: sliders with the same type, control points relative to
+    their start and length (repeats within a map, or maps sharing a pattern) are evaluated once.
+
+    Parameters:
+    - curve_type: str - 'B' (Bézier), 'C' (Catmull), 'L' (linear) or 'P' (perfect circle).
+    - points: ndarray - (k, 2) control points, starting with the slider position.
+    - length: float - Pixel length of the slider.
+
+    Returns:
+    - path: ndarray - (m, 2) float64 points from the slider position to the slider end.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    relative = points - points[0]
+    return _relative_path(curve_type, relative.tobytes(), float(length)) + points[0]
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Concatenated arange(start, start + count) for every start and count.
+    """
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+def _determinants(points: np.ndarray) -> np.ndarray:
+    # The denominator d of _circle_path for every (3, 2) triangle, 0 when its points are collinear
+    a, b, c = points[:, 0], points[:, 1], points[:, 2]
+    return 2 * (a[:, 0] * (b[:, 1] - c[:, 1]) + b[:, 0] * (c[:, 1] - a[:, 1]) + c[:, 0] * (a[:, 1] - b[:, 1]))
+
+def _fit_lengths(paths: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    _fit_length of n paths of m points each at once.
+
+    Parameters:
+    - paths: ndarray - (n, m, 2) paths.
+    - lengths: ndarray - (n,) pixel lengths.
+
+    Returns:
+    - points: ndarray - The fitted paths back to back.
+    - counts: ndarray - (n,) number of points of every fitted path.
+    """
+    n, m = paths.shape[:2]
+    if m < 2:
+        return paths.reshape(-1, 2), np.ones(n, dtype=np.int64)
+    rows = np.arange(n)
+    segments = np.linalg.norm(np.diff(paths, axis=1), axis=2)
+    distances = np.concatenate([np.zeros((n, 1)), np.cumsum(segments, axis=1)], axis=1)
+    end = np.clip((distances < lengths[:, None]).sum(axis=1), 1, m - 1)
+    # Step back over zero-length segments, to the last point that moves
+    moving = np.maximum.accumulate(np.where(segments > 0, np.arange(1, m), 0), axis=1)
+    end = np.maximum(moving[rows, end - 1], 1)
+    segment = distances[rows, end] - distances[rows, end - 1]
+    fraction = np.ones(n)
+    np.divide(lengths - distances[rows, end - 1], segment, out=fraction, where=segment > 0)
+    last = paths[rows, end - 1] + (paths[rows, end] - paths[rows, end - 1]) * fraction[:, None]
+
+    end[lengths <= 0] = 0
+    keep = np.concatenate([np.arange(m) < end[:, None], np.ones((n, 1), dtype=np.bool_)], axis=1)
+    points = np.concatenate([paths, last[:, None]], axis=1)
+    points[lengths <= 0, m] = paths[lengths <= 0, 0]
+    return points[keep], end + 1
+
+def _circle_arcs(points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    _circle_path of n non-collinear (3, 2) control points at once.
+
+    Returns:
+    - points: ndarray - The arcs back to back.
+    - counts: ndarray - (n,) number of points of every arc.
+    """
+    a, b, c = points[:, 0], points[:, 1], points[:, 2]
+    d = _determinants(points)
+    squares = (points ** 2).sum(axis=2)
+    center = np.stack([squares[:, 0] * (b[:, 1] - c[:, 1]) + squares[:, 1] * (c[:, 1] - a[:, 1]) + squares[:, 2] * (a[:, 1] - b[:, 1]),
+                       squares[:, 0] * (c[:, 0] - b[:, 0]) + squares[:, 1] * (a[:, 0] - c[:, 0]) + squares[:, 2] * (b[:, 0] - a[:, 0])],
+                      axis=1) / d[:, None]
+    radius = np.linalg.norm(a - center, axis=1)
+    relative = points - center[:, None]
+    start, through, end = np.arctan2(relative[..., 1], relative[..., 0]).T
+    span = (end - start) % (2 * np.pi)
+    span[(through - start) % (2 * np.pi) > span] -= 2 * np.pi
+    step = np.full(len(points), np.pi)
+    large = radius > CIRCLE_TOLERANCE
+    step[large] = 2 * np.arccos(np.maximum(-1.0, 1 - CIRCLE_TOLERANCE / radius[large]))
+    counts = np.maximum(2, np.ceil(np.abs(span) / step).astype(np.int64) + 1)
+
+    # linspace(0, span, count) of every arc, back to back
+    arc = np.repeat(np.arange(len(points)), counts)
+    angles = _ranges(np.zeros_like(counts), counts) * (span / (counts - 1))[arc]
+    angles[np.cumsum(counts) - 1] = span
+    angles += start[arc]
+    return center[arc] + radius[arc, None] * np.stack([np.cos(angles), np.sin(angles)], axis=1), counts
+
+def _fit_many(points: np.ndarray, counts: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    _fit_length of paths of any sizes, stored back to back with `counts` points each. Paths with the
+    same number of points are fitted together.
+    """
+    offsets = np.cumsum(counts) - counts
+    fitted_counts = np.zeros(len(counts), dtype=np.int64)
+    groups = []
+    for m in np.unique(counts).tolist():
+        paths = np.flatnonzero(counts == m)
+        group_points, group_counts = _fit_lengths(points[offsets[paths, None] + np.arange(m)], lengths[paths])
+        fitted_counts[paths] = group_counts
+        groups.append((paths, group_points))
+    fitted_offsets = np.cumsum(fitted_counts) - fitted_counts
+    result = np.empty((fitted_counts.sum(), 2))
+    for paths, group_points in groups:
+        result[_ranges(fitted_offsets[paths], fitted_counts[paths])] = group_points
+    return result, fitted_counts
+
+def _paths(arrays: HitObjectArrays, sliders: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Paths of the given sliders, back to back, and the number of points of each.
+
+    Linear and perfect circle sliders are evaluated together over the whole map; only Bézier, Catmull
+    and degenerate circle sliders go through curve_path one at a time.
+    """
+    counts = np.zeros(len(sliders), dtype=np.int64)
+    if len(sliders) == 0:
+        return np.zeros((0, 2)), counts
+    starts = np.stack([arrays.x[sliders], arrays.y[sliders]], axis=1).astype(np.float64)
+    curve_types = arrays.curve_type[sliders].astype('U1')
+    lengths = arrays.length[sliders].astype(np.float64)
+
+    # Control points relative to the slider position (as curve_path memoizes them), back to back
+    control_counts = 1 + arrays.curve_offsets[sliders + 1] - arrays.curve_offsets[sliders]
+    control_offsets = np.cumsum(control_counts) - control_counts
+    curve = _ranges(arrays.curve_offsets[sliders] - 1, control_counts)
+    control = np.zeros((control_counts.sum(), 2))
+    is_curve = np.ones(len(control), dtype=np.bool_)
+    is_curve[control_offsets] = False
+    control[is_curve] = arrays.curve_points[curve[is_curve]] - np.repeat(starts, control_counts - 1, axis=0)
+
+    results = []
+    linear = np.flatnonzero(curve_types == 'L')
+    if len(linear):
+        results.append((linear, *_fit_many(control[_ranges(control_offsets[linear], control_counts[linear])],
+                                           control_counts[linear], lengths[linear])))
+
+    circle = np.flatnonzero((curve_types == 'P') & (control_counts == 3))
+    if len(circle):
+        triples = control[control_offsets[circle, None] + np.arange(3)]
+        arcs = np.abs(_determinants(triples)) >= 1e-3  # Collinear ones are drawn as a Bézier
+        circle = circle[arcs]
+        if len(circle):
+            results.append((circle, *_fit_many(*_circle_arcs(triples[arcs]), lengths[circle])))
+
+    rest = np.ones(len(sliders), dtype=np.bool_)
+    for done, _, _ in results:
+        rest[done] = False
+    rest = np.flatnonzero(rest)
+    if len(rest):
+        paths = [_relative_path(curve_types[j], control[control_offsets[j]:control_offsets[j] + control_counts[j]].tobytes(),
+                                float(lengths[j])) for j in rest.tolist()]
+        results.append((rest, np.concatenate(paths), np.array([len(path) for path in paths], dtype=np.int64)))
+
+    for done, _, done_counts in results:
+        counts[done] = done_counts
+    offsets = np.cumsum(counts) - counts
+    points = np.empty((counts.sum(), 2))
+    for done, done_points, done_counts in results:
+        points[_ranges(offsets[done], done_counts)] = done_points
+    return points + np.repeat(starts, counts, axis=0), counts
+
+def slider_paths(arrays: HitObjectArrays) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Paths of every slider of a map, in the layout of curve_points.
+
+    Returns:
+    - points: ndarray - (total path points, 2) float64 points of all paths.
+    - offsets: ndarray - (hit objects + 1,) offsets; the path of object i is points[offsets[i]:offsets[i + 1]]
+      (empty for circles and spinners).
+    """
+    sliders = np.flatnonzero(arrays.is_slider)
+    points, slider_counts = _paths(arrays, sliders)
+    counts = np.zeros(len(arrays), dtype=np.int64)
+    counts[sliders] = slider_counts
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return points, offsets
+
+def positions_at(
+    path: np.ndarray,
+    distances
+) -> np.ndarray:
+    """
+    Points along a path at the given distances in osu!pixels from its start
+    (e.g. slider ticks), clamped to the path ends.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    along = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(path, axis=0), axis=1))])
+    return np.stack([np.interp(distances, along, path[:, 0]), np.interp(distances, along, path[:, 1])], axis=-1)
+
+def end_positions(arrays: HitObjectArrays) -> np.ndarray:
+    """
+    (hit objects, 2) position where every object ends: the end of the path for
+    sliders with an odd number of slides, otherwise the object position.
+    """
+    ends = np.stack([arrays.x, arrays.y], axis=1).astype(np.float64)
+    odd = np.flatnonzero(arrays.is_slider & (arrays.slides % 2 == 1))
+    points, counts = _paths(arrays, odd)
+    ends[odd] = points[np.cumsum(counts) - 1]
+    return ends
+
+def slider_durations(
+    arrays: HitObjectArrays,
+    timing_points: TimingPoints,
+    slider_multiplier: float
+) -> np.ndarray:
+    """
+    Duration in ms of every slider (0 for other objects): length * slides over
+    the velocity of SliderMultiplier * 100 osu!pixels per beat, times the slider
+    velocity multiplier active at the slider.
+    """
+    durations = np.zeros(len(arrays))
+    sliders = arrays.is_slider
+    if sliders.any():
+        times = arrays.time[sliders]
+        velocity = slider_multiplier * 100 * timing_points.slider_velocity_at(times) / timing_points.beat_length_at(times)
+        durations[sliders] = arrays.length[sliders] * arrays.slides[sliders] / velocity
+    return durations
+
+def end_times(
+    arrays: HitObjectArrays,
+    timing_points: TimingPoints,
+    slider_multiplier: float
+) -> np.ndarray:
+    """
+    Time in ms at which every object ends: the slider end for sliders, the
+    spinner end for spinners and the object time for circles.
+    """
+    return np.where(arrays.is_slider, arrays.time + slider_durations(arrays, timing_points, slider_multiplier),
+                    arrays.end_time)
@@ -0,0 +1,174 @@
+from typing import Iterable, List, Sequence, Union
+
+import numpy as np
+
+from parsing.dataset import PackedBeatmap
+from parsing.parse import Beatmap, HitObjectArrays
+from parsing.slider import end_positions
+
+# Strain model (the osu!standard aim/speed skills, without angle bonuses or slider tick simulation)
+MIN_STRAIN_TIME = 50  # ms
+SINGLE_SPACING = 125  # Normalized distance from which speed strain stops growing
+MIN_SPEED_BONUS = 75  # ms; objects closer than this get a speed bonus
+SECTION_LENGTH = 400  # ms per strain peak
+DECAY_WEIGHT = 0.9  # Weight of the i-th highest peak is DECAY_WEIGHT ** i
+DIFFICULTY_MULTIPLIER = 0.0675
+AIM = {"decay_base": 0.15, "multiplier": 26.25}
+SPEED = {"decay_base": 0.3, "multiplier": 1400}
+
+# Strains are accumulated over windows this long, so that exp(k * t) stays finite within a window
+STRAIN_CHUNK_MS = 200_000
+
+STAR_RATING_DTYPE = np.dtype([
+    ('aim', np.float64),
+    ('speed', np.float64),
+    ('stars', np.float64)
+])
+
+def _decayed_strains(
+    times: np.ndarray,
+    values: np.ndarray,
+    map_start: np.ndarray,
+    decay_base: float
+) -> np.ndarray:
+    """
+    strain[i] = strain[i - 1] * decay_base ** (dt / 1000) + values[i], restarting at every map.
+
+    Solved in closed form, strain[i] = exp(-k t_i) * sum_j values[j] * exp(k t_j), one chunk of at most
+    STRAIN_CHUNK_MS at a time with times taken relative to the start of the chunk so the exponentials stay finite.
+    Only the strain carried from one chunk into the next is propagated in Python.
+    """
+    k = -np.log(decay_base) / 1000
+    window = np.floor_divide(times, STRAIN_CHUNK_MS)
+    chunk_start = map_start.copy()
+    chunk_start[1:] |= window[1:] != window[:-1]
+    starts = np.flatnonzero(chunk_start).tolist()
+    ends = starts[1:] + [len(times)]
+
+    strains = np.empty(len(times))
+    carry, previous_time = 0.0, 0.0
+    for start, end in zip(starts, ends):
+        reference = times[start]
+        if map_start[start]:
+            carry = 0.0
+        else:
+            carry *= np.exp(-k * (reference - previous_time))
+        relative = times[start:end] - reference
+        strains[start:end] = np.exp(-k * relative) * (carry + np.cumsum(values[start:end] * np.exp(k * relative)))
+        carry, previous_time = strains[end - 1], times[end - 1]
+    return strains
+
+def _weighted_peaks(
+    times: np.ndarray,
+    strains: np.ndarray,
+    map_index: np.ndarray,
+    map_start: np.ndarray,
+    num_maps: int,
+    decay_base: float
+) -> np.ndarray:
+    """
+    Per map, the highest strain of every SECTION_LENGTH section that has objects (including the strain decayed
+    from the previous object at the start of the section), summed from highest to lowest with DECAY_WEIGHT ** i.
+    """
+    k = -np.log(decay_base) / 1000
+    section = np.floor_divide(times, SECTION_LENGTH)
+    group_start = map_start.copy()
+    group_start[1:] |= section[1:] != section[:-1]
+    starts = np.flatnonzero(group_start)
+
+    peaks = np.maximum.reduceat(strains, starts)
+    # Strain left over from the previous object of the map when the section begins
+    carried = ~map_start[starts]
+    previous = starts[carried] - 1
+    peaks[carried] = np.maximum(peaks[carried],
+                                strains[previous] * np.exp(-k * (section[starts[carried]] * SECTION_LENGTH - times[previous])))
+
+    peak_map = map_index[starts]
+    order = np.lexsort((-peaks, peak_map))
+    first_of_map = np.searchsorted(peak_map[order], peak_map[order], side='left')
+    rank = np.arange(len(order)) - first_of_map
+    return np.bincount(peak_map[order], weights=peaks[order] * DECAY_WEIGHT ** rank, minlength=num_maps)
+
+def star_ratings_from_arrays(
+    hit_objects: Sequence[HitObjectArrays],
+    circle_sizes: Sequence[float],
+    overall_difficulties: Sequence[float]
+) -> np.ndarray:
+    """
+    Aim, speed and star rating of many maps in one vectorized pass over their concatenated columns.
+
+    Parameters:
+    - hit_objects: Sequence[HitObjectArrays] - The hit objects of every map, sorted by time.
+    - circle_sizes, overall_difficulties: Sequence[float] - Difficulty.CircleSize and OverallDifficulty of every map.
+
+    Returns:
+    - ratings: ndarray - One STAR_RATING_DTYPE row per map.
+    """
+    num_maps = len(hit_objects)
+    ratings = np.zeros(num_maps, dtype=STAR_RATING_DTYPE)
+    counts = np.array([len(arrays) for arrays in hit_objects], dtype=np.int64)
+    if counts.sum() == 0:
+        return ratings
+
+    map_index = np.repeat(np.arange(num_maps), counts)
+    map_start = np.zeros(counts.sum(), dtype=np.bool_)
+    map_start[np.cumsum(counts)[counts > 0] - counts[counts > 0]] = True
+
+    times = np.concatenate([arrays.time for arrays in hit_objects]).astype(np.float64)
+    start = np.concatenate([np.stack([arrays.x, arrays.y], axis=1) for arrays in hit_objects]).astype(np.float64)
+    end = np.concatenate([end_positions(arrays) for arrays in hit_objects])
+    travel_length = np.concatenate([arrays.length * arrays.slides for arrays in hit_objects])
+    is_spinner = np.concatenate([arrays.is_spinner for arrays in hit_objects])
+
+    # Distances are normalized to a circle radius of 52 osu!pixels
+    radius = (54.4 - 4.48 * np.asarray(circle_sizes, dtype=np.float64))[map_index]
+    scale = 52 / radius
+    great_window = (2 * (80 - 6 * np.asarray(overall_difficulties, dtype=np.float64)))[map_index]
+
+    # Movement from the previous object; nothing moves into, out of or after the first object of a map
+    delta = np.diff(times, prepend=times[0])
+    strain_time = np.maximum(delta, MIN_STRAIN_TIME)
+    jump = np.linalg.norm(start - np.roll(end, 1, axis=0), axis=1) * scale
+    travel = np.maximum(0, np.roll(travel_length, 1) - 2.4 * radius) * scale  # Lazy cursor inside the follow circle
+    no_movement = map_start | is_spinner | np.roll(is_spinner, 1)
+    jump[no_movement] = 0
+    travel[no_movement] = 0
+
+    aim = (jump + travel) ** 0.99 / strain_time
+
+    # Speed: strain time is stretched when the OD hit window allows cheesing taps that are close together
+    speed_time = strain_time / np.clip(strain_time / great_window / 0.93, 0.92, 1)
+    speed_bonus = 1 + 0.75 * np.square(np.maximum(0, MIN_SPEED_BONUS - speed_time) / 40)
+    distance = np.minimum(jump + travel, SINGLE_SPACING)
+    speed = speed_bonus * (1 + (distance / SINGLE_SPACING) ** 3.5) / speed_time
+
+    for skill, values, name in [(AIM, aim, 'aim'), (SPEED, speed, 'speed')]:
+        values = np.where(map_start | is_spinner, 0, values) * skill["multiplier"]
+        strains = _decayed_strains(times, values, map_start, skill["decay_base"])
+        difficulty = _weighted_peaks(times, strains, map_index, map_start, num_maps, skill["decay_base"])
+        ratings[name] = np.sqrt(difficulty) * DIFFICULTY_MULTIPLIER
+
+    ratings['stars'] = ratings['aim'] + ratings['speed'] + np.abs(ratings['aim'] - ratings['speed']) / 2
+    return ratings
+
+def star_ratings(
+    beatmaps: Iterable[Union[Beatmap, PackedBeatmap]]
+) -> np.ndarray:
+    """
+    Star ratings of parsed or packed beatmaps, scored together in one batch.
+
+    Returns:
+    - ratings: ndarray - One STAR_RATING_DTYPE row per map, with fields aim, speed and stars.
+    """
+    hit_objects: List[HitObjectArrays] = []
+    circle_sizes, overall_difficulties = [], []
+    for beatmap in beatmaps:
+        if isinstance(beatmap, PackedBeatmap):
+            hit_objects.append(beatmap.hit_objects)
+            circle_sizes.append(beatmap.difficulty['CircleSize'])
+            overall_difficulties.append(beatmap.difficulty['OverallDifficulty'])
+        else:
+            hit_objects.append(beatmap.hitObjects.to_arrays())
+            circle_sizes.append(beatmap.difficulty.CircleSize)
+            overall_difficulties.append(beatmap.difficulty.OverallDifficulty)
+    return star_ratings_from_arrays(hit_objects, circle_sizes, overall_difficulties)
@@ -1,5 +1,16 @@
 from parsing.parse import *
-import unittest
+from parsing.benchmark import create_beatmap_from_file_buffered
+from parsing.bulk import parse_directory, parse_many
+from parsing.cache import BeatmapCache, DiskCache
+from parsing.corpus import CorpusIndex
+from parsing.dataset import PackedBeatmaps, pack_beatmaps, pack_files
+from parsing.slider import _relative_path, curve_path, end_positions, end_times, positions_at, slider_paths
+from parsing.star_rating import _decayed_strains, star_ratings, star_ratings_from_arrays
+from parsing.writer import OszWriter, beatmap_to_string, write_beatmap
+import glob, os, pickle, shutil, tempfile, unittest, zipfile
+from unittest import mock
+
+DATA_MAPS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'test1', '*.osu')))
 
 class BeatmapTest(unittest.TestCase):
     @classmethod
@@ -125,6 +136,463 @@ class BeatmapTest(unittest.TestCase):
         self.assertEqual(circle.time, 8239)
         self.assertEqual(circle.type_flags, 5)
 
+class StreamingParserTest(unittest.TestCase):
+    def test_matches_buffered_parser(self):
+        for path in DATA_MAPS:
+            streamed = create_beatmap_from_file(path)
+            buffered = create_beatmap_from_file_buffered(path)
+
+            for name in ['general', 'editor', 'metadata', 'difficulty', 'events', 'timingPoints', 'colours']:
+                self.assertEqual(getattr(streamed, name).to_dict(), getattr(buffered, name).to_dict())
+            self.assertEqual([vars(o) for o in streamed.hitObjects.hit_objects],
+                             [vars(o) for o in buffered.hitObjects.hit_objects])
+
+    def test_optional_hit_sample(self):
+        slider = HitObject.create("139,142,195,6,0,L|101:145,2,31.4999990386963")
+        self.assertIsInstance(slider, Slider)
+        self.assertEqual(slider.curvePoints, [(101, 145)])
+        self.assertEqual(slider.slides, 2)
+        self.assertEqual(slider.hit_sample, DEFAULT_HIT_SAMPLE.split(':'))
+
+class HitObjectArraysTest(unittest.TestCase):
+    def test_columns_match_objects(self):
+        for path in DATA_MAPS:
+            objects = create_beatmap_from_file(path).hitObjects.hit_objects
+            arrays = HitObjectArrays.from_hit_objects(objects)
+
+            self.assertEqual(len(arrays), len(objects))
+            self.assertEqual(arrays.x.tolist(), [o.x for o in objects])
+            self.assertEqual(arrays.time.tolist(), [o.time for o in objects])
+            self.assertEqual(arrays.new_combo.tolist(), [o.new_combo for o in objects])
+            self.assertEqual(arrays.combo_skip.tolist(), [o.combo_skip for o in objects])
+            for i, o in enumerate(objects):
+                if isinstance(o, Slider):
+                    self.assertEqual(arrays.curve_type[i].decode(), o.curveType)
+                    self.assertEqual([tuple(p) for p in arrays.curve(i).tolist()], o.curvePoints)
+                    self.assertEqual(arrays.slides[i], o.slides)
+                    self.assertEqual(arrays.length[i], o.length)
+                else:
+                    self.assertEqual(len(arrays.curve(i)), 0)
+                if isinstance(o, Spinner):
+                    self.assertEqual(arrays.end_time[i], o.end_time)
+
+    def test_vectorized_parse_matches_objects(self):
+        synthetic = HitObjects()
+        synthetic.load_from_string("256,192,1000,12,0,3000,0:0:0:0:\n"
+                                   "4,5,1500,2,0,L|1:1|7:9,1,10,2|0,0:0|0:0,0:0:0:0:\n"
+                                   "1,1,2000,5,0")
+        sections = [synthetic] + [create_beatmap_from_file(path).hitObjects for path in DATA_MAPS]
+
+        for hit_objects in sections:
+            fast = hit_objects.to_arrays()
+            slow = HitObjectArrays.from_hit_objects(hit_objects.hit_objects)
+            for name, column in fast.to_dict().items():
+                self.assertEqual(column.dtype, getattr(slow, name).dtype)
+                self.assertTrue(np.array_equal(column, getattr(slow, name)), name)
+
+class TimingPointsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tp = TimingPoints()
+        cls.tp.load_from_string("1000,500,4,2,0,60,1,0\n"
+                                "1000,-50,4,2,0,60,0,0\n"
+                                "3000,-200,4,2,0,60,0,1\n"
+                                "5000,250,3,2,0,60,1,0\n"
+                                "6000,-100,3,2,0,60,0,1")
+
+    def test_structured_array(self):
+        points = self.tp.to_numpy()
+        self.assertEqual(points.dtype, TIMING_POINT_DTYPE)
+        self.assertEqual(points['uninherited'].tolist(), [True, False, False, True, False])
+        self.assertEqual(self.tp.timing_points[1], [1000, -50.0, 4, 2, 0, 60, False, 0])
+
+    def test_active_queries(self):
+        times = np.array([0, 1000, 2999, 3000, 5000, 5500, 7000])
+        self.assertTrue(np.allclose(self.tp.bpm_at(times), [120, 120, 120, 120, 240, 240, 240]))
+        self.assertTrue(np.allclose(self.tp.slider_velocity_at(times), [1, 2, 2, 0.5, 1, 1, 1]))
+        self.assertEqual(self.tp.kiai_at(times).tolist(), [False, False, False, True, False, False, True])
+
+    def test_beat_phase(self):
+        times = np.array([1000, 1250, 3000, 5000, 5125, 6000])
+        self.assertTrue(np.allclose(self.tp.beat_phase_at(times), [0, 0.5, 4, 0, 0.5, 4]))
+
+    def test_set_timing_points(self):
+        tp = TimingPoints()
+        tp.load_from_string("1000,500,4,2,0,60,1,0")
+        timing_points = tp.timing_points
+        self.assertIs(tp.timing_points, timing_points)  # Built once, not on every access
+
+        # In-place edits of the list and of its rows reach the array
+        timing_points.append([3000, 250.0, 3, 2, 0, 60, 1, 0])
+        self.assertEqual(len(tp.points), 2)
+        self.assertTrue(np.allclose(tp.bpm_at([2000, 3000]), [120, 240]))
+        tp.timing_points[1][1] = 500.0
+        self.assertTrue(np.allclose(tp.bpm_at([3000]), [120]))
+        tp.load_line("5000,1000,4,2,0,60,1,0")
+        self.assertEqual([point[0] for point in tp.timing_points], [1000, 3000, 5000])
+
+        tp.timing_points = [[1000, 250.0, 4, 2, 0, 60, 1, 0]]
+        self.assertEqual(tp.timing_points, [[1000, 250.0, 4, 2, 0, 60, True, 0]])
+        self.assertTrue(np.allclose(tp.bpm_at([2000]), [240]))
+
+        # Pickled without the list view, keeping the edits
+        tp.timing_points.append([3000, 500.0, 4, 2, 0, 60, 1, 0])
+        copy = pickle.loads(pickle.dumps(tp))
+        self.assertTrue(np.array_equal(copy.points, tp.points))
+
+    def test_from_numpy(self):
+        points = self.tp.to_numpy().copy()
+        tp = TimingPoints.from_numpy(points)
+        self.assertTrue(np.shares_memory(tp.points, points))  # Wrapped, not rebuilt from rows
+        self.assertTrue(np.allclose(tp.bpm_at([2000, 5500]), [120, 240]))
+        tp.load_line("7000,1000,4,2,0,60,1,0")
+        self.assertEqual(len(tp.points), 6)
+        self.assertTrue(np.allclose(tp.bpm_at([5500, 7000]), [240, 60]))
+
+    def test_beat_times(self):
+        self.assertTrue(np.array_equal(self.tp.beat_times(5600), [0, 500, 1000, 1500, 2000, 2500, 3000, 3500, 4000,
+                                                                  4500, 5000, 5250, 5500]))
+        self.assertTrue(np.array_equal(self.tp.beat_times(1000, divisor=4), np.arange(0, 1000, 125)))
+
+class BulkParseTest(unittest.TestCase):
+    def test_parse_many_collects_errors(self):
+        paths = DATA_MAPS * 3 + ["does/not/exist.osu"]
+        results = list(parse_many(paths, max_workers=2, chunksize=2))
+
+        self.assertEqual(sorted(r.path for r in results), sorted(paths))
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(failed), 1)
+        self.assertTrue(failed[0].error.startswith("FileNotFoundError"))
+        for result in results:
+            if result.ok:
+                self.assertEqual(len(result.beatmap.hitObjects.to_arrays()), 667)
+
+    def test_parse_directory(self):
+        directory = os.path.dirname(DATA_MAPS[0])
+        results = list(parse_directory(directory, max_workers=2))
+        self.assertEqual(sorted(r.path for r in results), DATA_MAPS)
+
+class BeatmapCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_cached_beatmap_matches_parsed(self):
+        cache = BeatmapCache(self.directory.name)
+        for path in DATA_MAPS:
+            parsed = create_beatmap_from_file(path)
+            cache(path)
+            cached = cache(path)
+
+            for name in ['general', 'editor', 'metadata', 'difficulty', 'events', 'timingPoints', 'colours']:
+                self.assertEqual(getattr(cached, name).to_dict(), getattr(parsed, name).to_dict())
+            self.assertEqual([vars(o) for o in cached.hitObjects.hit_objects],
+                             [vars(o) for o in parsed.hitObjects.hit_objects])
+            for name, column in parsed.hitObjects.to_arrays().to_dict().items():
+                self.assertTrue(np.array_equal(getattr(cached.hitObjects.to_arrays(), name), column), name)
+        self.assertEqual(len(os.listdir(self.directory.name)), len(DATA_MAPS))
+
+    def test_eviction(self):
+        cache = BeatmapCache(self.directory.name)
+        for path in DATA_MAPS:
+            cache(path)
+        total = cache.cache.size()
+
+        # Age every entry, then touch the first map so it is the most recently used one
+        for i, entry in enumerate(sorted(os.listdir(self.directory.name))):
+            os.utime(os.path.join(self.directory.name, entry), (1000 + i, 1000 + i))
+        cache(DATA_MAPS[0])
+        bounded = BeatmapCache(self.directory.name, max_bytes=total - 1)
+        bounded.cache.evict()
+
+        with open(DATA_MAPS[0], 'rb') as file:
+            key = BeatmapCache.key(file.read())
+        self.assertEqual(os.listdir(self.directory.name), [os.path.basename(bounded.cache.path_for(key))])
+
+    def test_put_does_not_rescan(self):
+        cache = DiskCache(self.directory.name, max_bytes=1000, suffix='.bin')
+        with mock.patch('parsing.cache.os.scandir', wraps=os.scandir) as scandir:
+            for i in range(200):
+                cache.put(str(i), lambda file: file.write(b'x' * 10))
+                self.assertLessEqual(cache._total, 1000)
+            # One scan when the cache opens, then one per batch of evictions
+            self.assertLessEqual(scandir.call_count, 1 + 200 // 10)
+        self.assertEqual(cache.size(), cache._total)
+        self.assertIsNotNone(cache.get("199"))
+        self.assertIsNone(cache.get("0"))
+
+        # Overwriting an entry counts its new size only
+        cache.put("199", lambda file: file.write(b'x' * 5))
+        self.assertEqual(cache.size(), cache._total)
+
+class PackedDatasetTest(unittest.TestCase):
+    def test_pack_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            errors = pack_files(DATA_MAPS + ["does/not/exist.osu"], directory, max_workers=2)
+            self.assertEqual(len(errors), 1)
+
+            packed = pickle.loads(pickle.dumps(PackedBeatmaps(directory)))
+            self.assertEqual(sorted(packed.sources), DATA_MAPS)
+            for packed_map in packed:
+                beatmap = create_beatmap_from_file(packed_map.source)
+                self.assertIsInstance(packed_map.hit_objects.time, np.memmap)
+                self.assertEqual(packed_map.map_id, beatmap.metadata.BeatmapID)
+                self.assertEqual(packed.position(packed_map.map_id), packed.sources.index(packed_map.source))
+                self.assertAlmostEqual(float(packed_map.difficulty['ApproachRate']), beatmap.difficulty.ApproachRate, places=5)
+                self.assertTrue(np.array_equal(packed_map.timing_points, beatmap.timingPoints.to_numpy()))
+                for name, column in beatmap.hitObjects.to_arrays().to_dict().items():
+                    self.assertTrue(np.array_equal(getattr(packed_map.hit_objects, name), column), name)
+            del packed, packed_map
+
+    def test_duplicate_map_ids(self):
+        beatmap = create_beatmap_from_file(DATA_MAPS[0])
+        unsubmitted = create_beatmap_from_file(DATA_MAPS[1])
+        unsubmitted.metadata.BeatmapID = 0
+        with tempfile.TemporaryDirectory() as directory:
+            pack_beatmaps([("a", beatmap), ("b", unsubmitted), ("c", beatmap)], directory)
+            packed = PackedBeatmaps(directory)
+            self.assertEqual(packed.positions(beatmap.metadata.BeatmapID), [0, 2])
+            self.assertEqual(packed.position(0), 1)
+            with self.assertRaises(ValueError):
+                packed.position(beatmap.metadata.BeatmapID)
+            with self.assertRaises(KeyError):
+                packed.position(12345)
+            del packed
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), "Needs /proc to list open files")
+    def test_files_closed_on_error(self):
+        def beatmaps():
+            yield "a", create_beatmap_from_file(DATA_MAPS[0])
+            raise RuntimeError("parse failed")
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaises(RuntimeError):
+                pack_beatmaps(beatmaps(), directory)
+            open_files = []
+            for fd in os.listdir('/proc/self/fd'):
+                try:
+                    open_files.append(os.readlink(os.path.join('/proc/self/fd', fd)))
+                except OSError:
+                    pass  # The descriptor of the listing itself
+            self.assertFalse([path for path in open_files if path.startswith(directory)])
+
+class SectionFilterTest(unittest.TestCase):
+    def test_only_requested_sections(self):
+        full = create_beatmap_from_file(DATA_MAPS[0])
+        partial = create_beatmap_from_file(DATA_MAPS[0], sections=["Difficulty", "TimingPoints", "HitObjects"])
+
+        self.assertEqual(partial.difficulty.to_dict(), full.difficulty.to_dict())
+        self.assertEqual(partial.timingPoints.to_dict(), full.timingPoints.to_dict())
+        self.assertEqual(len(partial.hitObjects.to_arrays()), len(full.hitObjects.to_arrays()))
+        self.assertEqual(partial.metadata.to_dict(), Metadata().to_dict())
+        self.assertEqual(partial.events.events, [])
+
+    def test_header_stops_before_hit_objects(self):
+        lines = []
+
+        def read(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    lines.append(line)
+                    yield line
+
+        header = create_beatmap_from_lines(read(DATA_MAPS[0]), sections=HEADER_SECTIONS)
+        self.assertEqual(header.metadata.Title, "One by One")
+        self.assertEqual(header.difficulty.ApproachRate, 9.4)
+        self.assertEqual(lines[-1].strip(), "[Events]")
+
+    def test_unknown_section(self):
+        with self.assertRaises(Exception):
+            create_beatmap_from_file(DATA_MAPS[0], sections=["Storyboard"])
+
+class CorpusIndexTest(unittest.TestCase):
+    def test_incremental_update_and_query(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus = os.path.join(directory, "maps")
+            shutil.copytree(os.path.dirname(DATA_MAPS[0]), corpus)
+            with open(os.path.join(corpus, "broken.osu"), 'w', encoding='utf-8') as file:
+                file.write("[General]\nMode: taiko\n")
+
+            with CorpusIndex(os.path.join(directory, "index.db")) as index:
+                indexed, errors = index.update(corpus, max_workers=2)
+                self.assertEqual(indexed, 3)
+                self.assertEqual(len(errors), 1)
+
+                # Nothing changed, nothing is reparsed
+                self.assertEqual(index.update(corpus, max_workers=2), (0, []))
+
+                rows = index.query("Mode = ? AND ApproachRate BETWEEN ? AND ?", (0, 8, 10))
+                self.assertEqual(sorted(row["Version"] for row in rows), ["Backline", "fdg"])
+                row = rows[0]
+                self.assertEqual(row["hit_objects"], row["circles"] + row["sliders"] + row["spinners"])
+                self.assertLess(row["drain_length"], row["length"])
+                self.assertGreater(row["star_rating"], 0)
+
+                os.remove(os.path.join(corpus, "broken.osu"))
+                index.update(corpus, max_workers=2)
+                self.assertEqual(len(index.connection.execute("SELECT path FROM beatmaps").fetchall()), 2)
+                self.assertEqual(len(index.select_paths("Creator = ?", ("DarkScrap",))), 2)
+
+class SliderTest(unittest.TestCase):
+    def assertPathLength(self, path, length):
+        self.assertAlmostEqual(np.linalg.norm(np.diff(path, axis=0), axis=1).sum(), length, places=6)
+
+    def test_curve_types(self):
+        arc = curve_path('P', np.array([[0, 0], [100, 100], [200, 0]]), 100 * np.pi)
+        # Chords are a little shorter than the arc, so the last one is extended by up to the sampling tolerance
+        self.assertTrue(np.allclose(np.linalg.norm(arc - [100, 0], axis=1), 100, atol=0.5))
+        self.assertTrue(np.allclose(arc[-1], [200, 0], atol=0.5))
+        self.assertPathLength(arc, 100 * np.pi)
+
+        # A repeated point splits a Bézier into two straight segments
+        bezier = curve_path('B', np.array([[0, 0], [100, 0], [100, 0], [100, 100]]), 150)
+        self.assertTrue(np.allclose(bezier[-1], [100, 50]))
+        self.assertTrue(np.allclose(curve_path('B', np.array([[0, 0], [50, 100], [100, 0]]), 1e6)[0], [0, 0]))
+
+        catmull = curve_path('C', np.array([[0, 0], [100, 0], [200, 0]]), 150)
+        self.assertTrue(np.allclose(catmull[:, 1], 0))
+        self.assertTrue(np.allclose(catmull[-1], [150, 0]))
+
+        # Linear paths are cut at, or extended to, the slider length
+        self.assertTrue(np.allclose(curve_path('L', np.array([[0, 0], [10, 0], [10, 10]]), 15)[-1], [10, 5]))
+        self.assertTrue(np.allclose(curve_path('L', np.array([[0, 0], [10, 0]]), 30)[-1], [30, 0]))
+        self.assertTrue(np.allclose(positions_at(curve_path('L', np.array([[0, 0], [10, 0], [10, 10]]), 20), [5, 15, 50]),
+                                    [[5, 0], [10, 5], [10, 10]]))
+
+    def test_memoized_per_shape(self):
+        points = np.array([[0, 0], [40, 80], [120, 20]])
+        first = curve_path('B', points, 130)
+        before = _relative_path.cache_info().hits
+        moved = curve_path('B', points + [50, 60], 130)
+        self.assertEqual(_relative_path.cache_info().hits, before + 1)
+        self.assertTrue(np.allclose(moved, first + [50, 60]))
+
+    def test_vectorized_curves(self):
+        # Linear and perfect circle sliders are evaluated for the whole map at once, the same as curve_path
+        arrays = HitObjectArrays.from_lines([
+            "100,100,1000,2,0,L|200:100|200:100|200:200,1,150",  # Repeated point
+            "100,100,2000,2,0,L|200:100,1,0",
+            "100,100,2500,2,0,L|100:100|100:100,1,30",  # No movement at all
+            "100,100,3000,2,0,P|150:150|200:100,1,100",
+            "100,100,4000,2,0,P|150:100|200:100,1,100",  # Collinear, drawn as a Bézier
+            "100,100,5000,2,0,P|150:150|200:100|250:100,1,200",  # Not three points, drawn as a Bézier
+            "300,100,6000,2,0,P|150:150|200:100,2,500",
+            "256,192,7000,1,0,0:0:0:0:",
+            "100,100,8000,2,0,B|150:150|200:100,1,100",
+            "100,100,9000,2,0,L|300:100,3,50"
+        ])
+        points, offsets = slider_paths(arrays)
+        ends = end_positions(arrays)
+        for i in np.flatnonzero(arrays.is_slider):
+            control = np.concatenate([[[arrays.x[i], arrays.y[i]]], arrays.curve(i)])
+            expected = curve_path(arrays.curve_type[i].decode(), control, arrays.length[i])
+            self.assertEqual(offsets[i + 1] - offsets[i], len(expected))
+            self.assertTrue(np.allclose(points[offsets[i]:offsets[i + 1]], expected))
+            self.assertTrue(np.allclose(ends[i], expected[-1] if arrays.slides[i] % 2 else expected[0]))
+        self.assertEqual(len(end_positions(HitObjectArrays())), 0)
+
+    def test_map_paths(self):
+        beatmap = create_beatmap_from_file(DATA_MAPS[0])
+        arrays = beatmap.hitObjects.to_arrays()
+        points, offsets = slider_paths(arrays)
+        ends = end_positions(arrays)
+        times = end_times(arrays, beatmap.timingPoints, beatmap.difficulty.SliderMultiplier)
+        for i in range(len(arrays)):
+            path = points[offsets[i]:offsets[i + 1]]
+            if arrays.is_slider[i]:
+                self.assertPathLength(path, arrays.length[i])
+                self.assertTrue(np.allclose(path[0], [arrays.x[i], arrays.y[i]]))
+                self.assertTrue(np.allclose(ends[i], path[-1] if arrays.slides[i] % 2 else path[0]))
+                self.assertGreater(times[i], arrays.time[i])
+            else:
+                self.assertEqual(len(path), 0)
+                self.assertEqual(times[i], arrays.end_time[i])
+
+class StarRatingTest(unittest.TestCase):
+    def test_decayed_strains(self):
+        rng = np.random.default_rng(0)
+        times = np.cumsum(rng.integers(50, 400, 4000)).astype(np.float64)  # Long enough to span several chunks
+        values = rng.random(4000)
+        map_start = np.zeros(4000, dtype=np.bool_)
+        map_start[[0, 1000]] = True
+
+        expected = np.empty(4000)
+        for i in range(4000):
+            decayed = 0 if map_start[i] else expected[i - 1] * 0.15 ** ((times[i] - times[i - 1]) / 1000)
+            expected[i] = decayed + values[i]
+        self.assertTrue(np.allclose(_decayed_strains(times, values, map_start, 0.15), expected, rtol=1e-9))
+
+    def test_batch_matches_single_maps(self):
+        beatmaps = [create_beatmap_from_file(path) for path in DATA_MAPS]
+        empty = HitObjectArrays()
+        batch = star_ratings_from_arrays([beatmaps[0].hitObjects.to_arrays(), empty, beatmaps[1].hitObjects.to_arrays()],
+                                         [4, 4, 4], [9, 9, 9])
+        for rating, beatmap in zip(batch[[0, 2]], beatmaps):
+            self.assertEqual(rating, star_ratings([beatmap])[0])
+            self.assertTrue(2 < rating['stars'] < 10)
+        self.assertEqual(batch[1]['stars'], 0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            pack_files(DATA_MAPS, directory)
+            packed = PackedBeatmaps(directory)
+            by_source = dict(zip(DATA_MAPS, star_ratings(beatmaps)))
+            for packed_map, rating in zip(packed, star_ratings(packed)):
+                self.assertAlmostEqual(rating['stars'], by_source[packed_map.source]['stars'], places=4)
+            del packed, packed_map
+
+    def test_harder_settings_rate_higher(self):
+        arrays = create_beatmap_from_file(DATA_MAPS[0]).hitObjects.to_arrays()
+        faster = HitObjectArrays.from_lines(HitObjects.from_arrays(arrays).to_lines())
+        faster.time = faster.time // 2
+        ratings = star_ratings_from_arrays([arrays, arrays, faster], [4, 6, 4], [9, 9, 9])
+        self.assertGreater(ratings[1]['aim'], ratings[0]['aim'])
+        self.assertGreater(ratings[2]['speed'], ratings[0]['speed'])
+
+class WriterTest(unittest.TestCase):
+    def assertSameBeatmap(self, written, beatmap):
+        for name in ['general', 'editor', 'metadata', 'difficulty', 'events', 'timingPoints', 'colours']:
+            self.assertEqual(getattr(written, name).to_dict(), getattr(beatmap, name).to_dict())
+        for name, column in beatmap.hitObjects.to_arrays().to_dict().items():
+            self.assertTrue(np.array_equal(getattr(written.hitObjects.to_arrays(), name), column), name)
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for path in DATA_MAPS:
+                beatmap = create_beatmap_from_file(path)
+                output = os.path.join(directory, "out.osu")
+                write_beatmap(beatmap, output)
+                self.assertSameBeatmap(create_beatmap_from_file(output), beatmap)
+
+    def test_round_trip_from_objects_and_columns(self):
+        beatmap = create_beatmap_from_file(DATA_MAPS[0])
+        beatmap.hitObjects.hit_objects[0].x = 7
+        written = create_beatmap_from_lines(beatmap_to_string(beatmap).splitlines())
+        self.assertEqual([vars(o) for o in written.hitObjects.hit_objects],
+                         [vars(o) for o in beatmap.hitObjects.hit_objects])
+
+        beatmap.hitObjects = HitObjects.from_arrays(beatmap.hitObjects.to_arrays())
+        self.assertSameBeatmap(create_beatmap_from_lines(beatmap_to_string(beatmap).splitlines()), beatmap)
+        self.assertEqual(beatmap.hitObjects.to_arrays().x[0], 7)
+
+    def test_format_decimal(self):
+        for value in [500.0, -100.0, 31.4999990386963, 1 / 3, 1e-5, 0.7]:
+            self.assertEqual(float(format_decimal(value)), value)
+        self.assertEqual(format_decimal(500.0), "500")
+
+    def test_osz(self):
+        beatmaps = [create_beatmap_from_file(path) for path in DATA_MAPS]
+        with tempfile.TemporaryDirectory() as directory:
+            osz = os.path.join(directory, "set.osz")
+            with OszWriter(osz) as writer:
+                names = [writer.add_beatmap(beatmap) for beatmap in beatmaps + beatmaps]
+            self.assertEqual(len(set(names)), 2 * len(beatmaps))
+
+            with zipfile.ZipFile(osz) as archive:
+                self.assertEqual(sorted(archive.namelist()), sorted(names))
+                for name, beatmap in zip(names, beatmaps + beatmaps):
+                    lines = archive.read(name).decode('utf-8').splitlines()
+                    self.assertSameBeatmap(create_beatmap_from_lines(lines), beatmap)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,551 @@
+from parsing.audio_processing import *
+from parsing.audio_batch import run_batch, song_id
+import parsing.audio_batch
+from parsing.audio_cache import AudioCache, cached_audio_processing
+from parsing.audio_features import AudioFeatures, beat_frames, beat_synchronous, extract_features, pack_audio_features
+from parsing.instrumentation import PipelineReport, StageRecord, _RSSSampler
+from parsing.parse import TimingPoints
+import parsing.instrumentation
+import parsing.audio_cache
+import parsing.audio_processing as pipeline
+import json, os, pickle, sys, tempfile, time, unittest
+from unittest import mock
+
+# Stands in for spleeter, which needs TensorFlow and the pretrained models. It
+# is written to a directory put first on sys.path, so processes spawned by the
+# batch runner import it too.
+STUB_SPLEETER = '''
+import os
+import numpy as np
+
+STEMS = {2: ["vocals", "accompaniment"], 4: ["vocals", "drums", "bass", "other"]}
+FLAKY_SAMPLES = 23456  # Songs of this length fail with a transient error
+CRASH_SAMPLES = 34567  # Songs of this length kill the process, once per STUB_CRASH_FLAG file
+created = []
+
+class Separator:
+    def __init__(self, params_descriptor):
+        self.num_stems = int(params_descriptor.split(":")[1][0])
+        created.append(self.num_stems)
+
+    def separate(self, waveform, audio_descriptor=None):
+        # Fails for silence, so tests can feed a song that cannot be separated
+        if not np.any(waveform):
+            raise ValueError("Silent input")
+        if len(waveform) == FLAKY_SAMPLES:
+            raise OSError("Flaky input")
+        flag = os.environ.get("STUB_CRASH_FLAG")
+        if len(waveform) == CRASH_SAMPLES and flag and not os.path.exists(flag):
+            open(flag, 'w').close()
+            os._exit(1)
+        names = STEMS[self.num_stems]
+        return {name: waveform / len(names) for name in names}
+
+    def separate_to_file(self, audio_descriptor, destination, **kwargs):
+        from parsing.audio_processing import AudioBuffer, save_stems, stem_dir
+        save_stems(self.separate(AudioBuffer.load(audio_descriptor).waveform), stem_dir(audio_descriptor, destination))
+'''
+
+def install_stub_spleeter(directory: str):
+    os.makedirs(os.path.join(directory, "spleeter"), exist_ok=True)
+    with open(os.path.join(directory, "spleeter", "__init__.py"), 'w') as file:
+        file.write("")
+    with open(os.path.join(directory, "spleeter", "separator.py"), 'w') as file:
+        file.write(STUB_SPLEETER)
+    sys.path.insert(0, directory)
+    for name in [name for name in sys.modules if name.split('.')[0] == "spleeter"]:
+        del sys.modules[name]
+    pipeline._separators.clear()
+
+def remove_stub_spleeter(directory: str):
+    sys.path.remove(directory)
+    for name in [name for name in sys.modules if name.split('.')[0] == "spleeter"]:
+        del sys.modules[name]
+    pipeline._separators.clear()
+
+def click_track(seconds: float = 20.0, bpm: float = 120.0, sr: int = SAMPLING_RATE, offset: float = 0.5) -> ndarray:
+    """
+    (samples, 2) float32 test song: a decaying 880 Hz click on every beat and a
+    quieter 3 kHz one on every off-beat.
+    """
+    t = np.arange(int(seconds * sr)) / sr
+    beat = 60 / bpm
+    since_beat = np.mod(t - offset, beat)
+    since_half = np.mod(t - offset - beat / 2, beat)
+    y = (np.sin(2 * np.pi * 880 * t) * np.exp(-since_beat * 40) * (t >= offset)
+         + 0.3 * np.sin(2 * np.pi * 3000 * t) * np.exp(-since_half * 60) * (t >= offset + beat / 2))
+    return np.stack([y, y], axis=1).astype(np.float32) * 0.5
+
+def scan_measure_prioritization(tempo, beat_times, all_onset_times):
+    """
+    The original nested-scan measure_prioritization, kept as the reference for the vectorized one.
+    """
+    prioritized_onsets = []
+    measure_duration = 4 * (60 / tempo[0])
+    segment_start_time = 0
+    for beat_time in beat_times:
+        if segment_start_time == 0 or beat_time - segment_start_time > measure_duration:
+            segment_onsets = [time for time in all_onset_times if segment_start_time <= time < beat_time]
+            if segment_onsets:
+                prioritized_onsets.append(segment_onsets[0])
+            segment_start_time = beat_time
+    segment_onsets = [time for time in all_onset_times if segment_start_time <= time]
+    if segment_onsets:
+        prioritized_onsets.append(segment_onsets[0])
+    return prioritized_onsets
+
+class AudioTestCase(unittest.TestCase):
+    """
+    A temporary directory with the stub spleeter and a 20 s click track at 120 BPM (song.wav).
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.stub = os.path.join(cls.directory.name, "stub")
+        install_stub_spleeter(cls.stub)
+        cls.song = os.path.join(cls.directory.name, "song.wav")
+        soundfile.write(cls.song, click_track(), SAMPLING_RATE)
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_stub_spleeter(cls.stub)
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.output = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output.cleanup)
+
+class SeparatorTest(AudioTestCase):
+    def test_separator_is_reused(self):
+        from spleeter import separator
+        self.assertIs(get_separator(2), get_separator(2))
+        self.assertIsNot(get_separator(4), get_separator(2))
+        # One model load per stem count, however many calls
+        self.assertEqual(sorted(separator.created), [2, 4])
+
+    def test_spleet(self):
+        spleet(self.song, self.output.name)
+        stems = stem_dir(self.song, self.output.name)
+        self.assertEqual(sorted(os.listdir(stems)), ["accompaniment.wav", "vocals.wav"])
+        self.assertEqual(soundfile.info(os.path.join(stems, "vocals.wav")).duration, 20.0)
+
+    def test_spleet_many_reports_each_failure(self):
+        silent = os.path.join(self.output.name, "silent.wav")
+        soundfile.write(silent, np.zeros((SAMPLING_RATE, 2), dtype=np.float32), SAMPLING_RATE)
+        unwritable = os.path.join(self.output.name, "unwritable.wav")
+        soundfile.write(unwritable, click_track(seconds=2), SAMPLING_RATE)
+        dest = os.path.join(self.output.name, "stems")
+        os.makedirs(dest)
+        with open(stem_dir(unwritable, dest), 'w') as file:
+            file.write("A file where the stem directory should go")
+
+        failed = spleet_many([self.song, silent, unwritable, "missing.wav"], dest)
+        self.assertEqual(sorted(failed), sorted([silent, unwritable, "missing.wav"]))
+        self.assertEqual(sorted(os.listdir(stem_dir(self.song, dest))), ["accompaniment.wav", "vocals.wav"])
+
+class InMemoryStemsTest(AudioTestCase):
+    def test_stems_stay_in_memory(self):
+        audio = AudioBuffer.load(self.song)
+        stems = separate(audio.waveform, num_stems=4)
+        self.assertEqual(sorted(stems), ["bass", "drums", "other", "vocals"])
+
+        # Onsets of the in-memory stems match those of the stems written to disk
+        save_stems(stems, self.output.name)
+        from_memory = compute_onsets_from_stems(stems, audio.sr)
+        from_files = compute_onsets(self.output.name)
+        self.assertTrue(np.allclose(from_memory, from_files))
+
+    def test_audio_processing_writes_stems_only_on_request(self):
+        onsets = audio_processing(self.song, stems=2)
+        self.assertEqual(os.listdir(self.output.name), [])
+
+        self.assertEqual(audio_processing(self.song, self.output.name, stems=2), onsets)
+        self.assertEqual(sorted(os.listdir(stem_dir(self.song, self.output.name))), ["accompaniment.wav", "vocals.wav"])
+        # Every kept onset is a click of the track (beats and off-beats, every 0.25 s from 0.5 s)
+        phase = np.mod(np.array(onsets) - 0.5 + 0.125, 0.25) - 0.125
+        self.assertTrue(np.all(np.abs(phase) < 0.03), onsets)
+        self.assertGreater(len(onsets), 5)
+
+class AudioBufferTest(AudioTestCase):
+    def test_load(self):
+        audio = AudioBuffer.load(self.song)
+        self.assertEqual(audio.waveform.shape, (20 * SAMPLING_RATE, 2))
+        self.assertEqual(audio.waveform.dtype, np.float32)
+        self.assertEqual(audio.sr, SAMPLING_RATE)
+        self.assertEqual(audio.duration, 20.0)
+
+    def test_mono_file_is_duplicated(self):
+        mono = os.path.join(self.output.name, "mono.wav")
+        soundfile.write(mono, click_track(seconds=2)[:, 0], SAMPLING_RATE)
+        audio = AudioBuffer.load(mono)
+        self.assertEqual(audio.waveform.shape, (2 * SAMPLING_RATE, 2))
+        self.assertTrue(np.array_equal(audio.waveform[:, 0], audio.waveform[:, 1]))
+
+    def test_mono_is_resampled_once(self):
+        audio = AudioBuffer.load(self.song)
+        self.assertIs(audio.mono(), audio.mono(SAMPLING_RATE))
+        self.assertIs(audio.mono(ANALYSIS_RATE), audio.mono(ANALYSIS_RATE))
+        self.assertEqual(len(audio.mono(ANALYSIS_RATE)), 20 * ANALYSIS_RATE)
+
+    def test_tempo_from_buffer(self):
+        # The shared buffer gives the same beats as decoding the file again
+        tempo, beat_times = compute_tempo(audio=AudioBuffer.load(self.song))
+        file_tempo, file_beat_times = compute_tempo(self.song)
+        self.assertTrue(np.array_equal(tempo, file_tempo))
+        self.assertTrue(np.array_equal(beat_times, file_beat_times))
+        self.assertGreater(len(beat_times), 10)
+
+class ConcurrentOnsetsTest(AudioTestCase):
+    def setUp(self):
+        super().setUp()
+        save_stems(separate(AudioBuffer.load(self.song).waveform, num_stems=4), self.output.name)
+
+    def test_concurrent_matches_sequential(self):
+        self.assertTrue(np.array_equal(compute_onsets(self.output.name), compute_onsets(self.output.name, max_workers=1)))
+
+    def test_return_by_track(self):
+        all_onset_times, by_track = compute_onsets(self.output.name, return_by_track=True)
+        self.assertEqual(sorted(by_track), ["bass", "drums", "other", "vocals"])
+        self.assertTrue(np.array_equal(all_onset_times, np.sort(np.hstack(list(by_track.values())))))
+
+    def test_no_tracks(self):
+        empty = os.path.join(self.output.name, "empty")
+        os.makedirs(empty)
+        with self.assertRaises(Exception):
+            compute_onsets(empty)
+
+class AudioCacheTest(AudioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = AudioCache(self.output.name)
+
+    def test_key(self):
+        audio_hash = AudioCache.audio_hash(self.song)
+        self.assertEqual(AudioCache.key(audio_hash, 'separate', {"stems": 2}), AudioCache.key(audio_hash, 'separate', {"stems": 2}))
+        self.assertNotEqual(AudioCache.key(audio_hash, 'separate', {"stems": 2}), AudioCache.key(audio_hash, 'separate', {"stems": 4}))
+        self.assertNotEqual(AudioCache.key(audio_hash, 'separate', {"stems": 2}), AudioCache.key(audio_hash, 'tempo', {"stems": 2}))
+        self.assertNotEqual(AudioCache.key(audio_hash, 'tempo', {}), AudioCache.key("0" * 40, 'tempo', {}))
+
+        # Stems, and the onsets computed from them, are recomputed when spleeter changes; the tempo is not
+        keys = []
+        for version in ["2.3.2", "2.4.0"]:
+            with mock.patch('parsing.audio_cache.spleeter_version', return_value=version):
+                keys.append([AudioCache.key(audio_hash, stage, {"stems": 2}) for stage in ['separate', 'onsets', 'tempo']])
+        self.assertNotEqual(keys[0][0], keys[1][0])
+        self.assertNotEqual(keys[0][1], keys[1][1])
+        self.assertEqual(keys[0][2], keys[1][2])
+
+    def test_stage_computes_once(self):
+        compute = mock.Mock(return_value={"x": np.arange(3)})
+        first = self.cache.stage("0" * 40, 'test', {}, compute)
+        second = self.cache.stage("0" * 40, 'test', {}, compute)
+        compute.assert_called_once()
+        self.assertTrue(np.array_equal(first["x"], second["x"]))
+        self.cache.stage("0" * 40, 'test', {"other": 1}, compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_cached_audio_processing(self):
+        expected = audio_processing(self.song, stems=2)
+        with mock.patch.object(parsing.audio_cache, 'separate', wraps=separate) as separate_mock, \
+                mock.patch.object(parsing.audio_cache, 'compute_tempo', wraps=compute_tempo) as tempo_mock:
+            self.assertEqual(cached_audio_processing(self.song, self.cache, stems=2), expected)
+            self.assertEqual(cached_audio_processing(self.song, self.cache, stems=2), expected)
+            self.assertEqual(separate_mock.call_count, 1)
+            self.assertEqual(tempo_mock.call_count, 1)
+
+            # The tempo does not depend on the stem count, the onsets do
+            cached_audio_processing(self.song, self.cache, stems=4)
+            self.assertEqual(separate_mock.call_count, 2)
+            self.assertEqual(tempo_mock.call_count, 1)
+
+class MeasurePrioritizationTest(unittest.TestCase):
+    def test_matches_scan(self):
+        rng = np.random.default_rng(0)
+        for _ in range(300):
+            if rng.random() < 0.5:
+                # Beats on frames and a tempo of a whole frame lag, as librosa reports them, so beats land exactly a
+                # measure apart
+                frame = HOP_LENGTH / ANALYSIS_RATE
+                lag = rng.integers(10, 50)
+                tempo = np.array([60 / (lag * frame)])
+                beat_times = (np.arange(rng.integers(0, 60)) * lag + rng.integers(0, 100)) * frame
+            else:
+                tempo = np.array([rng.uniform(60, 240)])
+                beat_times = np.sort(rng.uniform(0, 60, rng.integers(0, 120)))
+            if rng.random() < 0.2:
+                beat_times = np.concatenate([[0.0], beat_times])
+            onsets = np.sort(rng.uniform(-1, 65, rng.integers(0, 400)))
+            if rng.random() < 0.2:
+                onsets = np.round(onsets * 4) / 4  # Onsets on beats and edges
+            self.assertEqual(measure_prioritization(tempo, beat_times, onsets),
+                             scan_measure_prioritization(tempo, beat_times, onsets.tolist()))
+
+    def test_beat_at_zero(self):
+        # A measure opened at 0.0 s is closed by the next beat, like the scan's segment_start_time == 0 check
+        self.assertTrue(np.array_equal(measure_boundaries(60, [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0]), [0.0, 1.0, 6.0]))
+        self.assertEqual(measure_prioritization([60], [0.0, 1.0, 6.0], [0.5, 0.7, 1.5, 6.5]), [0.5, 1.5, 6.5])
+
+    def test_top_k(self):
+        beat_times = np.arange(1, 13, dtype=np.float64)  # 60 BPM: measures open at 1, 6 and 11
+        onsets = [0.5, 1.0, 1.5, 2.0, 6.0, 6.5, 11.5]
+        self.assertEqual(measure_prioritization(60, beat_times, onsets, top_k=2), [0.5, 1.0, 1.5, 6.0, 6.5, 11.5])
+        self.assertEqual(measure_prioritization(60, beat_times, onsets, top_k=0), [])
+
+    def test_onset_strengths(self):
+        beat_times = np.arange(1, 13, dtype=np.float64)
+        onsets = [0.5, 1.0, 1.5, 2.0, 6.0, 6.5, 11.5]
+        strengths = [1, 1, 3, 2, 1, 1, 5]
+        # The strongest onsets of each measure, in time order; ties go to the earliest
+        self.assertEqual(measure_prioritization(60, beat_times, onsets, onset_strengths=strengths), [0.5, 1.5, 6.0, 11.5])
+        self.assertEqual(measure_prioritization(60, beat_times, onsets, top_k=2, onset_strengths=strengths),
+                         [0.5, 1.5, 2.0, 6.0, 6.5, 11.5])
+
+    def test_per_beat_tempo(self):
+        # 60 BPM (4 s measures) for the first 8 beats, then 120 BPM (2 s measures)
+        beat_times = np.concatenate([np.arange(1, 9), 8.5 + np.arange(12) * 0.5])
+        tempo = np.where(beat_times < 8.5, 60.0, 120.0)
+        self.assertTrue(np.array_equal(measure_boundaries(tempo, beat_times), [1.0, 6.0, 10.5, 13.0]))
+        # A per-beat array of one tempo is the same as the global tempo
+        self.assertTrue(np.array_equal(measure_boundaries(np.full(len(beat_times), 60.0), beat_times),
+                                       measure_boundaries(60.0, beat_times)))
+
+class StreamingTest(AudioTestCase):
+    def test_onset_envelope(self):
+        y = AudioBuffer.load(self.song).mono(ANALYSIS_RATE)
+        for aggregate in [np.mean, np.median]:
+            expected = librosa.onset.onset_strength(y=y, sr=ANALYSIS_RATE, hop_length=HOP_LENGTH, aggregate=aggregate)
+            # Small blocks, so the envelope is stitched across many block boundaries
+            streamed = stream_onset_envelope(self.song, ANALYSIS_RATE, block_length=100, aggregate=aggregate)
+            self.assertEqual(len(streamed), len(expected))
+            self.assertLess(np.abs(streamed - expected).max(), 0.1 * expected.max())
+
+    def test_tempo(self):
+        tempo, beat_times = compute_tempo(self.song)
+        streamed_tempo, streamed_beat_times = compute_tempo_streaming(self.song, block_length=100)
+        self.assertTrue(np.allclose(streamed_tempo, tempo))
+        self.assertEqual(len(streamed_beat_times), len(beat_times))
+        self.assertTrue(np.allclose(streamed_beat_times, beat_times, atol=HOP_LENGTH / ANALYSIS_RATE))
+
+    def test_unreadable_format(self):
+        not_audio = os.path.join(self.output.name, "song.m4a")
+        with open(not_audio, 'wb') as file:
+            file.write(b"\0\0\0\x20ftypM4A " + bytes(64))
+        with self.assertRaises(ValueError):
+            next(stream_blocks(not_audio, 1024))
+
+    def test_falls_back_to_audio_processing(self):
+        expected = audio_processing(self.song, stems=2)
+        with mock.patch.object(pipeline.soundfile, 'info', side_effect=RuntimeError("Format not recognised")):
+            self.assertEqual(audio_processing_streaming(self.song, self.output.name, stems=2), expected)
+        # The fallback still keeps the stems it was asked to
+        self.assertEqual(sorted(os.listdir(stem_dir(self.song, self.output.name))), ["accompaniment.wav", "vocals.wav"])
+
+class BatchTest(AudioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.songs = []
+        for i in range(3):
+            self.songs.append(os.path.join(self.output.name, f"song{i}.wav"))
+            soundfile.write(self.songs[-1], click_track(seconds=4 + i), SAMPLING_RATE)
+        self.silent = os.path.join(self.output.name, "silent.wav")
+        soundfile.write(self.silent, np.zeros((SAMPLING_RATE, 2), dtype=np.float32), SAMPLING_RATE)
+        self.flaky = os.path.join(self.output.name, "flaky.wav")
+        soundfile.write(self.flaky, click_track(seconds=1)[:23456], SAMPLING_RATE)
+        self.results = os.path.join(self.output.name, "results")
+
+    def run_batch(self, paths, **kwargs):
+        return {result.path: result for result in run_batch(paths, self.results, stems=2, analysis_workers=1, **kwargs)}
+
+    def test_batch(self):
+        report = PipelineReport()
+        results = self.run_batch(self.songs + [self.silent, self.flaky], retries=1, report=report, max_pending=1)
+        self.assertEqual(sorted(results), sorted(self.songs + [self.silent, self.flaky]))
+
+        for i, path in enumerate(self.songs):
+            self.assertTrue(results[path].ok)
+            self.assertEqual(results[path].attempts, 0)
+            with open(results[path].result_path, 'r', encoding='utf-8') as file:
+                result = json.load(file)
+            self.assertEqual(sorted(result["onset_times"]), ["accompaniment", "vocals"])
+            self.assertEqual(result["prioritized_onsets"], measure_prioritization(
+                np.array(result["tempo"]), np.array(result["beat_times"]),
+                np.sort(np.hstack(list(result["onset_times"].values())))))
+            # Durations come from the separation stage, for every stage
+            self.assertEqual({record.audio_s for record in report.records if record.song == path}, {4.0 + i})
+        # Stems are dropped once a song is done
+        self.assertEqual(os.listdir(os.path.join(self.results, "stems")), [])
+
+        # The silent song fails the same way every time, so it is not retried
+        self.assertFalse(results[self.silent].ok)
+        self.assertEqual(results[self.silent].attempts, 1)
+        self.assertIn("ValueError", results[self.silent].error)
+        # The flaky one is retried once, and both attempts are reported
+        self.assertFalse(results[self.flaky].ok)
+        self.assertEqual(results[self.flaky].attempts, 2)
+        failed = [record for record in report.records if record.song == self.flaky]
+        self.assertEqual([record.stage for record in failed], ["separate", "separate"])
+        self.assertTrue(all("Flaky input" in record.error for record in failed))
+        self.assertEqual(report.summary()["separate"]["errors"], 3)
+
+    def test_unreadable_format(self):
+        # Not streamable, so decoded whole, which fails for good: no retries
+        not_audio = os.path.join(self.output.name, "song.m4a")
+        with open(not_audio, 'wb') as file:
+            file.write(b"\0\0\0\x20ftypM4A " + bytes(64))
+        results = self.run_batch([not_audio], retries=2)
+        self.assertFalse(results[not_audio].ok)
+        self.assertEqual(results[not_audio].attempts, 1)
+
+    def test_whole_file_fallback(self):
+        # Songs libsndfile cannot stream go through the whole-file functions instead
+        stems_dir = os.path.join(self.output.name, "stems")
+        result_path = os.path.join(self.output.name, "result.json")
+        with mock.patch.object(parsing.audio_batch, 'can_stream', return_value=False), \
+                mock.patch.object(parsing.audio_batch, 'separate_streaming', side_effect=AssertionError), \
+                mock.patch.object(parsing.audio_batch, 'compute_tempo_streaming', side_effect=AssertionError):
+            records, error, _ = parsing.audio_batch._separate_job(self.songs[0], stems_dir, 2)
+            self.assertIsNone(error)
+            self.assertEqual(records[0].audio_s, 4.0)
+            records, error, _ = parsing.audio_batch._analyse_job(self.songs[0], stems_dir, result_path, 2, 1, False, 4.0)
+            self.assertIsNone(error)
+        with open(result_path, 'r', encoding='utf-8') as file:
+            self.assertTrue(np.allclose(json.load(file)["tempo"], compute_tempo(self.songs[0])[0]))
+
+    def test_worker_crash(self):
+        # The first song kills its worker, which breaks the pool with the other songs queued behind it
+        crash = os.path.join(self.output.name, "crash.wav")
+        soundfile.write(crash, click_track(seconds=1)[:34567], SAMPLING_RATE)
+        with mock.patch.dict(os.environ, {"STUB_CRASH_FLAG": os.path.join(self.output.name, "crashed")}):
+            results = self.run_batch([crash] + self.songs[:2], retries=1, max_pending=3)
+        self.assertTrue(os.path.exists(os.path.join(self.output.name, "crashed")))
+        # The pool is recreated and every song in flight is resubmitted, the crash costing each one attempt
+        for path in [crash] + self.songs[:2]:
+            self.assertTrue(results[path].ok, results[path].error)
+            self.assertEqual(results[path].attempts, 1)
+
+    def test_resume(self):
+        first = self.run_batch(self.songs[:2])
+        # Stems left behind by an interrupted run are reused
+        stems_dir = os.path.join(self.results, "stems", song_id(self.songs[2]))
+        save_stems(separate(AudioBuffer.load(self.songs[2]).waveform), stems_dir)
+
+        report = PipelineReport()
+        second = self.run_batch(self.songs, report=report)
+        self.assertTrue(second[self.songs[0]].skipped and second[self.songs[1]].skipped)
+        self.assertFalse(second[self.songs[2]].skipped)
+        self.assertTrue(second[self.songs[2]].ok)
+        self.assertEqual(second[self.songs[0]].result_path, first[self.songs[0]].result_path)
+        self.assertEqual(sorted(record.stage for record in report.records), ["onsets", "prioritize", "tempo"])
+        self.assertEqual({record.audio_s for record in report.records}, {6.0})
+
+class InstrumentationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_stage(self):
+        report = PipelineReport()
+        with report.stage("song", "decode") as record:
+            time.sleep(0.01)
+            record.audio_s = 2.0
+        with self.assertRaises(ValueError):
+            with report.stage("song", "separate", 2.0):
+                raise ValueError("Bad audio")
+
+        decode, separate = report.records
+        self.assertEqual((decode.song, decode.stage, decode.audio_s, decode.error), ("song", "decode", 2.0, None))
+        self.assertGreaterEqual(decode.wall_s, 0.01)
+        self.assertAlmostEqual(decode.real_time_factor, decode.wall_s / 2.0)
+        self.assertEqual(separate.error, "ValueError: Bad audio")
+        self.assertEqual(list(report.by_song()), ["song"])
+        if parsing.instrumentation.current_rss() is not None:
+            self.assertGreater(decode.peak_rss_bytes, 0)
+
+    def test_rss_unavailable_while_sampling(self):
+        # /proc can stop answering mid-stage; the sampler keeps the peak it has
+        readings = iter([1000, None, 3000, None, None])
+        with mock.patch.object(parsing.instrumentation, 'current_rss', side_effect=lambda: next(readings, None)):
+            with _RSSSampler(interval=0.001) as sampler:
+                time.sleep(0.05)
+        self.assertEqual(sampler.peak, 3000)
+
+    def test_summary(self):
+        report = PipelineReport()
+        for song, wall_s, audio_s, rss, error in [("a", 1.0, 10.0, 100, None), ("b", 3.0, 30.0, 300, None),
+                                                  ("c", 0.5, None, None, "ValueError: x")]:
+            record = StageRecord(song, "tempo", audio_s)
+            record.wall_s, record.cpu_s, record.peak_rss_bytes, record.error = wall_s, 2 * wall_s, rss, error
+            report.add(record)
+        self.assertEqual(report.summary(), {"tempo": {
+            "songs": 3, "errors": 1, "wall_s": 4.5, "cpu_s": 9.0, "audio_s": 40.0, "peak_rss_bytes": 300,
+            "real_time_factor": 4.5 / 40.0}})
+
+    def test_write_json(self):
+        log_path = os.path.join(self.directory.name, "log.jsonl")
+        report = PipelineReport(log_path)
+        with report.stage("song", "tempo", 1.0):
+            pass
+        with report.stage("song", "onsets", 1.0):
+            pass
+        path = os.path.join(self.directory.name, "report.json")
+        report.write_json(path)
+
+        with open(path, 'r', encoding='utf-8') as file:
+            written = json.load(file)
+        self.assertEqual(written["environment"]["librosa"], librosa.__version__)
+        self.assertEqual(sorted(written["summary"]), ["onsets", "tempo"])
+        self.assertEqual([StageRecord.from_dict(record).to_dict() for record in written["records"]],
+                         [record.to_dict() for record in report.records])
+        with open(log_path, 'r', encoding='utf-8') as file:
+            logged = [json.loads(line) for line in file]
+        self.assertEqual([line["stage"] for line in logged], ["tempo", "onsets"])
+
+class AudioFeaturesTest(AudioTestCase):
+    def test_extract_features(self):
+        audio = AudioBuffer.load(self.song)
+        features = extract_features(audio=audio)
+        y = audio.mono(ANALYSIS_RATE)
+        self.assertEqual(features["mel"].shape, (1 + len(y) // HOP_LENGTH, 128))
+        # The envelope is librosa's, from the one spectrogram
+        self.assertTrue(np.allclose(features["onset"], librosa.onset.onset_strength(y=y, sr=ANALYSIS_RATE, hop_length=HOP_LENGTH)))
+
+    def test_pack(self):
+        short = os.path.join(self.output.name, "short.wav")
+        soundfile.write(short, click_track(seconds=3), SAMPLING_RATE)
+        packed = os.path.join(self.output.name, "features")
+        errors = pack_audio_features(iter([self.song, "missing.wav", short]), packed, max_workers=1, max_pending=1)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("missing.wav: "))
+
+        features = pickle.loads(pickle.dumps(AudioFeatures(packed)))
+        self.assertEqual(sorted(features.sources), sorted([self.song, short]))
+        for path in [self.song, short]:
+            i = features.position(path)
+            song = features[i]
+            expected = extract_features(path)
+            self.assertIsInstance(song["mel"], np.memmap)
+            self.assertEqual(song["mel"].dtype, np.float16)
+            self.assertEqual(features.num_frames(i), len(expected["mel"]))
+            self.assertTrue(np.allclose(song["mel"], expected["mel"], atol=0.1))
+            self.assertTrue(np.allclose(song["onset"], expected["onset"], atol=0.01))
+
+        i = features.position(short)
+        window = features.window(i, features.num_frames(i) - 10, 64)
+        self.assertEqual(len(window["mel"]), 10)  # Clipped to the end of the song
+        self.assertTrue(np.shares_memory(window["mel"], features.arrays["mel"]))
+        del features, song, window
+
+    def test_beat_synchronous(self):
+        features = np.arange(10, dtype=np.float16)
+        self.assertTrue(np.array_equal(beat_synchronous(features, [0, 4, 4, 9]), [1.5, 4, 6, 9]))
+        self.assertEqual(beat_synchronous(features.reshape(5, 2), []).shape, (0, 2))
+
+        timing_points = TimingPoints()
+        timing_points.load_from_string("1000,500,4,2,0,60,1,0")
+        frames = beat_frames(timing_points, 200)
+        frame_ms = 1000 * HOP_LENGTH / ANALYSIS_RATE
+        self.assertTrue(np.array_equal(frames, np.rint(np.arange(0, 200 * frame_ms, 500) / frame_ms)))
+
+if __name__ == "__main__":
+    unittest.main()
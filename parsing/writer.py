@@ -0,0 +1,181 @@
+import io, os, re, zipfile
+from typing import IO, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from parsing.parse import Beatmap, Colours, Events, Section, TimingPoints, format_decimal
+
+FILE_FORMAT_VERSION = 14
+NEWLINE = '\r\n'  # What the osu! editor writes
+WRITE_BUFFER_SIZE = 1 << 16
+
+# Key/value separator of every key/value section, as the osu! editor writes them
+KEY_VALUE_SEPARATORS = {
+    "General": ": ",
+    "Editor": ": ",
+    "Metadata": ":",
+    "Difficulty": ":"
+}
+
+def format_value(value) -> str:
+    if isinstance(value, float):
+        return format_decimal(value)
+    if isinstance(value, list):
+        return ' '.join(value) if value and isinstance(value[0], str) else ','.join(map(str, value))
+    return str(value)
+
+def key_value_lines(
+    section: Section,
+    separator: str = ": "
+) -> List[str]:
+    """
+    "Key: value" lines of a General/Editor/Metadata/Difficulty section. Unset
+    (None) fields and empty Editor bookmarks are left out.
+    """
+    return [f"{key}{separator}{format_value(value)}" for key, value in section.__dict__.items()
+            if value is not None and not (key == 'Bookmarks' and not value)]
+
+def event_lines(events: Events) -> List[str]:
+    lines = []
+    for event in events.events:
+        if event["type"] == "Background":
+            lines.append(f'0,0,"{event["filename"]}",{event["offset"][0]},{event["offset"][1]}')
+        elif event["type"] == "Video":
+            lines.append(f'Video,{event["startTime"]},"{event["filename"]}",{event["offset"][0]},{event["offset"][1]}')
+        elif event["type"] == "Break":
+            lines.append(f'2,{event["startTime"]},{event["endTime"]}')
+        else:
+            lines.append(event["data"])
+    return lines
+
+def timing_point_lines(timing_points: TimingPoints) -> List[str]:
+    """
+    TimingPoints lines, straight from the structured array.
+    """
+    points = timing_points.to_numpy()
+    columns = zip(points['time'].tolist(), map(format_decimal, points['beat_length'].tolist()), points['meter'].tolist(),
+                  points['sample_set'].tolist(), points['sample_index'].tolist(), points['volume'].tolist(),
+                  points['uninherited'].astype(np.uint8).tolist(), points['effects'].tolist())
+    return [','.join(map(str, row)) for row in columns]
+
+def colour_lines(colours: Colours) -> List[str]:
+    lines = [f"{key} : {','.join(map(str, value))}" for key, value in colours.combo_colors.items()]
+    if colours.slider_track_override is not None:
+        lines.append(f"SliderTrackOverride : {','.join(map(str, colours.slider_track_override))}")
+    if colours.slider_border is not None:
+        lines.append(f"SliderBorder : {','.join(map(str, colours.slider_border))}")
+    return lines
+
+def beatmap_sections(beatmap: Beatmap) -> Iterator[str]:
+    """
+    The text of a .osu file, one section (header included) at a time.
+    """
+    yield f"osu file format v{FILE_FORMAT_VERSION}{NEWLINE}"
+    sections = [
+        ("General", key_value_lines(beatmap.general, KEY_VALUE_SEPARATORS["General"])),
+        ("Editor", key_value_lines(beatmap.editor, KEY_VALUE_SEPARATORS["Editor"])),
+        ("Metadata", key_value_lines(beatmap.metadata, KEY_VALUE_SEPARATORS["Metadata"])),
+        ("Difficulty", key_value_lines(beatmap.difficulty, KEY_VALUE_SEPARATORS["Difficulty"])),
+        ("Events", event_lines(beatmap.events)),
+        ("TimingPoints", timing_point_lines(beatmap.timingPoints)),
+        ("Colours", colour_lines(beatmap.colours)),
+        ("HitObjects", beatmap.hitObjects.to_lines())
+    ]
+    for name, lines in sections:
+        if name == "Colours" and not lines:
+            continue
+        yield NEWLINE.join([f"{NEWLINE}[{name}]"] + lines) + NEWLINE
+
+def beatmap_to_string(beatmap: Beatmap) -> str:
+    return ''.join(beatmap_sections(beatmap))
+
+def write_beatmap(
+    beatmap: Beatmap,
+    file: Union[str, IO[str]]
+):
+    """
+    Write a beatmap as a .osu file, to a path or to an open text file. Every
+    section goes out in a single write.
+    """
+    if isinstance(file, str):
+        with open(file, 'w', encoding='utf-8', newline='', buffering=WRITE_BUFFER_SIZE) as f:
+            f.writelines(beatmap_sections(beatmap))
+    else:
+        file.writelines(beatmap_sections(beatmap))
+
+def beatmap_filename(beatmap: Beatmap) -> str:
+    """
+    The file name the osu! editor gives a difficulty: "Artist - Title (Creator) [Version].osu",
+    minus characters that are not allowed in file names.
+    """
+    metadata = beatmap.metadata
+    name = f"{metadata.Artist} - {metadata.Title} ({metadata.Creator}) [{metadata.Version}].osu"
+    return re.sub(r'[\\/:*?"<>|]', '', name)
+
+class OszWriter:
+    """
+    Streams beatmaps into a .osz archive (a zip file) one at a time, so
+    thousands of generated difficulties never have to be held in memory or
+    written out as loose files first.
+
+    with OszWriter('set.osz') as osz:
+        osz.add_file('song/audio.mp3', 'audio.mp3')
+        for beatmap in generated:
+            osz.add_beatmap(beatmap)
+    """
+
+    def __init__(self, path: str, compression: int = zipfile.ZIP_DEFLATED):
+        self.zip: zipfile.ZipFile = zipfile.ZipFile(path, 'w', compression=compression)
+        self.names: set = set()
+
+    def _unique(self, name: str) -> str:
+        stem, ext = os.path.splitext(name)
+        unique, i = name, 1
+        while unique in self.names:
+            unique, i = f"{stem} ({i}){ext}", i + 1
+        self.names.add(unique)
+        return unique
+
+    def add_beatmap(self, beatmap: Beatmap, name: Optional[str] = None) -> str:
+        """
+        Add a beatmap, by default as beatmap_filename(beatmap). Returns the name
+        used inside the archive, made unique if it was already taken.
+        """
+        name = self._unique(name or beatmap_filename(beatmap))
+        with self.zip.open(name, 'w') as raw, \
+                io.TextIOWrapper(io.BufferedWriter(raw, WRITE_BUFFER_SIZE), encoding='utf-8', newline='') as file:
+            write_beatmap(beatmap, file)
+        return name
+
+    def add_file(self, path: str, name: Optional[str] = None) -> str:
+        """
+        Add a file (audio, background...) to the archive.
+        """
+        name = self._unique(name or os.path.basename(path))
+        self.zip.write(path, name)
+        return name
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self) -> 'OszWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_osz(
+    path: str,
+    beatmaps: Iterable[Beatmap],
+    files: Iterable[str] = ()
+) -> List[str]:
+    """
+    Write a .osz archive with the given beatmaps (consumed lazily) and extra files.
+
+    Returns:
+    - List[str] - The names of the .osu files inside the archive.
+    """
+    with OszWriter(path) as osz:
+        for file in files:
+            osz.add_file(file)
+        return [osz.add_beatmap(beatmap) for beatmap in beatmaps]